@@ -248,6 +248,11 @@ if (typeof JSON !== "object") {
   var GITHUB_RAW_URL =
     "https://raw.githubusercontent.com/JavierJerezAntonetti/AE-WhisperX-Local-Transcriber/main/SubtitlesGeneratorWhisper.jsx";
   var WHISPER_API_URL = "http://127.0.0.1:5000/transcribe";
+  var WHISPER_JOBS_URL = "http://127.0.0.1:5000/jobs";
+  var JOB_POLL_INTERVAL_MS = 1000; // How often a running transcription job is polled
+  // The progress window handles clicks (Cancel) this often between polls
+  var JOB_UI_CHECK_INTERVAL_MS = 100;
+  var JOB_POLL_TIMEOUT_SECONDS = 5; // Longest a single status request may block
   // Name of the script shown in update messages
   var SCRIPT_NAME = "AE Whisper X Local Transcriber";
 
@@ -479,51 +484,8 @@ if (typeof JSON !== "object") {
     return combinedSegments;
   };
 
-  // --- Helper Function to Make API Call ---
-  var makeApiCall = function (
-    audioFile,
-    transcriptionLevel,
-    scriptTempFolder,
-    geminiApiKey,
-    languageCode,
-  ) {
-    var responseFilePath =
-      scriptTempFolder.fsName +
-      "/" +
-      transcriptionLevel +
-      "_" +
-      TEMP_RESPONSE_FILENAME;
-    var responseFile = new File(responseFilePath);
-    if (responseFile.exists) responseFile.remove();
-
-    var audioPathForCurl = audioFile.fsName.replace(/\\/g, "/");
-    var responsePathForCurl = responseFile.fsName.replace(/\\/g, "/");
-    var curlCommand =
-      'curl -s -S -X POST -F "audio=@\\"' +
-      audioPathForCurl +
-      '\\"" -F "transcription_level=' +
-      transcriptionLevel +
-      '"';
-
-    // Add Language Code if provided
-    if (languageCode && languageCode.trim() !== "") {
-      curlCommand += ' -F "language=' + languageCode.trim() + '"';
-    }
-
-    // Add Gemini API key if provided (for sentence-level splitting)
-    if (
-      geminiApiKey &&
-      geminiApiKey.trim() !== "" &&
-      transcriptionLevel === "sentence"
-    ) {
-      // Escape the API key for curl (handle special characters)
-      var escapedApiKey = geminiApiKey.replace(/"/g, '\\"');
-      curlCommand += ' -F "gemini_api_key=' + escapedApiKey + '"';
-    }
-
-    curlCommand +=
-      ' "' + WHISPER_API_URL + '" -o "' + responsePathForCurl + '"';
-
+  // --- Helper Function to Run a curl Command ---
+  var runCurlCommand = function (curlCommand) {
     var systemCallResult = "";
     try {
       if ($.os.indexOf("Windows") > -1) {
@@ -541,7 +503,107 @@ if (typeof JSON !== "object") {
           curlCommand,
       );
     }
+    return systemCallResult;
+  };
+
+  // --- Helper Functions to Decode the Compact "format=columnar" Response ---
+  // The numeric arrays come first in the response, so they are sliced out and
+  // split directly instead of going through the (slow) JSON.parse; only the
+  // remaining text fields are parsed as JSON.
+  var COLUMNAR_NUMERIC_KEYS = [
+    "segment_start",
+    "segment_end",
+    "segment_word_offsets",
+    "word_start",
+    "word_end",
+    "word_score",
+  ];
+
+  var extractNumberArray = function (text, key, columns) {
+    var marker = '"' + key + '":[';
+    var begin = text.indexOf(marker);
+    if (begin === -1) return text;
+    var bodyStart = begin + marker.length;
+    var bodyEnd = text.indexOf("]", bodyStart);
+    var body = text.substring(bodyStart, bodyEnd);
+    var values = [];
+    if (body.length > 0) {
+      var parts = body.split(",");
+      for (var i = 0; i < parts.length; i++) {
+        values.push(parseInt(parts[i], 10));
+      }
+    }
+    columns[key] = values;
+    return text.substring(0, bodyStart) + text.substring(bodyEnd);
+  };
+
+  var columnarSeconds = function (milliseconds) {
+    return milliseconds < 0 ? undefined : milliseconds / 1000;
+  };
+
+  var expandColumnarResult = function (data, columns) {
+    var result = {};
+    for (var key in data) {
+      if (data.hasOwnProperty(key)) result[key] = data[key];
+    }
+    var offsets = columns.segment_word_offsets;
+    var segments = [];
+    for (var i = 0; i < columns.segment_start.length; i++) {
+      var segment = {
+        text: data.segment_text[i],
+        start: columnarSeconds(columns.segment_start[i]),
+        end: columnarSeconds(columns.segment_end[i]),
+      };
+      if (data.has_words) {
+        segment.words = [];
+        for (var j = offsets[i]; j < offsets[i + 1]; j++) {
+          segment.words.push({
+            word: data.words[j],
+            start: columnarSeconds(columns.word_start[j]),
+            end: columnarSeconds(columns.word_end[j]),
+            score:
+              columns.word_score[j] < 0
+                ? undefined
+                : columns.word_score[j] / 1000,
+          });
+        }
+      }
+      if (data.segment_id) segment.id = data.segment_id[i];
+      if (data.segment_words_error && data.segment_words_error[i]) {
+        segment.words_error = data.segment_words_error[i];
+      }
+      if (data.segment_split_error && data.segment_split_error[i]) {
+        segment.split_error = data.segment_split_error[i];
+      }
+      segments.push(segment);
+    }
+    result.segments = segments;
+    return result;
+  };
+
+  var parseApiResponse = function (text) {
+    if (text.indexOf('"format":"columnar"') === -1) return JSON.parse(text);
 
+    var columns = {};
+    for (var i = 0; i < COLUMNAR_NUMERIC_KEYS.length; i++) {
+      text = extractNumberArray(text, COLUMNAR_NUMERIC_KEYS[i], columns);
+    }
+    var data = JSON.parse(text);
+    if (data.result && data.result.format === "columnar") {
+      data.result = expandColumnarResult(data.result, columns);
+    } else if (data.format === "columnar") {
+      data = expandColumnarResult(data, columns);
+    }
+    return data;
+  };
+
+  // --- Helper Function to Read the JSON Response Written by curl ---
+  var readJsonResponse = function (
+    responseFile,
+    curlCommand,
+    systemCallResult,
+    apiUrl,
+  ) {
     if (!responseFile.exists || responseFile.length === 0) {
       throw new Error(
         "API call failed or produced no response file (or empty file). \n" +
@@ -552,15 +614,15 @@ if (typeof JSON !== "object") {
           systemCallResult +
           "'\n" +
           "Check if your Python Whisper API server is running at " +
-          WHISPER_API_URL +
+          apiUrl +
           ".\n" +
           "Expected response file at: " +
-          responseFilePath,
+          responseFile.fsName,
       );
     }
 
     // Parse JSON response
-    var transcriptionData;
+    var responseData;
     var responseContent = "";
     try {
       responseFile.open("r");
@@ -573,7 +635,7 @@ if (typeof JSON !== "object") {
             responseContent.substring(0, 200),
         );
       }
-      transcriptionData = JSON.parse(responseContent);
+      responseData = parseApiResponse(responseContent);
     } catch (e_json) {
       throw new Error(
         "Error parsing API response: " +
@@ -584,7 +646,203 @@ if (typeof JSON !== "object") {
       );
     }
 
-    return transcriptionData;
+    return responseData;
+  };
+
+  // --- Helper Functions for the Job Progress Window ---
+  var createJobProgressWindow = function (transcriptionLevel) {
+    var progressWin = new Window("palette", "Whisper Transcription");
+    progressWin.orientation = "column";
+    progressWin.alignChildren = ["fill", "top"];
+    progressWin.cancelRequested = false;
+    progressWin.statusText = progressWin.add(
+      "statictext",
+      undefined,
+      "Queued (" + transcriptionLevel + ")...",
+    );
+    progressWin.statusText.preferredSize.width = 320;
+    progressWin.progressBar = progressWin.add(
+      "progressbar",
+      undefined,
+      0,
+      100,
+    );
+    var cancelBtn = progressWin.add("button", undefined, "Cancel");
+    cancelBtn.onClick = function () {
+      progressWin.cancelRequested = true;
+      progressWin.statusText.text = "Cancelling...";
+    };
+    progressWin.show();
+    return progressWin;
+  };
+
+  var updateJobProgressWindow = function (progressWin, jobData) {
+    if (progressWin.cancelRequested) return;
+    var statusLine =
+      (jobData.stage || jobData.status) +
+      " - " +
+      Math.round(jobData.percent || 0) +
+      "%";
+    if (typeof jobData.eta_seconds === "number") {
+      statusLine += " (about " + Math.ceil(jobData.eta_seconds) + "s left)";
+    }
+    progressWin.statusText.text = statusLine;
+    progressWin.progressBar.value = jobData.percent || 0;
+    progressWin.update();
+  };
+
+  // --- Helper Function to Poll a Transcription Job Until it Finishes ---
+  var waitForJob = function (jobData, responseFile, transcriptionLevel) {
+    var statusUrl = WHISPER_JOBS_URL + "/" + jobData.job_id;
+    // Cancels only this request's interest when an identical job is shared
+    var cancelUrl =
+      statusUrl + (jobData.waiter_id ? "?waiter_id=" + jobData.waiter_id : "");
+    var responsePathForCurl = responseFile.fsName.replace(/\\/g, "/");
+    var pollCommand =
+      "curl -s -S --max-time " +
+      JOB_POLL_TIMEOUT_SECONDS +
+      ' "' +
+      statusUrl +
+      '?format=columnar" -o "' +
+      responsePathForCurl +
+      '"';
+
+    var progressWin = createJobProgressWindow(transcriptionLevel);
+    try {
+      while (jobData.status === "queued" || jobData.status === "running") {
+        updateJobProgressWindow(progressWin, jobData);
+        if (progressWin.cancelRequested) {
+          if (responseFile.exists) responseFile.remove();
+          runCurlCommand(
+            "curl -s -S --max-time " +
+              JOB_POLL_TIMEOUT_SECONDS +
+              ' -X DELETE "' +
+              cancelUrl +
+              '" -o "' +
+              responsePathForCurl +
+              '"',
+          );
+          throw new Error("Transcription cancelled.");
+        }
+        // Sleep in short steps, letting the window handle a Cancel click
+        for (
+          var waited = 0;
+          waited < JOB_POLL_INTERVAL_MS && !progressWin.cancelRequested;
+          waited += JOB_UI_CHECK_INTERVAL_MS
+        ) {
+          $.sleep(JOB_UI_CHECK_INTERVAL_MS);
+          progressWin.update();
+        }
+        if (progressWin.cancelRequested) continue;
+        if (responseFile.exists) responseFile.remove();
+        jobData = readJsonResponse(
+          responseFile,
+          pollCommand,
+          runCurlCommand(pollCommand),
+          statusUrl,
+        );
+      }
+    } finally {
+      progressWin.close();
+    }
+
+    if (jobData.status === "done" && jobData.result) {
+      return jobData.result;
+    }
+    throw new Error(
+      "Transcription job " +
+        jobData.status +
+        ": " +
+        (jobData.error || "the API returned no result."),
+    );
+  };
+
+  // --- Helper Function to Make API Call ---
+  var makeApiCall = function (
+    audioFile,
+    transcriptionLevel,
+    scriptTempFolder,
+    geminiApiKey,
+    languageCode,
+  ) {
+    var responseFilePath =
+      scriptTempFolder.fsName +
+      "/" +
+      transcriptionLevel +
+      "_" +
+      TEMP_RESPONSE_FILENAME;
+    var responseFile = new File(responseFilePath);
+    if (responseFile.exists) responseFile.remove();
+
+    var audioPathForCurl = audioFile.fsName.replace(/\\/g, "/");
+    var responsePathForCurl = responseFile.fsName.replace(/\\/g, "/");
+    var formFields =
+      ' -F "audio=@\\"' +
+      audioPathForCurl +
+      '\\"" -F "transcription_level=' +
+      transcriptionLevel +
+      '" -F "format=columnar"';
+
+    // Add Language Code if provided
+    if (languageCode && languageCode.trim() !== "") {
+      formFields += ' -F "language=' + languageCode.trim() + '"';
+    }
+
+    // Add Gemini API key if provided (for sentence-level splitting)
+    if (
+      geminiApiKey &&
+      geminiApiKey.trim() !== "" &&
+      (transcriptionLevel === "sentence" || transcriptionLevel === "both")
+    ) {
+      // Escape the API key for curl (handle special characters)
+      var escapedApiKey = geminiApiKey.replace(/"/g, '\\"');
+      formFields += ' -F "gemini_api_key=' + escapedApiKey + '"';
+    }
+
+    // Submit a background job so long files don't hold one request open
+    var submitCommand =
+      "curl -s -S -X POST" +
+      formFields +
+      ' "' +
+      WHISPER_JOBS_URL +
+      '" -o "' +
+      responsePathForCurl +
+      '"';
+    var jobData = null;
+    try {
+      jobData = readJsonResponse(
+        responseFile,
+        submitCommand,
+        runCurlCommand(submitCommand),
+        WHISPER_JOBS_URL,
+      );
+    } catch (e_submit) {
+      jobData = null;
+    }
+
+    if (jobData && jobData.job_id) {
+      return waitForJob(jobData, responseFile, transcriptionLevel);
+    }
+    if (jobData && jobData.error) {
+      throw new Error("API Error: " + jobData.error);
+    }
+
+    // Older API without the /jobs endpoints: single blocking request
+    if (responseFile.exists) responseFile.remove();
+    var curlCommand =
+      "curl -s -S -X POST" +
+      formFields +
+      ' "' +
+      WHISPER_API_URL +
+      '" -o "' +
+      responsePathForCurl +
+      '"';
+    return readJsonResponse(
+      responseFile,
+      curlCommand,
+      runCurlCommand(curlCommand),
+      WHISPER_API_URL,
+    );
   };
 
   // --- Main Transcription Function ---
@@ -738,21 +996,26 @@ if (typeof JSON !== "object") {
           useSeparateTextLayers &&
           selectedTranscriptionLevel === "sentence"
         ) {
-          // Make TWO API calls: one for word-level timing, one for sentence-level text
+          // Single "both" call: the server transcribes and aligns once and
+          // returns sentence segments with their matched word timings.
           transcriptionData = makeApiCall(
             audioFile,
-            "word",
-            scriptTempFolder,
-            "",
-            languageCode,
-          );
-          sentenceData = makeApiCall(
-            audioFile,
-            "sentence",
+            "both",
             scriptTempFolder,
             geminiApiKey,
             languageCode,
           );
+          if (transcriptionData.transcription_level !== "both") {
+            // Older API without "both" support: make TWO API calls, one for
+            // word-level timing and one for sentence-level text
+            sentenceData = makeApiCall(
+              audioFile,
+              "sentence",
+              scriptTempFolder,
+              geminiApiKey,
+              languageCode,
+            );
+          }
         } else {
           // Normal mode: single API call
           var apiKeyToUse =
@@ -788,7 +1051,15 @@ if (typeof JSON !== "object") {
       var processedSegments;
       var isSeparateMode = false;
 
-      if (useSeparateTextLayers && sentenceData) {
+      if (
+        useSeparateTextLayers &&
+        transcriptionData &&
+        transcriptionData.transcription_level === "both"
+      ) {
+        // Sentence segments already carry server-matched word timings
+        processedSegments = transcriptionData.segments;
+        isSeparateMode = true;
+      } else if (useSeparateTextLayers && sentenceData) {
         try {
           processedSegments = combineSeparateTextLayers(
             transcriptionData,
@@ -0,0 +1,543 @@
+"""
+Benchmark harness for whisperAPI.py.
+
+Generates synthetic audio of the requested lengths, sends it through
+/transcribe with the Flask test client and times the pieces of the pipeline
+that do not depend on the speech model: request overhead (upload, hashing,
+job dispatch, serialization), segment chunking for sentence splitting,
+sentence timing from aligned words and the size and encode time of the JSON
+response.
+
+By default whisperx and the Gemini client are replaced by deterministic fakes,
+so the numbers only reflect the server's own code and are comparable between
+versions. --real-model runs the installed whisperx instead when the model
+weights are available locally (the sentence splitter stays fake).
+
+Usage:
+    python benchmarks/benchmark_pipeline.py
+    python benchmarks/benchmark_pipeline.py --durations 60,600 --output bench.json
+    python benchmarks/benchmark_pipeline.py --compare bench.json
+    python benchmarks/benchmark_pipeline.py --real-model --model small --durations 60
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 16000
+DEFAULT_DURATIONS = "60,3600,36000"  # 1 minute, 1 hour, 10 hours
+BENCHMARK_SEED = 1234
+# Metrics checked by --compare; higher is worse for all of them
+COMPARED_METRICS = (
+    "request_seconds",
+    "pipeline_seconds",
+    "request_overhead_seconds",
+    "chunking_seconds",
+    "sentence_timing_seconds",
+    "word_attach_seconds",
+    "json_encode_seconds",
+    "jsonify_seconds",
+)
+
+FAKE_WORDS = (
+    "so the idea is that we keep the story simple and let the pictures do "
+    "most of the work because nobody wants to read a wall of text while the "
+    "music is playing and the cuts are fast but when it matters we slow down "
+    "and give every line enough time on screen"
+).split()
+
+
+# --- Fakes ------------------------------------------------------------------
+
+
+def _fake_segment_text(rng):
+    words = [rng.choice(FAKE_WORDS) for _ in range(rng.randint(6, 14))]
+    if len(words) > 8:
+        words[rng.randint(3, len(words) - 4)] += ","
+    words[0] = words[0].capitalize()
+    return " " + " ".join(words) + "."
+
+
+class FakeWhisperModel:
+    """Emits one segment per 4 seconds of audio with 0.5 s pauses in between."""
+
+    def __init__(self, model_size):
+        self.model_size = model_size
+
+    def detect_language(self, audio):
+        return "en"
+
+    def transcribe(self, audio, batch_size=16, language=None, **kwargs):
+        duration = len(audio) / SAMPLE_RATE
+        rng = random.Random(BENCHMARK_SEED)
+        segments = []
+        start = 0.0
+        while start < duration - 0.5:
+            end = min(start + 4.0, duration)
+            segments.append(
+                {
+                    "text": _fake_segment_text(rng),
+                    "start": round(start, 3),
+                    "end": round(end, 3),
+                }
+            )
+            start = end + 0.5
+        return {"segments": segments, "language": language or "en"}
+
+
+def _fake_load_audio(path, sr=SAMPLE_RATE):
+    # Map the samples instead of decoding them: the fakes only need the length,
+    # and ten hours of float32 audio would not fit in memory on small machines
+    with wave.open(path, "rb") as wav:
+        frames = wav.getnframes()
+    data_offset = os.path.getsize(path) - frames * 2
+    return np.memmap(path, dtype=np.int16, mode="r", offset=data_offset)
+
+
+def _fake_align(segments, model, metadata, audio, device, **kwargs):
+    aligned = []
+    for seg in segments:
+        tokens = seg["text"].split()
+        step = (seg["end"] - seg["start"]) / max(len(tokens), 1)
+        words = [
+            {
+                "word": token,
+                "start": round(seg["start"] + i * step, 3),
+                "end": round(seg["start"] + (i + 1) * step, 3),
+                "score": 0.9,
+            }
+            for i, token in enumerate(tokens)
+        ]
+        aligned.append(
+            {
+                "text": seg["text"],
+                "start": seg["start"],
+                "end": seg["end"],
+                "words": words,
+            }
+        )
+    return {
+        "segments": aligned,
+        "word_segments": [w for seg in aligned for w in seg["words"]],
+    }
+
+
+def make_fake_whisperx():
+    module = types.ModuleType("whisperx")
+    module.load_model = lambda model_size, **kwargs: FakeWhisperModel(model_size)
+    module.load_audio = _fake_load_audio
+    module.load_align_model = lambda language_code, **kwargs: (
+        object(),
+        {"language": language_code},
+    )
+    module.align = _fake_align
+    return module
+
+
+class FakeSplitClient:
+    """Stands in for Gemini: splits the prompt's text every 7 to 10 words."""
+
+    model_name = "benchmark-fake-splitter"
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+
+    def generate(self, prompt):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        match = re.search(
+            r"Transcription text \(in [^)]*\):\n(.*)\n\nReturn the JSON array",
+            prompt,
+            re.S,
+        )
+        words = match.group(1).split() if match else []
+        lines = []
+        i = 0
+        while i < len(words):
+            size = 7 + (i // 7) % 4
+            lines.append(" ".join(words[i : i + size]).rstrip(".,"))
+            i += size
+        return json.dumps(lines)
+
+
+# --- Setup ------------------------------------------------------------------
+
+
+def load_server(real_model, workdir, split_latency):
+    """Import whisperAPI with its temp folders in workdir and fakes installed."""
+    tempfile.tempdir = workdir
+    if not real_model:
+        sys.modules["whisperx"] = make_fake_whisperx()
+    sys.path.insert(0, REPO_DIR)
+    with quiet():
+        import whisperAPI
+
+    split_client = FakeSplitClient(split_latency)
+    whisperAPI.make_split_client = lambda gemini_api_key: split_client
+    whisperAPI.gemini_rate_limiter = whisperAPI.TokenBucket(0, 1)
+    # Caches would turn every repetition after the first into a cache hit
+    whisperAPI.split_cache = None
+    whisperAPI.audio_cache = None
+    return whisperAPI, split_client
+
+
+def real_model_available(model_size):
+    """Whether whisperx is installed and the faster-whisper weights are cached."""
+    try:
+        import whisperx  # noqa: F401
+    except ImportError:
+        return False, "whisperx is not installed"
+    hub_dir = os.environ.get("HF_HUB_CACHE") or os.path.join(
+        os.environ.get("HF_HOME")
+        or os.path.join(os.path.expanduser("~"), ".cache", "huggingface"),
+        "hub",
+    )
+    if os.path.isdir(model_size):
+        return True, None
+    for repo in (
+        f"Systran/faster-whisper-{model_size}",
+        f"openai/whisper-{model_size}",
+    ):
+        if os.path.isdir(os.path.join(hub_dir, "models--" + repo.replace("/", "--"))):
+            return True, None
+    return False, f"no cached weights for '{model_size}' in {hub_dir}"
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Silence the server's progress prints while timing."""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def write_synthetic_audio(path, duration_seconds):
+    """
+    Write deterministic 16 kHz mono speech-like audio: 4 s of modulated tones
+    followed by 0.5 s of near silence, generated block by block.
+    """
+    rng = np.random.default_rng(BENCHMARK_SEED)
+    block_seconds = 60
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        written = 0
+        total = int(duration_seconds * SAMPLE_RATE)
+        while written < total:
+            count = min(block_seconds * SAMPLE_RATE, total - written)
+            t = (np.arange(written, written + count)) / SAMPLE_RATE
+            voiced = (t % 4.5) < 4.0
+            signal = 0.3 * np.sin(2 * np.pi * (180 + 40 * np.sin(t)) * t)
+            signal *= 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+            signal = np.where(voiced, signal, 0.0) + rng.normal(0, 0.003, count)
+            wav.writeframes((np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes())
+            written += count
+
+
+# --- Measurements -----------------------------------------------------------
+
+
+def timed(fn, repeat, verbose=False):
+    """Run fn repeat times; returns (timing summary, last return value)."""
+    samples = []
+    value = None
+    for _ in range(repeat):
+        with quiet(not verbose):
+            start = time.perf_counter()
+            value = fn()
+            samples.append(time.perf_counter() - start)
+    return summarize(samples), value
+
+
+def summarize(samples):
+    return {
+        "min": round(min(samples), 6),
+        "median": round(statistics.median(samples), 6),
+        "max": round(max(samples), 6),
+        "runs": len(samples),
+    }
+
+
+def post_transcribe(client, audio_path, form):
+    with open(audio_path, "rb") as f:
+        data = dict(form, audio=(f, os.path.basename(audio_path)))
+        response = client.post(
+            "/transcribe", data=data, content_type="multipart/form-data"
+        )
+        body = response.get_data()
+    if response.status_code != 200:
+        raise RuntimeError(f"/transcribe returned {response.status_code}: {body[:300]}")
+    return body
+
+
+def benchmark_case(server, split_client, audio_path, duration, level, args):
+    client = server.app.test_client()
+    form = {"transcription_level": level, "cache": "0", "model": args.model}
+    options = {
+        "model": args.model,
+        "language": args.language,
+        "transcription_level": level,
+        "gemini_api_key": "",
+        "splitter": args.splitter,
+    }
+    if level != "word" and args.splitter == "gemini":
+        form["gemini_api_key"] = options["gemini_api_key"] = "benchmark"
+    form["splitter"] = args.splitter
+    if args.language:
+        form["language"] = args.language
+
+    case = {"audio_seconds": duration, "transcription_level": level}
+
+    request_time, body = timed(
+        lambda: post_transcribe(client, audio_path, form), args.repeat, args.verbose
+    )
+    pipeline_time, result = timed(
+        lambda: server.run_transcription_pipeline(audio_path, options),
+        args.repeat,
+        args.verbose,
+    )
+    case["request_seconds"] = request_time
+    case["pipeline_seconds"] = pipeline_time
+    case["request_overhead_seconds"] = round(
+        request_time["median"] - pipeline_time["median"], 6
+    )
+    case["real_time_factor"] = round(pipeline_time["median"] / duration, 6)
+    case["response_bytes"] = len(body)
+    case["segments"] = len(result["segments"])
+    case["words"] = sum(len(seg.get("words") or []) for seg in result["segments"])
+
+    json_time, encoded = timed(
+        lambda: json.dumps(result, ensure_ascii=False), args.repeat
+    )
+    case["json_bytes"] = len(encoded.encode("utf-8"))
+    case["json_encode_seconds"] = json_time
+    with server.app.app_context():
+        case["jsonify_seconds"], _ = timed(lambda: server.jsonify(result), args.repeat)
+
+    if level == "word":
+        return case
+
+    # Sentence splitting on aligned segments, isolated from the request
+    with quiet(not args.verbose):
+        audio = server.load_audio(audio_path)
+        raw = server.model_registry.get(args.model).transcribe(
+            audio, batch_size=server.BATCH_SIZE, language=args.language
+        )
+        aligned, _ = server.align_segments(
+            raw["segments"], audio, raw.get("language") or "en"
+        )
+    language = raw.get("language") or "en"
+
+    if args.splitter == "local":
+        case["chunking_seconds"], sentences = timed(
+            lambda: server.split_segments_locally(copy.deepcopy(aligned), language),
+            args.repeat,
+            args.verbose,
+        )
+    else:
+        case["chunking_seconds"], sentences = timed(
+            lambda: server.split_segments_with_gemini(
+                copy.deepcopy(aligned), "benchmark", language, client=split_client
+            ),
+            args.repeat,
+            args.verbose,
+        )
+    case["sentences"] = len(sentences)
+
+    combined_text = " ".join(seg["text"].strip() for seg in aligned)
+    sentence_texts = [seg["text"] for seg in sentences]
+    case["sentence_timing_seconds"], _ = timed(
+        lambda: server.time_sentences(sentence_texts, aligned, combined_text),
+        args.repeat,
+    )
+    if level == "both":
+        case["word_attach_seconds"], _ = timed(
+            lambda: server.attach_words_to_sentences(copy.deepcopy(sentences), aligned),
+            args.repeat,
+        )
+    return case
+
+
+def compare(results, baseline_path, tolerance):
+    """Print median ratios against a previous run; returns the regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {
+        (case["audio_seconds"], case["transcription_level"]): case
+        for case in baseline.get("cases", [])
+    }
+    regressions = []
+    print(f"\nComparison with {baseline_path} (tolerance {tolerance:.0%}):")
+    for case in results["cases"]:
+        key = (case["audio_seconds"], case["transcription_level"])
+        old = previous.get(key)
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            new_value, old_value = case.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            if isinstance(new_value, dict):
+                new_value, old_value = new_value["median"], old_value["median"]
+            if old_value <= 0:
+                continue
+            ratio = new_value / old_value
+            flag = ""
+            # Ignore sub-millisecond noise
+            if ratio > 1 + tolerance and new_value - old_value > 0.001:
+                flag = "  REGRESSION"
+                regressions.append((key, metric, ratio))
+            print(f"  {key[0]:>7}s {key[1]:<8} {metric:<26} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=REPO_DIR,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--durations",
+        default=DEFAULT_DURATIONS,
+        help="Comma-separated synthetic audio lengths in seconds",
+    )
+    parser.add_argument("--levels", default="word,sentence,both")
+    parser.add_argument("--splitter", choices=["gemini", "local"], default="gemini")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--model", default="large-v3")
+    parser.add_argument("--language", default="en")
+    parser.add_argument(
+        "--split-latency",
+        type=float,
+        default=0.0,
+        help="Simulated latency of every fake Gemini call in seconds",
+    )
+    parser.add_argument(
+        "--real-model",
+        action="store_true",
+        help="Use the installed whisperx instead of the fake (needs local weights)",
+    )
+    parser.add_argument(
+        "--audio",
+        help="Benchmark this audio file instead of synthetic audio (real-model mode)",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Previous JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.language = args.language or None
+    results = {
+        "benchmark": "transcription-pipeline",
+        "mode": "real" if args.real_model else "fake",
+        "git_revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "repeat": args.repeat,
+            "model": args.model,
+            "language": args.language,
+            "splitter": args.splitter,
+            "split_latency": args.split_latency,
+        },
+        "cases": [],
+    }
+
+    if args.real_model:
+        available, reason = real_model_available(args.model)
+        if not available:
+            print(f"Skipping real-model benchmark: {reason}.")
+            results["skipped"] = reason
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    json.dump(results, f, indent=2)
+            return 0
+
+    workdir = tempfile.mkdtemp(prefix="whisperapi-bench-")
+    try:
+        server, split_client = load_server(args.real_model, workdir, args.split_latency)
+        if args.audio:
+            audio_files = [(args.audio, None)]
+        else:
+            audio_files = []
+            for value in args.durations.split(","):
+                duration = float(value)
+                path = os.path.join(workdir, f"synthetic-{int(duration)}s.wav")
+                print(f"Generating {duration:.0f}s of synthetic audio...")
+                write_synthetic_audio(path, duration)
+                audio_files.append((path, duration))
+
+        for path, duration in audio_files:
+            if duration is None:
+                with quiet():
+                    duration = len(server.load_audio(path)) / SAMPLE_RATE
+            for level in args.levels.split(","):
+                print(f"Benchmarking {duration:.0f}s, level '{level}'...")
+                case = benchmark_case(server, split_client, path, duration, level, args)
+                results["cases"].append(case)
+                print(
+                    f"  request {case['request_seconds']['median']:.3f}s, "
+                    f"pipeline {case['pipeline_seconds']['median']:.3f}s, "
+                    f"overhead {case['request_overhead_seconds']:.3f}s, "
+                    f"JSON {case['json_bytes'] / 1e6:.2f} MB in "
+                    f"{case['json_encode_seconds']['median']:.3f}s"
+                )
+            if path.startswith(workdir):
+                os.remove(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
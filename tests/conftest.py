@@ -0,0 +1,87 @@
+"""
+Shared fixtures for the API tests: whisperAPI is imported once with the
+deterministic whisperx and sentence-splitter fakes of
+benchmarks/benchmark_pipeline.py, with its temp folders in a per-session
+directory, and every test gets empty caches.
+"""
+
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_benchmark():
+    spec = importlib.util.spec_from_file_location(
+        "benchmark_pipeline",
+        os.path.join(REPO_DIR, "benchmarks", "benchmark_pipeline.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bench = _load_benchmark()
+whisperx = bench.make_fake_whisperx()  # Installed as the whisperx module
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    tempfile.tempdir = str(tmp_path_factory.mktemp("server"))
+    sys.modules["whisperx"] = whisperx
+    sys.path.insert(0, REPO_DIR)
+    import whisperAPI
+
+    whisperAPI.gemini_rate_limiter = whisperAPI.TokenBucket(0, 1)
+    return whisperAPI
+
+
+@pytest.fixture(autouse=True)
+def caches(server, tmp_path, monkeypatch):
+    """Fresh, empty caches in tmp_path for every test."""
+    root = tmp_path / "cache"
+    monkeypatch.setattr(
+        server,
+        "result_cache",
+        server.DiskCache(str(root / "results"), 64 * 1024 * 1024, label="results"),
+    )
+    monkeypatch.setattr(server, "split_cache", None)
+    monkeypatch.setattr(
+        server,
+        "language_cache",
+        server.DiskCache(str(root / "languages"), 1024 * 1024, label="languages"),
+    )
+    monkeypatch.setattr(
+        server,
+        "audio_cache",
+        server.AudioCache(str(root / "audio"), 1024 * 1024 * 1024, label="audio"),
+    )
+    monkeypatch.setattr(server, "TRACE_DIR", str(tmp_path / "traces"))
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def make_wav(tmp_path):
+    """Write synthetic speech-like audio of the given length; returns its bytes."""
+
+    def make(seconds, name="clip.wav"):
+        path = tmp_path / name
+        bench.write_synthetic_audio(str(path), seconds)
+        return path.read_bytes()
+
+    return make
+
+
+def post_audio(client, path, data, filename="clip.wav", **form):
+    """POST data as the "audio" upload with the other form fields."""
+    form["audio"] = (io.BytesIO(data), filename)
+    return client.post(path, data=form, content_type="multipart/form-data")
@@ -0,0 +1,133 @@
+"""Alignment model pool: LRU eviction by count and bytes, prefetch, configuration."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import REPO_DIR, whisperx
+
+
+class FakeParameter:
+    def __init__(self, size_bytes):
+        self.size_bytes = size_bytes
+
+    def numel(self):
+        return self.size_bytes
+
+    def element_size(self):
+        return 1
+
+
+class FakeAlignModel:
+    def __init__(self, language, size_bytes):
+        self.language = language
+        self.size_bytes = size_bytes
+
+    def parameters(self):
+        return [FakeParameter(self.size_bytes)]
+
+
+class Loads(list):
+    """Languages in load order, with the sizes and gate of the fake loader."""
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Record alignment model loads; sizes[language] sets the model size."""
+    loaded = Loads()
+    sizes = {}
+    gate = threading.Event()
+    gate.set()
+
+    def load_align_model(language_code, **kwargs):
+        gate.wait(5)
+        loaded.append(language_code)
+        model = FakeAlignModel(language_code, sizes.get(language_code, 100))
+        return model, {"language": language_code}
+
+    monkeypatch.setattr(whisperx, "load_align_model", load_align_model)
+    loaded.sizes = sizes
+    loaded.gate = gate
+    return loaded
+
+
+def resident(pool):
+    return [entry["language"] for entry in pool.stats()["resident"]]
+
+
+def test_least_recently_used_model_is_evicted_by_count(server, loads):
+    pool = server.AlignModelPool(2)
+    pool.get("en")
+    pool.get("es")
+    model, metadata = pool.get("en")
+    pool.get("fr")
+
+    assert (model.language, metadata) == ("en", {"language": "en"})
+    assert resident(pool) == ["en", "fr"]
+    assert loads == ["en", "es", "fr"]
+    stats = pool.stats()
+    assert (stats["hits"], stats["loads"], stats["evictions"]) == (1, 3, 1)
+
+
+def test_models_are_evicted_by_bytes(server, loads):
+    loads.sizes.update({"en": 100, "es": 100, "fr": 100, "de": 1000})
+    pool = server.AlignModelPool(10, max_bytes=250)
+    for language in ("en", "es", "fr"):
+        pool.get(language)
+    assert resident(pool) == ["es", "fr"]
+    assert pool.stats()["resident_bytes"] == 200
+
+    # A model over the budget on its own still stays loaded
+    pool.get("de")
+    assert resident(pool) == ["de"]
+    assert pool.stats()["evictions"] == 3
+
+
+def test_prefetch_loads_in_background_once(server, loads):
+    pool = server.AlignModelPool(2)
+    loads.gate.clear()
+    pool.prefetch("en")
+    getter = threading.Thread(target=pool.get, args=("en",))
+    getter.start()
+    time.sleep(0.1)
+    assert resident(pool) == []
+
+    loads.gate.set()
+    getter.join(5)
+    deadline = time.monotonic() + 5
+    while resident(pool) != ["en"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert resident(pool) == ["en"]
+    assert loads == ["en"]
+    assert pool.stats()["hits"] == 1
+
+
+def test_pool_limits_from_env_and_command_line():
+    code = (
+        "import sys, whisperAPI\n"
+        "pool = whisperAPI.align_model_pool\n"
+        "print(pool.max_models, pool.max_bytes)\n"
+        "whisperAPI.apply_args(whisperAPI.parse_args(sys.argv[1:]))\n"
+        "config = whisperAPI.worker_process_config()\n"
+        "print(pool.max_models, pool.max_bytes, config['ALIGN_MODEL_POOL_SIZE'],"
+        " config['ALIGN_MODEL_POOL_MAX_BYTES'])\n"
+    )
+    env = dict(
+        os.environ,
+        WHISPERX_API_ALIGN_POOL_SIZE="5",
+        WHISPERX_API_ALIGN_POOL_MAX_BYTES="1000",
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code, "--align-pool-size", "1"]
+        + ["--align-pool-max-bytes", "2000"],
+        cwd=REPO_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.splitlines()[-2:] == ["5 1000", "1 2000 1 2000"]
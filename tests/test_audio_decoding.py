@@ -0,0 +1,81 @@
+"""In-memory and spooled decoding of WAV and raw PCM uploads."""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from conftest import bench
+
+
+def stereo_pcm(seconds):
+    rng = np.random.default_rng(0)
+    samples = rng.uniform(-0.3, 0.3, (seconds * bench.SAMPLE_RATE, 2))
+    return (samples * 32767).astype("<i2")
+
+
+@pytest.mark.parametrize(
+    "audio_format, bits, scale",
+    [("pcm_s16le", 16, 32768.0), ("pcm_f32le", 32, 1.0)],
+)
+def test_raw_pcm_is_mixed_down(server, audio_format, bits, scale):
+    dtype = server.RAW_AUDIO_FORMATS[audio_format]
+    frames = (np.random.default_rng(1).uniform(-0.5, 0.5, (50000, 2)) * scale).astype(
+        dtype
+    )
+    data = frames.tobytes()
+    expected = (frames.astype(np.float64) / scale).mean(axis=1)
+    audio = server.decode_audio_bytes(data, audio_format, channels=2)
+    assert np.allclose(audio, expected, atol=1e-6)
+    wav = server.wav_header(audio_format, bench.SAMPLE_RATE, 2, len(data)) + data
+    assert np.array_equal(server.decode_audio_bytes(wav, "wav"), audio)
+
+
+def test_24_bit_wav(server):
+    values = np.array([0, 1, -1, (1 << 23) - 1, -(1 << 23), 12345], np.int32)
+    data = b"".join(int(v).to_bytes(3, "little", signed=True) for v in values)
+    wav = bytearray(server.wav_header("pcm_s16le", bench.SAMPLE_RATE, 1, len(data)))
+    wav[32:36] = (3).to_bytes(2, "little") + (24).to_bytes(2, "little")
+    audio = server.decode_audio_bytes(bytes(wav) + data, "wav")
+    assert np.allclose(audio, values / float(1 << 23))
+
+
+def test_raw_body_peak_memory(server, client, monkeypatch):
+    monkeypatch.setattr(server, "audio_cache", None)
+    body = stereo_pcm(300).tobytes()
+    environ = EnvironBuilder(
+        path="/transcribe",
+        method="POST",
+        query_string={"audio_format": "pcm_s16le", "channels": "2", "language": "en"},
+        data=body,
+        content_type="application/octet-stream",
+    ).get_environ()
+    tracemalloc.start()
+    try:
+        response = client.open(environ)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert response.status_code == 200
+    # The body itself plus the mono float32 signal, which is the same size
+    assert peak < 2.5 * len(body)
+
+
+@pytest.mark.parametrize("audio_cache", [True, False])
+def test_large_raw_body_is_spooled(server, client, monkeypatch, capsys, audio_cache):
+    if not audio_cache:
+        monkeypatch.setattr(server, "audio_cache", None)
+    body = stereo_pcm(60).tobytes()
+    url = "/transcribe?audio_format=pcm_s16le&channels=2&language=en&cache=0"
+
+    def transcribe():
+        return client.post(url, data=body, content_type="application/octet-stream")
+
+    in_memory = transcribe()
+    assert "Decoded request body in memory" in capsys.readouterr().out
+    monkeypatch.setattr(server, "IN_MEMORY_UPLOAD_MAX_BYTES", len(body) // 4)
+    spooled = transcribe()
+    assert "Decoded request body in memory" not in capsys.readouterr().out
+    assert spooled.status_code == 200
+    assert spooled.json["segments"] == in_memory.json["segments"]
@@ -0,0 +1,108 @@
+"""/transcribe_batch: clip offsets in the shared pass, and its temp files."""
+
+import io
+import os
+import threading
+import time
+
+import numpy as np
+
+from conftest import whisperx
+
+
+def post_batch(client, clips, **form):
+    form["audio"] = [(io.BytesIO(data), name) for name, data in clips]
+    return client.post(
+        "/transcribe_batch", data=form, content_type="multipart/form-data"
+    )
+
+
+def test_clips_outlive_a_disconnected_client(server, client, make_wav, monkeypatch):
+    release = threading.Event()
+    opened = []
+    load_audio = whisperx.load_audio
+
+    def slow_load_audio(path, *args, **kwargs):
+        release.wait(5)
+        opened.append(path)
+        return load_audio(path, *args, **kwargs)
+
+    monkeypatch.setattr(whisperx, "load_audio", slow_load_audio)
+    monkeypatch.setattr(server, "client_disconnected", lambda: True)
+    monkeypatch.setattr(server, "CLIENT_DISCONNECT_POLL_SECONDS", 0.01)
+    response = post_batch(
+        client, [("a.mp3", make_wav(5, "a.wav")), ("b.mp3", make_wav(6, "b.wav"))]
+    )
+    assert response.status_code == 499
+    # The job still reads the clips after the request has returned
+    release.set()
+    for _ in range(200):
+        if len(opened) == 2 and not any(os.path.exists(p) for p in opened):
+            break
+        time.sleep(0.02)
+    assert len(opened) == 2
+    # and removes them once it has finished
+    assert not any(os.path.exists(p) for p in opened)
+
+
+class RegionModel:
+    """One segment per run of non-silent samples, named after its value."""
+
+    def transcribe(self, audio, batch_size=16, language=None):
+        audio = np.asarray(audio)
+        voiced = np.flatnonzero(audio)
+        runs = np.split(voiced, np.flatnonzero(np.diff(voiced) > 1) + 1)
+        rate = 16000
+        segments = [
+            {
+                "text": f"{audio[run[0]]:.1f}",
+                "start": run[0] / rate,
+                "end": (run[-1] + 1) / rate,
+            }
+            for run in runs
+            if len(run)
+        ]
+        return {"segments": segments, "language": language}
+
+
+def test_segments_go_back_to_their_clip(server):
+    rate = server.SAMPLE_RATE
+    clips = [
+        np.full(int(seconds * rate), value, dtype=np.float32)
+        for seconds, value in ((7.5, 0.1), (3.25, 0.2), (12.0, 0.3))
+    ]
+    language, clip_segments = server.transcribe_clips(RegionModel(), clips, "en")
+
+    assert language == "en"
+    for clip, segments in zip(clips, clip_segments):
+        assert segments == [
+            {"text": f"{clip[0]:.1f}", "start": 0.0, "end": len(clip) / rate}
+        ]
+
+
+def test_batch_results_match_their_files(client, make_wav):
+    response = post_batch(
+        client,
+        [
+            ("a.wav", make_wav(7, "a.wav")),
+            ("b.wav", make_wav(13, "b.wav")),
+            ("c.wav", make_wav(5, "c.wav")),
+        ],
+        language="en",
+    )
+    assert response.status_code == 200
+    data = response.get_json()
+    # One transcribe call for the three files
+    assert [(b["language"], b["files"]) for b in data["batches"]] == [("en", 3)]
+    for result, (name, seconds) in zip(
+        data["files"], (("a.wav", 7), ("b.wav", 13), ("c.wav", 5))
+    ):
+        assert result["filename"] == name
+        segments = result["segments"]
+        assert segments[0]["start"] < 4.5
+        assert all(0 <= seg["start"] <= seg["end"] <= seconds for seg in segments)
+        assert all(
+            0 <= word["start"] <= seconds
+            for seg in segments
+            for word in seg.get("words", [])
+        )
@@ -0,0 +1,161 @@
+"""format=columnar expands back to the object response."""
+
+import time
+
+from conftest import post_audio
+
+
+def seconds(milliseconds):
+    return None if milliseconds == -1 else milliseconds / 1000
+
+
+def expand(columnar):
+    """Rebuild the object segments from the columnar arrays."""
+    offsets = columnar["segment_word_offsets"]
+    segments = []
+    for i, text in enumerate(columnar["segment_text"]):
+        seg = {
+            "start": seconds(columnar["segment_start"][i]),
+            "end": seconds(columnar["segment_end"][i]),
+            "text": text,
+        }
+        if "segment_id" in columnar:
+            seg["id"] = columnar["segment_id"][i]
+        if columnar["has_words"]:
+            seg["words"] = [
+                {
+                    "word": columnar["words"][k],
+                    "start": seconds(columnar["word_start"][k]),
+                    "end": seconds(columnar["word_end"][k]),
+                    "score": (
+                        None
+                        if columnar["word_score"][k] == -1
+                        else columnar["word_score"][k] / 1000
+                    ),
+                }
+                for k in range(offsets[i], offsets[i + 1])
+            ]
+        for key in ("words_error", "split_error"):
+            errors = columnar.get(f"segment_{key}")
+            if errors and errors[i]:
+                seg[key] = errors[i]
+        segments.append(seg)
+    return segments
+
+
+def rounded(value, digits=3):
+    return None if value is None else round(value, digits)
+
+
+def normalize(segments, with_words=True):
+    """Object segments with times and scores at columnar precision."""
+    normalized = []
+    for seg in segments:
+        out = {
+            "start": rounded(seg.get("start")),
+            "end": rounded(seg.get("end")),
+            "text": seg.get("text", ""),
+        }
+        if "id" in seg:
+            out["id"] = seg["id"]
+        if with_words:
+            out["words"] = [
+                {
+                    "word": w.get("word", ""),
+                    "start": rounded(w.get("start")),
+                    "end": rounded(w.get("end")),
+                    "score": rounded(w.get("score")),
+                }
+                for w in seg.get("words") or []
+            ]
+        for key in ("words_error", "split_error"):
+            if seg.get(key):
+                out[key] = seg[key]
+        normalized.append(out)
+    return normalized
+
+
+def test_missing_values_and_segments_without_words(server):
+    result = {
+        "language": "en",
+        "segments": [
+            {
+                "start": 0.0,
+                "end": 1.2344,
+                "text": "Hello 20 dollars.",
+                "words": [
+                    {"word": "Hello", "start": 0.0, "end": 0.5, "score": 0.9876},
+                    {"word": "20"},
+                    {"word": "dollars.", "start": 0.8, "end": 1.2344, "score": None},
+                ],
+            },
+            {
+                "start": 1.5,
+                "end": 2.0,
+                "text": "♪",
+                "words": [],
+                "words_error": "Alignment failed.",
+            },
+            {"start": None, "end": 3.0, "text": "Bye.", "words": []},
+        ],
+        "full_text": "Hello 20 dollars. ♪ Bye.",
+    }
+    columnar = server.to_columnar(result)
+
+    assert columnar["segment_word_offsets"] == [0, 3, 3, 3]
+    assert columnar["word_start"] == [0, -1, 800]
+    assert columnar["word_score"] == [988, -1, -1]
+    assert columnar["segment_start"] == [0, 1500, -1]
+    assert "segment_id" not in columnar
+    assert "segment_split_error" not in columnar
+    assert columnar["language"] == "en"
+    assert columnar["full_text"] == result["full_text"]
+    assert expand(columnar) == normalize(result["segments"])
+
+
+def test_transcription_round_trips(server, client, make_wav):
+    audio = make_wav(12)
+    objects = post_audio(client, "/transcribe", audio, language="en").get_json()
+    response = post_audio(
+        client, "/transcribe", audio, language="en", format="columnar"
+    )
+    columnar = response.get_json()
+
+    assert response.status_code == 200
+    assert columnar["format"] == "columnar"
+    assert columnar["has_words"] is True
+    assert columnar["segment_word_offsets"][-1] == len(columnar["words"])
+    assert expand(columnar) == normalize(objects["segments"])
+    assert columnar["full_text"] == objects["full_text"]
+    assert columnar["language"] == objects["language"]
+    assert set(objects) - {"segments"} <= set(columnar)
+
+
+def test_sentence_segments_without_words_round_trip(server):
+    result = {
+        "segments": [{"start": 0.0, "end": 1.0, "text": "One.", "split_error": "x"}],
+        "full_text": "One.",
+    }
+    columnar = server.to_columnar(result)
+
+    assert columnar["has_words"] is False
+    assert columnar["segment_word_offsets"] == [0, 0]
+    assert expand(columnar) == normalize(result["segments"], with_words=False)
+
+
+def test_draft_results_keep_segment_ids(server, client, make_wav):
+    job = post_audio(
+        client, "/jobs", make_wav(12), draft_model="base", model="small"
+    ).get_json()
+    for _ in range(200):
+        status = client.get(f"/jobs/{job['job_id']}").get_json()
+        if status["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert status["status"] == "done"
+    columnar = client.get(f"/jobs/{job['job_id']}?format=columnar").get_json()
+
+    segments = status["result"]["segments"]
+    assert segments and all("id" in seg for seg in segments)
+    assert columnar["result"]["segment_id"] == [seg["id"] for seg in segments]
+    assert expand(columnar["result"]) == normalize(segments)
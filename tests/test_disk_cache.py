@@ -0,0 +1,93 @@
+"""DiskCache: shared directories, eviction, and entries that are in use."""
+
+import os
+
+import numpy as np
+
+from conftest import post_audio
+
+
+def test_entries_written_elsewhere_are_found(server, tmp_path):
+    directory = str(tmp_path / "shared")
+    first = server.DiskCache(directory, 1024 * 1024)
+    second = server.DiskCache(directory, 1024 * 1024)
+    first.put("key", {"value": 1})
+    assert second.get("key") == {"value": 1}
+
+
+def test_eviction_counts_every_writer(server, tmp_path):
+    value = {"text": "x" * 1000}
+    directory = tmp_path / "shared"
+    caches = [server.DiskCache(str(directory), 10_000) for _ in range(3)]
+    for i in range(30):
+        caches[i % 3].put(f"key{i}", value)
+    on_disk = sum(entry.stat().st_size for entry in os.scandir(directory))
+    assert on_disk <= 10_000
+    # The newest entries survive, whichever instance wrote them
+    assert all(caches[0].get(f"key{i}") == value for i in range(27, 30))
+
+
+def test_audio_entries_are_evicted_oldest_first(server, tmp_path):
+    audio = np.zeros(16000, dtype=np.float32)
+    cache = server.AudioCache(str(tmp_path / "audio"), 2 * audio.nbytes + 1000)
+    for key in ("a", "b", "c"):
+        cache.put(key, audio)
+    assert cache.get_path("a") is None
+    assert cache.get_path("b") and cache.get_path("c")
+    on_disk = sum(entry.stat().st_size for entry in os.scandir(tmp_path / "audio"))
+    assert cache.stats()["size_bytes"] == on_disk
+
+
+def test_entry_that_cannot_be_removed_stays_counted(server, tmp_path, monkeypatch):
+    directory = tmp_path / "audio"
+    audio = np.zeros(16000, dtype=np.float32)
+    cache = server.AudioCache(str(directory), 2 * audio.nbytes + 1000)
+    cache.put("a", audio)
+    cache.put("b", audio)
+    remove = os.remove
+
+    def locked_remove(path):
+        # Like Windows while another job maps the file
+        if os.path.basename(path) == "a.npy":
+            raise PermissionError(path)
+        remove(path)
+
+    monkeypatch.setattr(os, "remove", locked_remove)
+    cache.put("c", audio)
+    on_disk = sum(entry.stat().st_size for entry in os.scandir(directory))
+    assert cache.stats()["size_bytes"] == on_disk
+    assert (directory / "a.npy").exists() and not (directory / "b.npy").exists()
+
+    # Retried once the file is free again
+    monkeypatch.setattr(os, "remove", remove)
+    cache.put("d", audio)
+    assert sorted(os.listdir(directory)) == ["c.npy", "d.npy"]
+    assert cache.stats()["size_bytes"] == 2 * os.path.getsize(directory / "c.npy")
+
+
+def test_second_decode_keeps_the_mapped_entry(server, tmp_path, monkeypatch, make_wav):
+    upload = tmp_path / "upload.wav"
+    upload.write_bytes(make_wav(3))
+    first = server.decode_into_audio_cache(str(upload), "hash")
+    replace = os.replace
+
+    def windows_replace(src, dst):
+        # Windows refuses to replace a file that is mapped
+        if os.path.exists(dst):
+            raise PermissionError(dst)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", windows_replace)
+    second = server.decode_into_audio_cache(str(upload), "hash")
+    assert np.array_equal(first, second)
+    cache_dir = os.path.dirname(server.audio_cache.get_path("hash"))
+    assert os.listdir(cache_dir) == ["hash.npy"]
+
+
+def test_requests_share_the_decoded_audio(server, client, make_wav):
+    audio = make_wav(8)
+    for _ in range(2):
+        response = post_audio(client, "/transcribe", audio, language="en", cache="0")
+        assert response.status_code == 200
+    assert server.audio_cache.stats()["entries"] == 1
+    assert server.audio_cache.hits >= 1
@@ -0,0 +1,37 @@
+"""The refine pass of draft_model requests reuses the draft's language."""
+
+import time
+
+from conftest import bench, post_audio
+
+
+def test_refine_pass_uses_the_draft_language(server, client, make_wav, monkeypatch):
+    languages = []
+    transcribe = bench.FakeWhisperModel.transcribe
+
+    def recording_transcribe(self, audio, language=None, **kwargs):
+        languages.append((self.model_size, language))
+        return transcribe(self, audio, language=language, **kwargs)
+
+    probes = []
+    detect = server.detect_language
+
+    def counting_detect(whisper_model, audio):
+        probes.append(whisper_model.model_size)
+        return detect(whisper_model, audio)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "transcribe", recording_transcribe)
+    monkeypatch.setattr(server, "detect_language", counting_detect)
+    job = post_audio(
+        client, "/jobs", make_wav(12), draft_model="base", model="small"
+    ).get_json()
+    for _ in range(200):
+        status = client.get(f"/jobs/{job['job_id']}").get_json()
+        if status["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert status["status"] == "done"
+
+    assert probes == ["base"]
+    assert languages == [("base", "en"), ("small", "en")]
+    assert status["result"]["language_detection"]["language"] == "en"
@@ -0,0 +1,119 @@
+"""Cancelling /jobs jobs, while queued and while running."""
+
+import threading
+import time
+
+from conftest import bench, post_audio
+
+
+def wait_status(client, job_id, statuses):
+    for _ in range(250):
+        status = client.get(f"/jobs/{job_id}").get_json()
+        if status["status"] in statuses:
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} is still {status['status']}")
+
+
+def test_cancel_running_and_queued_jobs(client, make_wav, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    transcribe = bench.FakeWhisperModel.transcribe
+
+    def blocking_transcribe(self, audio, **kwargs):
+        started.set()
+        release.wait(5)
+        return transcribe(self, audio, **kwargs)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "transcribe", blocking_transcribe)
+    running = post_audio(client, "/jobs", make_wav(10), language="en").get_json()
+    assert started.wait(5)
+    queued = post_audio(
+        client, "/jobs", make_wav(12, "other.wav"), language="en"
+    ).get_json()
+    assert client.get(f"/jobs/{queued['job_id']}").get_json()["status"] == "queued"
+
+    # A queued job is cancelled at once
+    response = client.delete(f"/jobs/{queued['job_id']}")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "cancelled"
+
+    # A running one at its next progress report
+    client.delete(f"/jobs/{running['job_id']}")
+    release.set()
+    status = wait_status(client, running["job_id"], ("done", "failed", "cancelled"))
+    assert status["status"] == "cancelled"
+    assert client.get(f"/jobs/{running['job_id']}/result").status_code == 409
+
+    assert client.delete("/jobs/unknown").status_code == 404
+
+
+def test_one_of_two_joined_requests_cancels(client, make_wav, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    transcribe = bench.FakeWhisperModel.transcribe
+
+    def blocking_transcribe(self, audio, **kwargs):
+        started.set()
+        release.wait(5)
+        return transcribe(self, audio, **kwargs)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "transcribe", blocking_transcribe)
+    audio = make_wav(10)
+    first = post_audio(client, "/jobs", audio, language="en").get_json()
+    assert started.wait(5)
+    second = post_audio(client, "/jobs", audio, language="en").get_json()
+    assert second["job_id"] == first["job_id"]
+    assert second["waiter_id"] != first["waiter_id"]
+    job_url = f"/jobs/{first['job_id']}"
+
+    # Repeating the creator's Cancel (with or without its waiter_id) does not
+    # take the transcription away from the request that joined it
+    for query in (f"?waiter_id={first['waiter_id']}", "", ""):
+        response = client.delete(job_url + query)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["status"] == "running"
+        assert data["other_waiters"] == 1
+        assert "cancel_requested" not in data
+
+    response = client.delete(f"{job_url}?waiter_id={second['waiter_id']}")
+    assert response.get_json()["cancel_requested"] is True
+    release.set()
+    assert (
+        wait_status(client, first["job_id"], ("done", "cancelled"))["status"]
+        == "cancelled"
+    )
+
+
+def test_joined_transcribe_request_keeps_its_result(
+    server, client, make_wav, monkeypatch
+):
+    started, release = threading.Event(), threading.Event()
+    transcribe = bench.FakeWhisperModel.transcribe
+
+    def blocking_transcribe(self, audio, **kwargs):
+        started.set()
+        release.wait(5)
+        return transcribe(self, audio, **kwargs)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "transcribe", blocking_transcribe)
+    audio = make_wav(10)
+    job = post_audio(client, "/jobs", audio, language="en").get_json()
+    assert started.wait(5)
+    results = []
+    waiting = threading.Thread(
+        target=lambda: results.append(
+            post_audio(server.app.test_client(), "/transcribe", audio, language="en")
+        )
+    )
+    waiting.start()
+    for _ in range(250):
+        if len(server.job_manager.get(job["job_id"]).waiters) == 2:
+            break
+        time.sleep(0.02)
+
+    client.delete(f"/jobs/{job['job_id']}")
+    client.delete(f"/jobs/{job['job_id']}")
+    release.set()
+    waiting.join(5)
+    assert results[0].status_code == 200
+    assert results[0].get_json()["segments"]
@@ -0,0 +1,103 @@
+"""Language detection: speech probes, /detect_language and its cache."""
+
+import numpy as np
+
+from conftest import bench, post_audio
+
+
+def test_probe_joins_the_windows_with_most_speech(server):
+    rate = server.SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.001, 120 * rate).astype(np.float32)
+    t = np.arange(10 * rate) / rate
+    for start in (70, 30, 100):
+        audio[start * rate : (start + 10) * rate] += 0.3 * np.sin(2 * np.pi * 200 * t)
+
+    probe = server.speech_probe(audio)
+
+    expected = np.concatenate(
+        [audio[start * rate : (start + 10) * rate] for start in (30, 70, 100)]
+    )
+    assert np.array_equal(probe, expected)
+
+
+def test_short_audio_is_probed_whole(server):
+    audio = np.ones(25 * server.SAMPLE_RATE, np.float32)
+    assert len(server.speech_probe(audio)) == len(audio)
+
+
+def detected_probes(monkeypatch):
+    """Probes passed to the benchmark fake's detect_language."""
+    probes = []
+    detect = bench.FakeWhisperModel.detect_language
+
+    def recording_detect(self, audio):
+        probes.append(len(audio) / bench.SAMPLE_RATE)
+        return detect(self, audio)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "detect_language", recording_detect)
+    return probes
+
+
+def test_top_probabilities_are_returned(server, monkeypatch):
+    ranked = [("en", 0.81234), ("de", 0.1), ("nl", 0.05), ("fr", 0.02)]
+    ranked += [("es", 0.01), ("it", 0.005), ("pt", 0.001)]
+    monkeypatch.setattr(server, "_language_probabilities", lambda model, probe: ranked)
+    audio = np.zeros(60 * server.SAMPLE_RATE, np.float32)
+
+    detection = server.detect_language(bench.FakeWhisperModel("small"), audio)
+
+    assert detection == {
+        "language": "en",
+        "probability": 0.8123,
+        "probabilities": {"en": 0.8123, "de": 0.1, "nl": 0.05, "fr": 0.02, "es": 0.01},
+        "probe_seconds": 30.0,
+    }
+
+
+def test_fallback_detects_from_the_probe_only(server, monkeypatch):
+    probes = detected_probes(monkeypatch)
+    audio = np.zeros(60 * server.SAMPLE_RATE, np.float32)
+
+    detection = server.detect_language(bench.FakeWhisperModel("small"), audio)
+
+    assert probes == [30.0]
+    assert detection["language"] == "en"
+    assert detection["probability"] is None
+    assert detection["probabilities"] == {}
+
+
+def test_detection_is_cached(server, client, make_wav, monkeypatch):
+    probes = detected_probes(monkeypatch)
+    audio = make_wav(60)
+
+    first = post_audio(client, "/detect_language", audio)
+    second = post_audio(client, "/detect_language", audio)
+
+    assert first.status_code == second.status_code == 200
+    assert first.get_json()["language"] == "en"
+    assert first.get_json()["probe_seconds"] == 30.0
+    assert first.get_json()["cache_hit"] is False
+    assert second.get_json()["cache_hit"] is True
+    assert probes == [30.0]
+
+
+def test_transcribe_reuses_a_cached_detection(server, client, make_wav, monkeypatch):
+    probes = detected_probes(monkeypatch)
+    languages = []
+    transcribe = bench.FakeWhisperModel.transcribe
+
+    def recording_transcribe(self, audio, language=None, **kwargs):
+        languages.append(language)
+        return transcribe(self, audio, language=language, **kwargs)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "transcribe", recording_transcribe)
+    audio = make_wav(60)
+
+    assert post_audio(client, "/detect_language", audio).status_code == 200
+    response = post_audio(client, "/transcribe", audio)
+
+    assert response.status_code == 200
+    assert response.get_json()["language"] == "en"
+    assert probes == [30.0]
+    assert languages == ["en"]
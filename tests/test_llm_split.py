@@ -0,0 +1,201 @@
+"""Sentence splitting against a local fake LLM server: concurrency, order, retries."""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import REPO_DIR, bench
+
+
+class FakeLLMServer:
+    """
+    HTTP endpoint in the LLM_SPLIT_ENDPOINT format, answering with the
+    benchmark splitter. The first `failures` requests get a 500.
+    """
+
+    def __init__(self, latency=0.05, failures=0):
+        self.splitter = bench.FakeSplitClient(latency)
+        self.failures = failures
+        self.requests = []  # Arrival times
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with fake.lock:
+                    fake.requests.append(time.monotonic())
+                    fail = len(fake.requests) <= fake.failures
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                try:
+                    if fail:
+                        self.send_response(500)
+                        self.end_headers()
+                        return
+                    text = fake.splitter.generate(json.loads(body)["prompt"])
+                    payload = json.dumps({"text": text}).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                finally:
+                    with fake.lock:
+                        fake.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/split"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def llm(server, monkeypatch):
+    servers = []
+
+    def start(**kwargs):
+        fake = FakeLLMServer(**kwargs)
+        servers.append(fake)
+        monkeypatch.setattr(server, "LLM_SPLIT_ENDPOINT", fake.url)
+        return fake
+
+    yield start
+    for fake in servers:
+        fake.close()
+
+
+def make_segments(seconds, segment_seconds=10):
+    """Consecutive segments of five distinct words each."""
+    return [
+        {
+            "start": float(start),
+            "end": float(start + segment_seconds),
+            "text": " ".join(f"w{start}x{k}" for k in range(5)),
+        }
+        for start in range(0, seconds, segment_seconds)
+    ]
+
+
+def words_of(segments):
+    return " ".join(seg["text"] for seg in segments).split()
+
+
+def test_chunks_are_split_concurrently_and_kept_in_order(server, llm):
+    fake = llm(latency=0.2)
+    segments = make_segments(600)  # Five 120-second chunks
+    expected = words_of(segments)
+
+    result = server.split_segments_with_gemini(segments, None, "en")
+
+    assert len(fake.requests) == 5
+    assert 1 < fake.max_active <= server.GEMINI_MAX_CONCURRENCY
+    assert words_of(result) == expected
+    assert not any("split_error" in seg for seg in result)
+    assert all(a["start"] <= b["start"] for a, b in zip(result, result[1:]))
+    assert result[0]["start"] == 0.0 and result[-1]["end"] == 600.0
+
+
+def test_failed_chunk_is_retried(server, llm, monkeypatch):
+    monkeypatch.setattr(server, "GEMINI_RETRY_BASE_DELAY_SECONDS", 0)
+    fake = llm(failures=1)
+    segments = make_segments(60)
+    expected = words_of(segments)
+
+    result = server.split_segments_with_gemini(segments, None, "en")
+
+    assert len(fake.requests) == 2
+    assert words_of(result) == expected
+    assert not any("split_error" in seg for seg in result)
+
+
+def test_final_failure_marks_split_error(server, llm, monkeypatch):
+    monkeypatch.setattr(server, "GEMINI_RETRY_BASE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(server, "GEMINI_MAX_RETRIES", 1)
+    fake = llm(failures=1000)
+    segments = make_segments(240)  # Two chunks
+    texts = [seg["text"] for seg in segments]
+
+    result = server.split_segments_with_gemini(segments, None, "en")
+
+    assert len(fake.requests) == 4  # Two attempts per chunk
+    assert [seg["text"] for seg in result] == texts
+    assert all(seg["split_error"] == "Sentence splitting failed." for seg in result)
+
+
+def test_retries_back_off_exponentially(server, monkeypatch):
+    class FailingClient:
+        model_name = "failing"
+        calls = 0
+
+        def generate(self, prompt):
+            FailingClient.calls += 1
+            raise RuntimeError("quota exceeded")
+
+    sleeps = []
+    monkeypatch.setattr(server, "GEMINI_MAX_RETRIES", 3)
+    monkeypatch.setattr(server, "GEMINI_RETRY_BASE_DELAY_SECONDS", 1.0)
+    monkeypatch.setattr(server.random, "uniform", lambda low, high: 1.0)
+    monkeypatch.setattr(server.time, "sleep", sleeps.append)
+
+    assert server._call_gemini_split("one two", "en", FailingClient()) is None
+    assert FailingClient.calls == 4
+    assert sleeps == [1.0, 2.0, 4.0]
+
+
+def test_token_bucket_limits_the_rate(server):
+    bucket = server.TokenBucket(20, 2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # Two tokens from the burst, the other four at 20 per second
+    assert time.monotonic() - start >= 0.19
+
+
+def test_split_requests_respect_the_rate_limiter(server, llm, monkeypatch):
+    monkeypatch.setattr(server, "gemini_rate_limiter", server.TokenBucket(10, 1))
+    fake = llm(latency=0)
+
+    server.split_segments_with_gemini(make_segments(600), None, "en")
+
+    assert len(fake.requests) == 5
+    gaps = [b - a for a, b in zip(fake.requests, fake.requests[1:])]
+    assert sum(gaps) >= 0.38
+
+
+def test_endpoint_can_be_set_from_env_and_command_line(server):
+    code = (
+        "import sys, whisperAPI\n"
+        "print(whisperAPI.make_split_client(None).url)\n"
+        "whisperAPI.apply_args(whisperAPI.parse_args(sys.argv[1:]))\n"
+        "print(whisperAPI.make_split_client(None).url)\n"
+        "print(whisperAPI.worker_process_config()['LLM_SPLIT_ENDPOINT'])\n"
+    )
+    env = dict(os.environ, WHISPERX_API_LLM_SPLIT_ENDPOINT="http://env/split")
+    output = subprocess.run(
+        [sys.executable, "-c", code, "--llm-split-endpoint", "http://cli/split"],
+        cwd=REPO_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.splitlines()[-3:] == [
+        "http://env/split",
+        "http://cli/split",
+        "http://cli/split",
+    ]
@@ -0,0 +1,128 @@
+"""Rule-based sentence splitting (splitter=local)."""
+
+import pytest
+
+
+def aligned(text, pause_after=(), word_seconds=0.3, gap=0.05, pause=1.0):
+    """One aligned segment; words ending in sentence punctuation get a pause."""
+    words, time = [], 0.0
+    for token in text.split():
+        words.append({"word": token, "start": time, "end": time + word_seconds})
+        time += word_seconds + gap
+        if token.endswith((".", "?", "!")) or token in pause_after:
+            time += pause
+    return [{"text": text, "start": 0.0, "end": time, "words": words}]
+
+
+def split(server, text, language="en"):
+    lines = server.split_segments_locally(aligned(text), language)
+    return [line["text"].split() for line in lines]
+
+
+def test_lines_respect_the_word_limits(server):
+    text = " ".join(f"word{i}" for i in range(50)) + "."
+    lines = split(server, text)
+    assert sum(len(line) for line in lines) == 50
+    assert all(
+        server.LOCAL_SPLIT_MIN_WORDS <= len(line) <= server.LOCAL_SPLIT_MAX_WORDS
+        for line in lines
+    )
+
+
+def test_sentence_ends_without_an_orphan_line(server):
+    # The target length is reached two words before the sentence ends
+    text = (
+        "La casa que compramos el verano pasado era muy grande y bonita. "
+        "Ahora vivimos allí con nuestros hijos."
+    )
+    lines = split(server, text, "es")
+    assert lines[0][-1] == "bonita"
+    assert all(len(line) >= server.LOCAL_SPLIT_MIN_WORDS for line in lines)
+
+
+def test_short_sentence_end_joins_the_previous_line(server):
+    lines = split(
+        server, "one two three four five six seven eight nine ten eleven. Next one."
+    )
+    assert [len(line) for line in lines] == [11, 2]
+
+
+def test_long_sentence_end_is_rebalanced(server):
+    # Weak words push the first break to eleven words, two before the end
+    text = (
+        "one two three four five six seven eight of the big house today. "
+        "Next sentence starts here."
+    )
+    lines = split(server, text)
+    # Split evenly instead of leaving "house today" on its own
+    assert sorted(len(line) for line in lines[:2]) == [6, 7]
+    assert lines[1][-2:] == ["house", "today"]
+    assert lines[2] == ["Next", "sentence", "starts", "here"]
+
+
+@pytest.mark.parametrize(
+    "language, text",
+    [
+        (
+            "en",
+            "We walked for a long time through the quiet streets of the old "
+            "town and the tall houses with the red roofs until the evening.",
+        ),
+        (
+            "es",
+            "Caminamos durante mucho tiempo por las calles tranquilas de la "
+            "ciudad vieja y las casas altas con los tejados rojos hasta la noche.",
+        ),
+    ],
+)
+def test_lines_do_not_end_on_weak_words(server, language, text):
+    weak = server.LOCAL_SPLIT_WEAK_WORDS[language]
+    lines = split(server, text, language)
+    assert len(lines) > 1
+    assert all(line[-1].lower().strip(".,") not in weak for line in lines[:-1])
+
+
+@pytest.mark.parametrize(
+    "language, text, pair",
+    [
+        (
+            "en",
+            "After all these years of waiting for the right moment to say "
+            "it I finally told her the truth about everything.",
+            ("it", "I"),
+        ),
+        (
+            "es",
+            "Después de tantos años de espera lo que realmente nadie se "
+            "merece es esto que nos pasó ayer.",
+            ("se", "merece"),
+        ),
+    ],
+)
+def test_pronouns_stay_with_their_verb(server, language, text, pair):
+    glue = server.LOCAL_SPLIT_GLUE_WORDS[language]
+    lines = split(server, text, language)
+    assert len(lines) > 1
+    assert all(line[-1].lower() not in glue for line in lines[:-1])
+    pronoun, verb = pair
+    line = next(line for line in lines if pronoun in line)
+    assert line[line.index(pronoun) + 1] == verb
+
+
+def test_words_keep_their_order_and_times(server):
+    segments = aligned("Hello there. How are you doing today, my friend?")
+    lines = server.split_segments_locally(segments, "en")
+    assert " ".join(line["text"] for line in lines).split() == [
+        "Hello",
+        "there",
+        "How",
+        "are",
+        "you",
+        "doing",
+        "today,",
+        "my",
+        "friend?",
+    ]
+    words = segments[0]["words"]
+    assert lines[0]["start"] == words[0]["start"]
+    assert lines[-1]["end"] == words[-1]["end"]
@@ -0,0 +1,104 @@
+"""/metrics: Prometheus text output, worker-process merge, pipeline observations."""
+
+import pytest
+
+from conftest import post_audio
+
+
+@pytest.fixture
+def fresh_metrics(server, monkeypatch):
+    """An empty registry with the server's metric definitions."""
+    registry = server.Metrics()
+    registry._help = dict(server.metrics._help)
+    registry._buckets = dict(server.metrics._buckets)
+    monkeypatch.setattr(server, "metrics", registry)
+    return registry
+
+
+def make_registry(server):
+    registry = server.Metrics()
+    registry.define_histogram("test_seconds", "Test durations.", (0.1, 1, 10))
+    registry.define_counter("test_total", "Test events.")
+    return registry
+
+
+def test_histogram_buckets_sum_and_count(server):
+    registry = make_registry(server)
+    for value in (0.05, 0.5, 5, 50):
+        registry.observe("test_seconds", value, stage="decode")
+    registry.inc("test_total", result="hit", cache="results")
+    registry.inc("test_total", 2, result="hit", cache="results")
+
+    lines = registry.render().splitlines()
+    assert lines == [
+        "# HELP test_seconds Test durations.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="decode",le="0.1"} 1',
+        'test_seconds_bucket{stage="decode",le="1.0"} 2',
+        'test_seconds_bucket{stage="decode",le="10.0"} 3',
+        'test_seconds_bucket{stage="decode",le="+Inf"} 4',
+        'test_seconds_sum{stage="decode"} 55.55',
+        'test_seconds_count{stage="decode"} 4',
+        "# HELP test_total Test events.",
+        "# TYPE test_total counter",
+        'test_total{cache="results",result="hit"} 3',
+    ]
+
+
+def test_gauges_are_rendered_with_escaped_labels(server):
+    text = make_registry(server).render(
+        [("test_gauge", "A gauge.", [({"name": 'a "b"'}, 1.5)])]
+    )
+    assert text.endswith(
+        "# HELP test_gauge A gauge.\n"
+        "# TYPE test_gauge gauge\n"
+        'test_gauge{name="a \\"b\\""} 1.5\n'
+    )
+
+
+def test_worker_observations_are_merged(server):
+    parent = make_registry(server)
+    parent.observe("test_seconds", 0.5)
+    worker = make_registry(server)
+    worker.forward()
+    worker.observe("test_seconds", 2)
+    worker.inc("test_total", result="miss")
+
+    parent.merge(worker.drain())
+    assert worker.drain() == []  # Each observation is sent once
+    assert parent.drain() == []  # The parent does not collect for forwarding
+
+    text = parent.render()
+    assert 'test_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_seconds_bucket{le="10.0"} 2' in text
+    assert "test_seconds_sum 2.5" in text
+    assert "test_seconds_count 2" in text
+    assert 'test_total{result="miss"} 1' in text
+
+
+def sample(text, line_start):
+    """Value of the line that starts with line_start."""
+    for line in text.splitlines():
+        if line.startswith(line_start + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_start} not in /metrics")
+
+
+def test_transcription_is_observed(server, client, make_wav, fresh_metrics):
+    audio = make_wav(10)
+    for _ in range(2):
+        response = post_audio(client, "/transcribe", audio, language="en")
+        assert response.status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+
+    # The second request is served from the result cache
+    stage = 'whisperx_api_stage_seconds_{}{{stage="transcribe"}}'
+    assert sample(text, stage.format("count")) == 1
+    assert sample(text, stage.format("sum")) > 0
+    assert sample(text, stage.format("bucket")[:-1] + ',le="+Inf"}') == 1
+    assert sample(text, 'whisperx_api_cache_hit_ratio{cache="results"}') == 0.5
+    assert "# TYPE whisperx_api_real_time_factor histogram" in text
@@ -0,0 +1,103 @@
+"""Result cache keys and which results may be cached."""
+
+from conftest import bench, post_audio, whisperx
+
+
+def test_cache_key_depends_on_options_that_change_the_result(server):
+    base = {
+        "model_size": "large-v3",
+        "language": "auto",
+        "transcription_level": "word",
+        "gemini": False,
+        "splitter": None,
+    }
+    key = server.result_cache_key("a" * 64, base)
+    assert key == server.result_cache_key("a" * 64, dict(base))
+    assert key != server.result_cache_key("b" * 64, base)
+    for change in (
+        {"model_size": "small"},
+        {"language": "de"},
+        {"transcription_level": "both"},
+        {"start": 1.0},
+        {"draft_model": "base"},
+    ):
+        assert key != server.result_cache_key("a" * 64, dict(base, **change))
+
+
+def test_api_key_is_not_part_of_the_cache_key(server):
+    form_a = {"transcription_level": "sentence", "gemini_api_key": "first"}
+    form_b = {"transcription_level": "sentence", "gemini_api_key": "second"}
+    _, options_a, _ = server.parse_transcription_options(form_a)
+    _, options_b, _ = server.parse_transcription_options(form_b)
+    assert options_a == options_b
+    assert "first" not in str(options_a)
+
+
+def test_repeated_request_is_a_cache_hit(client, make_wav):
+    audio = make_wav(12)
+    first = post_audio(client, "/transcribe", audio)
+    second = post_audio(client, "/transcribe", audio)
+    assert first.json["cache_hit"] is False
+    assert second.json["cache_hit"] is True
+    assert second.json["segments"] == first.json["segments"]
+    assert (
+        post_audio(client, "/transcribe", audio, cache="0").json["cache_hit"] is False
+    )
+
+
+def test_failed_alignment_is_not_cached(server, client, make_wav, monkeypatch):
+    audio = make_wav(12)
+
+    def failing_align(*args, **kwargs):
+        raise RuntimeError("aligner unavailable")
+
+    monkeypatch.setattr(whisperx, "align", failing_align)
+    degraded = post_audio(client, "/transcribe", audio)
+    assert degraded.status_code == 200
+    assert all("words_error" in seg for seg in degraded.json["segments"])
+
+    monkeypatch.setattr(whisperx, "align", bench._fake_align)
+    retry = post_audio(client, "/transcribe", audio)
+    assert retry.json["cache_hit"] is False
+    assert not any("words_error" in seg for seg in retry.json["segments"])
+    assert post_audio(client, "/transcribe", audio).json["cache_hit"] is True
+
+
+def test_failed_sentence_split_is_not_cached(server, client, make_wav, monkeypatch):
+    audio = make_wav(12)
+    form = {"transcription_level": "sentence", "gemini_api_key": "test"}
+
+    class FailingClient(bench.FakeSplitClient):
+        def generate(self, prompt):
+            raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(server, "GEMINI_MAX_RETRIES", 0)
+    monkeypatch.setattr(server, "make_split_client", lambda key: FailingClient())
+    degraded = post_audio(client, "/transcribe", audio, **form)
+    assert degraded.status_code == 200
+    assert all("split_error" in seg for seg in degraded.json["segments"])
+
+    monkeypatch.setattr(
+        server, "make_split_client", lambda key: bench.FakeSplitClient()
+    )
+    retry = post_audio(client, "/transcribe", audio, **form)
+    assert retry.json["cache_hit"] is False
+    assert not any("split_error" in seg for seg in retry.json["segments"])
+    assert post_audio(client, "/transcribe", audio, **form).json["cache_hit"] is True
+
+
+def test_failed_alignment_in_a_batch_is_not_cached(
+    server, client, make_wav, monkeypatch
+):
+    audio = make_wav(12)
+
+    def failing_align(*args, **kwargs):
+        raise RuntimeError("aligner unavailable")
+
+    monkeypatch.setattr(whisperx, "align", failing_align)
+    degraded = post_audio(client, "/transcribe_batch", audio)
+    assert degraded.json["files"][0]["cache_hit"] is False
+
+    monkeypatch.setattr(whisperx, "align", bench._fake_align)
+    retry = post_audio(client, "/transcribe", audio)
+    assert retry.json["cache_hit"] is False
@@ -0,0 +1,121 @@
+"""Sentence segments keep their words, and their place without them."""
+
+import pytest
+
+
+def word(text, start, end):
+    return {"word": text, "start": start, "end": end, "score": 0.9}
+
+
+def test_sentences_without_matched_words_are_kept(server):
+    aligned = [
+        {
+            "start": 0.0,
+            "end": 3.4,
+            "words": [
+                word("hello", 0.0, 0.5),
+                word("world", 0.5, 1.0),
+                word("goodbye", 2.5, 3.0),
+                word("now", 3.0, 3.4),
+            ],
+        }
+    ]
+    sentences = [
+        {"text": "Hello world.", "start": 0.0, "end": 1.0},
+        {"text": "♪", "start": 1.0, "end": 2.5},
+        {"text": "Goodbye now.", "start": 2.5, "end": 3.4},
+        {"text": "Thanks.", "start": 3.4, "end": 4.0},
+    ]
+    combined = server.attach_words_to_sentences(sentences, aligned)
+
+    assert [seg["text"] for seg in combined] == [s["text"] for s in sentences]
+    assert [len(seg["words"]) for seg in combined] == [2, 0, 2, 0]
+    # Interpolated between the neighbouring sentences
+    assert (combined[1]["start"], combined[1]["end"]) == (1.0, 2.5)
+    assert (combined[3]["start"], combined[3]["end"]) == (3.4, 4.0)
+    assert all(a["end"] <= b["start"] for a, b in zip(combined, combined[1:]))
+
+
+def indices(matches):
+    return [[idx for _, idx in pairs] for pairs in matches]
+
+
+def test_matching_ignores_case_and_punctuation(server):
+    words = [word("hello,", 0, 1), word("World", 1, 2), word("it's", 2, 3)]
+    words.append(word("fine.", 3, 4))
+    matches = server.match_sentences_to_words(["Hello — world.", "Its FINE!"], words)
+
+    assert indices(matches) == [[0, 1], [2, 3]]
+    # A punctuation-only token is glued to the word before it
+    assert matches[0][0] == ("Hello —", 0)
+
+
+def test_matching_skips_words_the_llm_dropped(server):
+    texts = "so um we went uh home today".split()
+    words = [word(text, i, i + 1) for i, text in enumerate(texts)]
+    matches = server.match_sentences_to_words(["So we went", "home today."], words)
+
+    assert indices(matches) == [[0, 2, 3], [5, 6]]
+
+
+def test_matching_consumes_words_the_llm_changed(server):
+    texts = "it costs twenty dollars okay".split()
+    words = [word(text, i, i + 1) for i, text in enumerate(texts)]
+    matches = server.match_sentences_to_words(["It costs 20 dollars.", "Okay."], words)
+
+    assert indices(matches) == [[0, 1, 2, 3], [4]]
+    assert matches[0][2] == ("20", 2)
+
+
+def test_matching_leaves_sentences_without_words_empty(server):
+    words = [word("hello", 0, 1), word("world", 1, 2)]
+    matches = server.match_sentences_to_words(
+        ["♪", "Hello world.", "Extra words."], words
+    )
+
+    assert indices(matches) == [[], [0, 1], []]
+
+
+def test_time_sentences_snaps_to_words_and_falls_back_to_proportions(server):
+    chunk = [
+        {
+            "start": 0.0,
+            "end": 10.0,
+            "text": "Hello world goodbye now",
+            "words": [
+                word("Hello", 1.0, 1.5),
+                word("world", 1.5, 2.0),
+                word("goodbye", 6.0, 6.5),
+                word("now", 6.5, 7.0),
+            ],
+        }
+    ]
+    sentences = ["Hello world.", "♪", "Goodbye now.", "Thanks.", "", None]
+    timed = server.time_sentences(
+        sentences, chunk, "Hello world. ♪ Goodbye now. Thanks."
+    )
+
+    assert [seg["text"] for seg in timed] == [
+        "Hello world.",
+        "♪",
+        "Goodbye now.",
+        "Thanks.",
+    ]
+    assert (timed[0]["start"], timed[0]["end"]) == (1.0, 2.0)
+    assert (timed[2]["start"], timed[2]["end"]) == (6.0, 7.0)
+    # Unmatched sentences keep their place by character offset
+    assert timed[1]["start"] == pytest.approx(3.714, abs=1e-3)
+    assert timed[1]["end"] == pytest.approx(4.0)
+    assert (timed[3]["start"], timed[3]["end"]) == (8.0, 10.0)
+
+
+def test_time_sentences_without_alignment_uses_proportions(server):
+    chunk = [
+        {"start": 0.0, "end": 4.0, "text": "aaaa bbbb"},
+        {"start": 4.0, "end": 10.0, "text": "cc"},
+    ]
+    timed = server.time_sentences(["aaaa bbbb", "cc"], chunk, "aaaa bbbb cc")
+
+    assert timed[0] == {"text": "aaaa bbbb", "start": 0.0, "end": 7.5}
+    assert timed[1]["start"] == pytest.approx(8.333, abs=1e-3)
+    assert timed[1]["end"] == 10.0
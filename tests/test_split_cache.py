@@ -0,0 +1,80 @@
+"""Split cache: hits skip the LLM, keys follow the prompt inputs, failures are not stored."""
+
+import pytest
+
+from conftest import bench
+
+
+class CountingClient(bench.FakeSplitClient):
+    """The benchmark splitter, or a fixed reply, counting its calls."""
+
+    def __init__(self, reply=None, model_name="benchmark-fake-splitter"):
+        super().__init__()
+        self.reply = reply
+        self.model_name = model_name
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.reply is not None:
+            return self.reply
+        return super().generate(prompt)
+
+
+@pytest.fixture
+def split_cache(server, tmp_path, monkeypatch):
+    cache = server.DiskCache(str(tmp_path / "splits"), 1024 * 1024, label="splits")
+    monkeypatch.setattr(server, "split_cache", cache)
+    monkeypatch.setattr(server, "GEMINI_RETRY_BASE_DELAY_SECONDS", 0)
+    return cache
+
+
+def make_segments():
+    return [
+        {"start": float(i * 5), "end": float(i * 5 + 5), "text": f"part {i} " * 6}
+        for i in range(8)
+    ]
+
+
+def test_cache_hit_skips_the_client(server, split_cache):
+    client = CountingClient()
+    first = server.split_segments_with_gemini(make_segments(), None, "en", client)
+    second = server.split_segments_with_gemini(make_segments(), None, "en", client)
+
+    assert client.calls == 1
+    assert second == first
+    assert split_cache.stats()["entries"] == 1
+
+
+def test_key_changes_with_language_model_and_prompt_version(server, monkeypatch):
+    client = CountingClient()
+    key = server.split_cache_key("Hello there.", "en", client)
+
+    assert server.split_cache_key("Hello there.", "en", CountingClient()) == key
+    assert server.split_cache_key("Hello there!", "en", client) != key
+    assert server.split_cache_key("Hello there.", "es", client) != key
+    other_model = CountingClient(model_name="other-model")
+    assert server.split_cache_key("Hello there.", "en", other_model) != key
+    monkeypatch.setattr(server, "SPLIT_PROMPT_VERSION", server.SPLIT_PROMPT_VERSION + 1)
+    assert server.split_cache_key("Hello there.", "en", client) != key
+
+
+def test_other_language_calls_the_client_again(server, split_cache):
+    client = CountingClient()
+    server._call_gemini_split("one two three", "en", client)
+    server._call_gemini_split("one two three", "es", client)
+    server._call_gemini_split("one two three", "en", client)
+    assert client.calls == 2
+
+
+@pytest.mark.parametrize("reply", ["Sorry, I cannot help with that.", '["", " "]'])
+def test_unparsable_reply_is_not_cached(server, split_cache, monkeypatch, reply):
+    monkeypatch.setattr(server, "GEMINI_MAX_RETRIES", 0)
+    bad = CountingClient(reply=reply)
+    server._call_gemini_split("one two three", "en", bad)
+    assert split_cache.stats()["entries"] == 0
+
+    good = CountingClient()
+    assert server._call_gemini_split("one two three", "en", good) == ["one two three"]
+    assert good.calls == 1
+    assert split_cache.stats()["entries"] == 1
@@ -0,0 +1,27 @@
+"""Importing the server stays cheap: no whisperx import, no cache scans."""
+
+import os
+import subprocess
+import sys
+
+from conftest import REPO_DIR
+
+
+def test_import_defers_whisperx_and_cache_scans(tmp_path):
+    results = tmp_path / "whisperx_api_cache" / "results"
+    results.mkdir(parents=True)
+    (results / ("a" * 64 + ".json")).write_text("{}")
+    code = (
+        "import sys, whisperAPI\n"
+        "cache = whisperAPI.result_cache\n"
+        "print('whisperx' in sys.modules, cache._indexed, cache.stats()['entries'])\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_DIR,
+        env=dict(os.environ, TMPDIR=str(tmp_path)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.splitlines()[-1] == "False False 1"
@@ -0,0 +1,67 @@
+"""Streamed transcriptions share transcribe calls between windows."""
+
+import json
+
+from conftest import bench, post_audio
+
+
+def read_events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_windows_are_transcribed_in_growing_groups(
+    server, client, make_wav, monkeypatch
+):
+    calls = []
+    transcribe = bench.FakeWhisperModel.transcribe
+
+    def counting_transcribe(self, audio, **kwargs):
+        calls.append(len(audio))
+        return transcribe(self, audio, **kwargs)
+
+    monkeypatch.setattr(bench.FakeWhisperModel, "transcribe", counting_transcribe)
+    response = post_audio(
+        client, "/transcribe", make_wav(600), stream="ndjson", language="en"
+    )
+    events = read_events(response)
+    windows = events[0]["windows"]
+    assert events[-1]["type"] == "end"
+
+    groups, size = [], 1
+    while sum(groups) < windows:
+        groups.append(min(size, windows - sum(groups)))
+        size = min(size * 2, server.STREAM_MAX_GROUP_WINDOWS)
+    assert len(calls) == len(groups) < windows
+
+    segments = [event["segment"] for event in events if event["type"] == "segment"]
+    assert segments
+    assert all(a["end"] <= b["start"] for a, b in zip(segments, segments[1:]))
+    assert segments[-1]["end"] <= 600
+
+
+def test_language_is_detected_from_the_probe(client, make_wav):
+    response = post_audio(client, "/transcribe", make_wav(40), stream="ndjson")
+    events = read_events(response)
+    language = [event for event in events if event["type"] == "language"]
+    assert len(language) == 1
+    assert language[0]["language"] == "en"
+    assert language[0]["language_detection"]["probe_seconds"] > 0
+
+
+def test_cached_result_replays_the_start_event(server, client, make_wav):
+    audio = make_wav(40)
+    live = read_events(
+        post_audio(client, "/transcribe", audio, stream="ndjson", model="small")
+    )
+    assert post_audio(client, "/transcribe", audio, model="small").status_code == 200
+    replayed = read_events(
+        post_audio(client, "/transcribe", audio, stream="ndjson", model="small")
+    )
+
+    start = replayed[0]
+    assert start["type"] == "start" and start["cache_hit"] is True
+    assert start["model"] == live[0]["model"] == "small"
+    assert set(live[0]) - {"windows"} <= set(start)
+    for key in ("transcription_level", "duration_seconds"):
+        assert start[key] == live[0][key]
+    assert replayed[-1]["type"] == "end"
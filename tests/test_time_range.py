@@ -0,0 +1,60 @@
+"""Re-transcribing a time range and splicing it into an earlier result."""
+
+import time
+
+from conftest import post_audio
+
+
+def test_range_is_spliced_into_the_earlier_result(client, make_wav):
+    audio = make_wav(40)
+    base = post_audio(client, "/transcribe", audio, language="en").get_json()
+    spliced = post_audio(
+        client,
+        "/transcribe",
+        audio,
+        language="en",
+        start="13",
+        end="27",
+        splice=base["result_id"],
+    ).get_json()
+
+    assert spliced["spliced_range"] == [13.0, 27.0]
+    segments = spliced["segments"]
+    assert all(a["end"] <= b["start"] for a, b in zip(segments, segments[1:]))
+
+    def middle(seg):
+        return (seg["start"] + seg["end"]) / 2
+
+    # Segments outside the range are the base ones, untouched apart from the
+    # seams; the ones inside come from the range transcription
+    outside = [seg for seg in base["segments"] if not 13 <= middle(seg) < 27]
+    kept = [seg for seg in segments if not 13 <= middle(seg) < 27]
+    assert [seg["text"] for seg in kept] == [seg["text"] for seg in outside]
+    inside = [seg for seg in segments if 13 <= middle(seg) < 27]
+    assert inside and all(13 <= seg["start"] and seg["end"] <= 27 for seg in inside)
+    assert spliced["full_text"] == " ".join(seg["text"].strip() for seg in segments)
+
+
+def test_windowed_job_cannot_be_a_splice_base(client, make_wav):
+    audio = make_wav(20)
+    job = post_audio(
+        client, "/jobs", audio, language="en", windowed="1", cache="0"
+    ).get_json()
+    for _ in range(250):
+        status = client.get(f"/jobs/{job['job_id']}").get_json()
+        if status["status"] != "queued" and status["status"] != "running":
+            break
+        time.sleep(0.02)
+    assert "result_url" in status
+
+    response = post_audio(
+        client,
+        "/transcribe",
+        audio,
+        language="en",
+        start="5",
+        end="10",
+        splice=job["job_id"],
+    )
+    assert response.status_code == 400
+    assert "windowed" in response.get_json()["error"]
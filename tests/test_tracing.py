@@ -0,0 +1,111 @@
+"""Traces are written once all the work of a traced request has finished."""
+
+import json
+import os
+import pstats
+import time
+
+from conftest import post_audio
+
+
+def read_trace(server, response, timeout=10):
+    """Wait for the trace referenced by response and return its span names."""
+    name = os.path.basename(response.headers["X-Trace-Url"])
+    path = os.path.join(server.TRACE_DIR, name)
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        assert time.time() < deadline, "trace was never written"
+        time.sleep(0.05)
+    with open(path, encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    return [event["name"] for event in events if event["ph"] == "X"]
+
+
+def wait_done(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        data = client.get(f"/jobs/{job_id}").json
+        if data["status"] in ("done", "failed", "cancelled"):
+            return data
+        assert time.time() < deadline, "job never finished"
+        time.sleep(0.05)
+
+
+def test_trace_covers_the_whole_request(server, client, make_wav):
+    response = post_audio(
+        client,
+        "/transcribe",
+        make_wav(12),
+        profile="1",
+        transcription_level="both",
+        splitter="local",
+    )
+    assert response.json["trace"]["trace_url"] == response.headers["X-Trace-Url"]
+    response.close()
+    names = read_trace(server, response)
+    for stage in (
+        "POST /transcribe",
+        "receive_audio",
+        "queued",
+        "transcribe",
+        "align",
+        "split_local",
+        "attach_words",
+        "json_serialize",
+        "send_response",
+    ):
+        assert stage in names
+
+
+def test_streamed_trace_is_saved_after_the_stream(server, client, make_wav):
+    response = post_audio(
+        client, "/transcribe", make_wav(40), profile="1", stream="ndjson"
+    )
+    lines = response.get_data(as_text=True).splitlines()
+    assert json.loads(lines[-1])["type"] == "end"
+    response.close()
+    names = read_trace(server, response)
+    assert "transcribe" in names
+    assert "align" in names
+    assert "send_response" in names
+
+
+def test_draft_trace_includes_the_refine_pass(server, client, make_wav):
+    response = post_audio(
+        client, "/transcribe", make_wav(12), profile="1", draft_model="base"
+    )
+    response.close()
+    # Written only once the refine pass has finished, too
+    names = read_trace(server, response)
+    assert names.count("transcribe") == 2
+
+
+def test_async_job_trace(server, client, make_wav):
+    response = post_audio(client, "/jobs", make_wav(12), profile="1")
+    assert response.status_code == 202
+    response.close()
+    job = wait_done(client, response.json["job_id"])
+    assert job["trace"]["trace_url"] == response.headers["X-Trace-Url"]
+    names = read_trace(server, response)
+    assert "POST /jobs" in names
+    assert "transcribe" in names
+
+
+def test_cprofile_dump(server, client, make_wav):
+    response = post_audio(
+        client, "/transcribe", make_wav(12), profile="cprofile", cache="0"
+    )
+    response.close()
+    read_trace(server, response)
+    profile_path = os.path.join(
+        server.TRACE_DIR, os.path.basename(response.json["trace"]["profile_url"])
+    )
+    stats = pstats.Stats(profile_path)
+    assert any(name == "execute_task" for _, _, name in stats.stats)
+
+
+def test_untraced_requests_write_nothing(server, client, make_wav):
+    response = post_audio(client, "/transcribe", make_wav(12))
+    assert "trace" not in response.json
+    assert "X-Trace-Url" not in response.headers
+    assert not os.path.exists(server.TRACE_DIR)
@@ -0,0 +1,57 @@
+"""Windowed jobs keep memory bounded by the window, not the recording."""
+
+import tracemalloc
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from conftest import bench, post_audio
+
+
+@pytest.fixture
+def short_windows(server, monkeypatch):
+    monkeypatch.setattr(server, "WINDOWED_WINDOW_SECONDS", 60)
+    monkeypatch.setattr(server, "WINDOWED_OVERLAP_SECONDS", 10)
+
+
+@pytest.mark.parametrize("audio_cache", [True, False])
+def test_peak_memory_is_bounded(
+    server, client, tmp_path, monkeypatch, short_windows, audio_cache
+):
+    if not audio_cache:
+        monkeypatch.setattr(server, "audio_cache", None)
+    path = tmp_path / "long.wav"
+    bench.write_synthetic_audio(str(path), 30 * 60)
+    size = path.stat().st_size
+
+    with open(path, "rb") as f:
+        # Encode the request first: only the server's memory is measured
+        environ = EnvironBuilder(
+            path="/transcribe",
+            method="POST",
+            data={"audio": (f, "long.wav"), "windowed": "1", "language": "en"},
+        ).get_environ()
+    tracemalloc.start()
+    try:
+        response = client.open(environ)
+        body = response.get_data()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert response.status_code == 200
+    assert b'"windows": 36' in body
+    # The decoded float32 signal alone would be twice the 16-bit file
+    assert peak < size / 4
+
+
+def test_raw_body_is_spooled_like_a_wav_upload(server, client, make_wav, short_windows):
+    data = make_wav(150)
+    form = post_audio(client, "/transcribe", data, windowed="1", language="en")
+    raw = client.post(
+        "/transcribe?windowed=1&language=en&audio_format=pcm_s16le",
+        data=data[44:],
+        content_type="application/octet-stream",
+    )
+    assert raw.status_code == 200
+    assert raw.json["segments"] == form.json["segments"]
@@ -0,0 +1,82 @@
+"""Jobs in a transcription worker process: cancellation and metrics."""
+
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import REPO_DIR, bench
+
+ALIGN_SECONDS = 1.5
+
+# whisperx for the spawned process: the benchmark fakes with a slow alignment
+WHISPERX_SHIM = f"""
+import importlib.util
+import time
+
+_spec = importlib.util.spec_from_file_location(
+    "benchmark_pipeline", {REPO_DIR!r} + "/benchmarks/benchmark_pipeline.py"
+)
+_bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_bench)
+globals().update(
+    (name, value)
+    for name, value in vars(_bench.make_fake_whisperx()).items()
+    if not name.startswith("_")
+)
+
+
+def align(*args, **kwargs):
+    time.sleep({ALIGN_SECONDS})
+    return _bench._fake_align(*args, **kwargs)
+"""
+
+
+@pytest.fixture
+def worker(server, tmp_path, monkeypatch):
+    shim_dir = tmp_path / "shim"
+    shim_dir.mkdir()
+    (shim_dir / "whisperx.py").write_text(WHISPERX_SHIM)
+    monkeypatch.syspath_prepend(str(shim_dir))
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    process = server.TranscriptionProcess(0, server.worker_process_config())
+    process.wait_ready()
+    yield process
+    process.stop()
+
+
+def test_cancel_reaches_a_process_that_sends_nothing(server, worker):
+    clip = np.zeros(10 * bench.SAMPLE_RATE, np.float32)
+    job = server.Job(None, {"language": "en"}, audio=clip)
+    update = job.update
+
+    def cancel_during_alignment(stage, fraction):
+        # The process reports nothing until alignment is over, and only
+        # checks for cancellation once more after it
+        update(stage, fraction)
+        if stage == "aligning":
+            threading.Timer(ALIGN_SECONDS / 3, job.cancel_event.set).start()
+
+    job.update = cancel_during_alignment
+    with pytest.raises(server.JobCancelled):
+        worker.run(job)
+
+    # The process carries on with the next job
+    pid = worker.process.pid
+    result = worker.run(server.Job(None, {"language": "en"}, audio=clip))
+    assert result["segments"]
+    assert worker.process.pid == pid
+
+
+def test_worker_metrics_reach_the_parent(server, worker, monkeypatch):
+    registry = server.Metrics()
+    registry._help = dict(server.metrics._help)
+    registry._buckets = dict(server.metrics._buckets)
+    monkeypatch.setattr(server, "metrics", registry)
+
+    clip = np.zeros(10 * bench.SAMPLE_RATE, np.float32)
+    worker.run(server.Job(None, {"language": "en"}, audio=clip))
+
+    text = registry.render()
+    assert 'whisperx_api_stage_seconds_count{stage="transcribe"} 1' in text
+    assert 'whisperx_api_stage_seconds_count{stage="align"} 1' in text
@@ -2,10 +2,31 @@ import os
 import tempfile
 import time  # For timing operations
 import sys  # For sys.frozen and sys._MEIPASS
-from flask import Flask, request, jsonify
-import whisperx
+import argparse
+import atexit
+import cProfile
+import hashlib
+import io
+import math
+import multiprocessing
+import queue
+import select
+import socket
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, Request, Response, request, jsonify, send_from_directory
+import numpy as np
 from werkzeug.utils import secure_filename
+import copy
 import json
+import marshal
+import random
+import re
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 # Try to import Google Generative AI - will fail gracefully if not installed
 try:
@@ -19,6 +40,15 @@ except ImportError:
     )
     print("Install with: pip install google-generativeai")
 
+# scipy (installed with WhisperX's dependencies) provides a fast polyphase
+# resampler; without it a numpy implementation is used
+try:
+    from scipy.signal import resample_poly
+
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
 # --- Determine the script's directory (especially for PyInstaller) ---
 if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
     SCRIPT_DIR = sys._MEIPASS
@@ -28,50 +58,272 @@ else:
 # --- Configuration for UPLOAD_FOLDER ---
 TEMP_DIR_BASE = tempfile.gettempdir()
 UPLOAD_FOLDER = os.path.join(TEMP_DIR_BASE, "whisperx_api_uploads")
-ALLOWED_EXTENSIONS = {"wav", "mp3", "m4a", "ogg", "flac", "aac", "opus"}
+ALLOWED_EXTENSIONS = {"wav", "mp3", "m4a", "ogg", "flac", "aac", "opus", "pcm", "raw"}
+
+
+def _env_setting(name, default, cast=str):
+    """
+    Read configuration value WHISPERX_API_<name> from the environment, falling
+    back to default when it is unset or cannot be converted with cast.
+    """
+    value = os.environ.get(f"WHISPERX_API_{name}")
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return cast(value.strip())
+    except ValueError:
+        print(f"Warning: ignoring invalid WHISPERX_API_{name}={value!r}")
+        return default
+
+
+def _csv_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
 
 
 # --- Configuration ---
-# WhisperX model identifier (e.g., "large-v3", "large-v2", "medium", "base", etc.)
-MODEL_SIZE = "large-v3"
+# Every setting marked (env) can also be set through a WHISPERX_API_<NAME>
+# environment variable or the matching command line option (see --help).
+# WhisperX model identifier (e.g., "large-v3", "large-v2", "medium", "base", etc.) (env)
+MODEL_SIZE = _env_setting("MODEL_SIZE", "large-v3")
+# Models a request may select with the "model" form field (env: comma-separated)
+ALLOWED_MODELS = _env_setting(
+    "ALLOWED_MODELS",
+    ["tiny", "base", "small", "medium", "large-v2", "large-v3"],
+    _csv_list,
+)
+if MODEL_SIZE not in ALLOWED_MODELS:
+    ALLOWED_MODELS.append(MODEL_SIZE)
+# Maximum number of WhisperX models kept loaded; least recently used are unloaded (env)
+MAX_LOADED_MODELS = _env_setting("MAX_LOADED_MODELS", 2, int)
+# Models loaded in the background when the server starts, so the first request
+# does not pay the load time (env: comma-separated, empty to disable)
+WARMUP_MODELS = _env_setting("WARMUP_MODELS", [MODEL_SIZE], _csv_list)
 # Gemini model used for sentence splitting.
 GEMINI_MODEL_NAME = "gemini-2.5-flash"
 GEMINI_MODEL_LABEL = "Gemini 2.5 Flash"
-# DEVICE: "cpu" or "cuda" if you have a GPU and compatible PyTorch/WhisperX installed
-DEVICE = "cpu"
-# COMPUTE_TYPE: "int8" for CPU. For GPU, "float16" or "bfloat16" (if supported) are common.
-COMPUTE_TYPE = "int8"
+# Sentence-splitting chunks sent to Gemini at the same time, and the request
+# rate allowed across all of them (token bucket; GEMINI_RATE_LIMIT_BURST
+# requests may be sent back-to-back before the rate applies).
+GEMINI_MAX_CONCURRENCY = 4
+GEMINI_REQUESTS_PER_MINUTE = 60
+GEMINI_RATE_LIMIT_BURST = 4
+GEMINI_MAX_RETRIES = 2  # Extra attempts per chunk, with exponential backoff
+GEMINI_RETRY_BASE_DELAY_SECONDS = 1.0
+# Optional HTTP endpoint used instead of Gemini for sentence splitting (e.g. a
+# local fake LLM server for testing): POST {"prompt": ...} -> {"text": ...} (env)
+LLM_SPLIT_ENDPOINT = _env_setting("LLM_SPLIT_ENDPOINT", None)
+LLM_SPLIT_TIMEOUT_SECONDS = 120
+# DEVICE: "cpu" or "cuda" if you have a GPU and compatible PyTorch/WhisperX installed (env)
+DEVICE = _env_setting("DEVICE", "cpu")
+# COMPUTE_TYPE: "int8" for CPU. For GPU, "float16" or "bfloat16" (if supported) are common. (env)
+COMPUTE_TYPE = _env_setting("COMPUTE_TYPE", "int8")
 # Language is now auto-detected.
 
-BATCH_SIZE = 16  # Batch size for transcription
-CPU_THREADS = 4  # Number of CPU threads for WhisperX
+BATCH_SIZE = _env_setting("BATCH_SIZE", 16, int)  # Batch size for transcription (env)
+CPU_THREADS = _env_setting(
+    "CPU_THREADS", 4, int
+)  # Number of CPU threads for WhisperX (env)
+
+# --- Result Cache Configuration ---
+# Finished transcriptions are stored on disk, keyed by a hash of the uploaded
+# audio bytes and the parameters that influence the result. Re-sending the same
+# file (e.g. after a style tweak in After Effects) is then answered from disk.
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_DIR = os.path.join(TEMP_DIR_BASE, "whisperx_api_cache", "results")
+# Least recently used entries are evicted above this size
+RESULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read per iteration while saving/hashing uploads
+
+# --- Decoded Audio Cache Configuration ---
+# Decoded 16 kHz float32 audio is written once as a .npy file, keyed by the
+# same content hash as the result cache, and memory-mapped by later requests
+# for the same media (and by worker processes) instead of decoding it again.
+AUDIO_CACHE_ENABLED = True
+AUDIO_CACHE_DIR = os.path.join(TEMP_DIR_BASE, "whisperx_api_cache", "audio")
+# About 17 hours of audio; least recently used files are evicted above this
+AUDIO_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# Uploads left in UPLOAD_FOLDER by an earlier run (e.g. after a crash) are
+# removed at startup once they are older than this
+UPLOAD_ORPHAN_MAX_AGE_SECONDS = 3600
+
+# --- Sentence Split Cache Configuration ---
+# Successfully parsed LLM sentence splits, keyed by chunk text, language, model
+# and prompt version, so re-transcribing the same material skips Gemini.
+SPLIT_CACHE_ENABLED = True
+SPLIT_CACHE_DIR = os.path.join(TEMP_DIR_BASE, "whisperx_api_cache", "splits")
+SPLIT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SPLIT_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600
+# Bump whenever build_split_prompt changes so old entries are ignored
+SPLIT_PROMPT_VERSION = 1
+
+# --- Alignment Model Pool Configuration ---
+# Alignment models are kept resident between requests (one per language) and
+# evicted least-recently-used once either limit below is exceeded.
+# Maximum number of resident alignment models (env)
+ALIGN_MODEL_POOL_SIZE = _env_setting("ALIGN_POOL_SIZE", 3, int)
+# Optional parameter memory budget in bytes (0 = no limit) (env)
+ALIGN_MODEL_POOL_MAX_BYTES = _env_setting("ALIGN_POOL_MAX_BYTES", 0, int)
+# Languages whose alignment models are loaded at startup, e.g. ["en", "es"] (env: comma-separated)
+ALIGN_MODEL_PRELOAD_LANGUAGES = _env_setting("ALIGN_PRELOAD", [], _csv_list)
+# How many aligned words a sentence token may skip to resynchronise when
+# sentence text and aligned words disagree (transcription_level "both").
+MATCH_LOOKAHEAD_WORDS = 4
+
+# --- Local Sentence Splitter Configuration (splitter=local) ---
+LOCAL_SPLIT_TARGET_WORDS = 9  # Preferred line length in words
+LOCAL_SPLIT_MAX_WORDS = 12  # Hard maximum line length in words
+LOCAL_SPLIT_MIN_WORDS = 3  # Shorter lines only at sentence ends or long pauses
+# A silence this long between words is a natural split point
+LOCAL_SPLIT_PAUSE_SECONDS = 0.7
+
+# --- Job Queue Configuration (/jobs and /transcribe) ---
+# Every transcription goes through one bounded job queue. With
+# WORKER_PROCESSES = 0 it is served by JOB_WORKERS threads sharing this
+# process's model; with N > 0 by N worker processes, each holding its own
+# model and using WORKER_THREADS CPU threads (e.g. 8 x 4 on a 32-core machine).
+JOB_WORKERS = _env_setting("JOB_WORKERS", 1, int)
+WORKER_PROCESSES = _env_setting("WORKER_PROCESSES", 0, int)
+WORKER_THREADS = _env_setting("WORKER_THREADS", CPU_THREADS, int)
+# Jobs waiting for a worker; further requests get HTTP 429 with Retry-After
+JOB_QUEUE_SIZE = _env_setting("JOB_QUEUE_SIZE", 8, int)
+# Finished jobs (and their results) are dropped after this
+JOB_RESULT_TTL_SECONDS = 3600
+JOB_RETRY_AFTER_SECONDS = 30  # Retry-After hint sent with HTTP 429
+# How often a blocking /transcribe request checks whether its client has gone
+CLIENT_DISCONNECT_POLL_SECONDS = 1.0
+# How often a worker process's manager thread checks for a cancelled job
+CANCEL_POLL_SECONDS = 0.2
+# Approximate share of the total work done before each pipeline stage starts,
+# used for the progress percentage and ETA reported by GET /jobs/<id>.
+PROGRESS_TRANSCRIBE_START = 0.05
+PROGRESS_ALIGN_START = 0.7
+PROGRESS_SPLIT_START = 0.85
+
+# --- Streaming Configuration (/transcribe with stream=ndjson or stream=sse) ---
+SAMPLE_RATE = 16000  # whisperx.load_audio always resamples to 16 kHz mono
+STREAM_WINDOW_SECONDS = 30  # Audio transcribed per streamed window
+# Window boundaries move to the quietest point within this range
+STREAM_CUT_SEARCH_SECONDS = 5
+ENERGY_FRAME_SECONDS = 0.1  # Frame length for the energy analysis used to find pauses
+# Windows are transcribed in groups with one call, like the clips of a batch
+# (see BATCH_GAP_SECONDS), so their speech shares BATCH_SIZE batches. The first
+# group is one window so the first segments arrive quickly; every further
+# group doubles up to this many windows.
+STREAM_MAX_GROUP_WINDOWS = 8
+
+# --- Language Detection (/detect_language and auto-detection) ---
+# Instead of letting the transcription detect the language from the first
+# 30 s of audio, the windows with the most speech are joined into one 30 s
+# probe. Detections are cached per audio hash and model.
+LANGUAGE_PROBE_ENABLED = True
+LANGUAGE_PROBE_WINDOW_SECONDS = 10
+LANGUAGE_PROBE_WINDOWS = 3
+# Only the start of long files is scanned for speech windows
+LANGUAGE_PROBE_SCAN_SECONDS = 600
+LANGUAGE_PROBE_TOP_LANGUAGES = 5  # Probabilities returned per detection
+LANGUAGE_CACHE_DIR = os.path.join(TEMP_DIR_BASE, "whisperx_api_cache", "languages")
+LANGUAGE_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# --- Windowed Pipeline (/transcribe and /jobs with windowed=1) ---
+# For multi-hour recordings: the audio is decoded by ffmpeg straight into the
+# decoded audio cache, transcribed and aligned in fixed-size overlapping
+# windows of that memory-mapped file, and the result is written to a file
+# segment by segment, so peak memory does not grow with the duration.
+WINDOWED_WINDOW_SECONDS = 600
+# Consecutive windows overlap by this much; segments are assigned to one of
+# the two windows at the quietest point in the middle half of the overlap
+WINDOWED_OVERLAP_SECONDS = 30
+FFMPEG_READ_BYTES = 1024 * 1024  # Decoded PCM read from ffmpeg per iteration
+
+# --- Time-range Re-transcription (/transcribe with start/end and splice) ---
+# Audio transcribed on each side of the requested range, so words at the
+# range boundaries are recognized in context; segments outside are dropped
+RANGE_CONTEXT_SECONDS = 2.0
+
+# --- Draft-then-refine (/transcribe and /jobs with draft_model) ---
+# A small model returns a draft quickly, then the requested model refines it;
+# the refined result carries a diff against the draft with stable segment ids.
+# draft_model=1 selects DRAFT_MODEL_SIZE, which must be in ALLOWED_MODELS.
+DRAFT_MODEL_SIZE = _env_setting("DRAFT_MODEL_SIZE", "base")
+DRAFT_PROGRESS_SHARE = 0.25  # Share of the job progress taken by the draft pass
+# A refined segment keeps the id of the draft segment it overlaps by at least
+# this fraction of the shorter of the two
+DRAFT_MATCH_MIN_OVERLAP = 0.5
+
+# --- Batch Transcription (/transcribe_batch) ---
+# The clips of one request are grouped by language and each group is
+# transcribed as one recording, so their speech shares BATCH_SIZE batches.
+# Clips are separated by this much silence: whisperx packs speech into
+# chunks of at most 30 s, so no chunk (and no segment) spans two clips.
+BATCH_GAP_SECONDS = 30
+BATCH_MAX_FILES = 64  # Files accepted per /transcribe_batch request
+
+# --- In-memory Audio Decoding ---
+# WAV files and raw PCM are decoded straight from the request into a numpy
+# array (and resampled in-process) instead of being written to UPLOAD_FOLDER
+# and decoded by an ffmpeg subprocess. Other formats still go through ffmpeg.
+IN_MEMORY_DECODE_ENABLED = True
+# Raw PCM formats accepted with audio_format=...; sample_rate and channels
+# request fields describe the layout (defaults: 16000 Hz, mono)
+RAW_AUDIO_FORMATS = {"pcm_s16le": "<i2", "pcm_f32le": "<f4"}
+# Uploads up to this size are read and decoded in memory; larger ones are
+# spooled to disk and decoded into a .npy file a chunk at a time
+IN_MEMORY_UPLOAD_MAX_BYTES = 128 * 1024 * 1024
+# Larger uploads are parsed into a temp file instead of memory, so windowed
+# jobs (which never decode in memory) stay bounded however long the file is
+UPLOAD_MEMORY_BUFFER_BYTES = 8 * 1024 * 1024
+RESAMPLE_HALF_TAPS = 10  # Filter half-length (in output samples) of the numpy resampler
+RESAMPLE_BLOCK_SIZE = 65536  # Output samples computed per vectorized block
+
+# --- Metrics Configuration (/metrics) ---
+# Histogram bucket upper bounds in seconds for the per-stage latencies
+METRICS_STAGE_BUCKETS = (
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+)
+# Real-time factor buckets: processing time / audio duration (below 1 is faster than real time)
+METRICS_REAL_TIME_FACTOR_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)
+
+# --- Request Tracing (/transcribe with profile=1 or profile=cprofile) ---
+# Traced requests record nested timing spans of every pipeline stage and
+# write them as Chrome trace-event JSON (chrome://tracing or Perfetto) to
+# TRACE_DIR, served by GET /traces/<file>; profile=cprofile adds a cProfile
+# dump of the transcription (open with pstats or snakeviz).
+TRACE_DIR = os.path.join(TEMP_DIR_BASE, "whisperx_api_traces")
+# Fraction of /transcribe requests traced without asking (0 disables)
+TRACE_SAMPLE_RATE = _env_setting("TRACE_SAMPLE_RATE", 0.0, float)
+TRACE_MAX_FILES = 200  # Oldest trace files are removed beyond this many
+
 
 # --- Initialize Flask App ---
+class AudioUploadRequest(Request):
+    """Request that buffers uploads up to UPLOAD_MEMORY_BUFFER_BYTES in memory."""
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return tempfile.SpooledTemporaryFile(
+            max_size=UPLOAD_MEMORY_BUFFER_BYTES, mode="rb+"
+        )
+
+
 app = Flask(__name__)
+app.request_class = AudioUploadRequest
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
-# --- Load WhisperX Model ---
-print(
-    f"Loading WhisperX model: {MODEL_SIZE} (language: auto-detect) on {DEVICE} with {COMPUTE_TYPE} compute type..."
-)
-model = None  # Initialize model to None
-try:
-    model = whisperx.load_model(
-        MODEL_SIZE,
-        device=DEVICE,
-        compute_type=COMPUTE_TYPE,
-        language=None,  # Set to None for automatic language detection
-        threads=CPU_THREADS,
-    )
-    print(f"WhisperX Model {MODEL_SIZE} (Language: auto-detect) loaded successfully.")
-except Exception as e:
-    print(f"Error loading WhisperX model: {e}")
-    print(
-        "Please ensure you have a working internet connection for the first download,"
-    )
-    print("and that the model size/type is correct and WhisperX is installed properly.")
-    # model remains None
-
 # --- Create UPLOAD_FOLDER if it doesn't exist ---
 if not os.path.exists(UPLOAD_FOLDER):
     try:
@@ -92,488 +344,5197 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def _call_gemini_split(text, detected_language, gemini_api_key):
+class PipelineError(Exception):
     """
-    Helper function to call Gemini and return a list of sentence strings.
+    Error raised by the transcription pipeline that should be reported to the
+    client as-is, with the given HTTP status code.
     """
-    try:
-        try:
-            model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        except Exception:
-            try:
-                model = genai.GenerativeModel("gemini-2.5-flash")
-            except Exception:
-                model = genai.GenerativeModel("gemini-2.0-flash")
 
-        language_name = (
-            detected_language.upper() if detected_language else "the detected language"
-        )
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
 
-        prompt = f"""You are a professional subtitle editor. Your task is to split the following transcription text into short, readable, captionable segments suitable for video subtitles.
 
-CRITICAL RULES:
-    1. LENGTH CONSTRAINT: Maximum around 9 words per segment, keep it natural, but you can go up to 12 words if it maintains readability and flow. Avoid very short segments (1-2 words) unless they are natural pauses or standalone phrases.
-    2. GRAMMATICAL GLUE (High Priority):
-      - NEVER separate a pronoun from its verb (e.g., keep "se merece", "te quiero", "it is" together).
-      - NEVER separate a preposition from its noun (e.g., keep "con [Name]", "in the house", "para ti" together).
-      - NEVER separate an article from its noun (e.g., keep "la casa", "the car" together).
-    3. NO ORPHANS: Do not end a line with a weak word like "y", "que", "de", "el", "la", "a", "con", "the", "and", "or". Push them to the next segment mantaining the natural flow and grammatical structure.
-    4. NATURAL FLOW:
-      - Split at natural pauses (commas, periods).
-      - Segments MUST NOT end with a comma (,) or a period (.), just ignore those punctuation marks at the end of each segment, only use them in between segments to guide splits.
-    5. FORMAT:
-      - Capitalize the first word of a segment ONLY if it starts a new sentence.
-      - Return ONLY a JSON array of strings.
+def _prometheus_escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
-    ### PATTERN EXAMPLES (Follow this Logic):
 
-    TYPE A: The "Preposition/Article" Split
-    BAD:  ["I went to the", "park with my friend"]
-    GOOD: ["I went to the park", "with my friend"]
-    (Reason: Keep "to the park" and "with my friend" as complete units.)
+class Metrics:
+    """
+    Counters and histograms for the /metrics endpoint, rendered in the
+    Prometheus text format. Worker processes call forward() and send their
+    observations to the parent with drain(), which replays them with merge().
+    """
 
-    TYPE B: The "Pronoun/Verb" Split
-    BAD:  ["Lo que realmente se", "merece es esto"]
-    GOOD: ["Lo que realmente se merece", "es esto"]
-    (Reason: "se" belongs to "merece". Never split them.)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}  # name -> (type, help text)
+        self._buckets = {}  # histogram name -> upper bounds
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self._pending = None  # observations not yet sent to the parent process
 
-Transcription text (in {language_name}):
-{text}
+    def define_counter(self, name, help_text):
+        self._help[name] = ("counter", help_text)
 
-Return the JSON array of segments:"""
+    def define_histogram(self, name, help_text, buckets):
+        self._help[name] = ("histogram", help_text)
+        self._buckets[name] = tuple(buckets)
 
-        generation_config = {
-            "temperature": 0.2,
-            "max_output_tokens": 8192,
-        }
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if self._pending is not None:
+                self._pending.append(("inc", name, amount, labels))
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._buckets[name]
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+            if self._pending is not None:
+                self._pending.append(("observe", name, value, labels))
 
+    @contextmanager
+    def time_stage(self, stage):
+        """
+        Observe the duration of the enclosed block as pipeline stage `stage`
+        (and record it as a span of a traced request).
+        """
+        start = time.perf_counter()
         try:
-            config_with_json = generation_config.copy()
-            config_with_json["response_mime_type"] = "application/json"
-            response = model.generate_content(
-                prompt, generation_config=config_with_json
-            )
-        except Exception:
-            print(
-                "Note: JSON MIME type enforcement not supported/failed, falling back to standard text generation."
-            )
-            response = model.generate_content(
-                prompt, generation_config=generation_config
+            with trace_span(stage):
+                yield
+        finally:
+            self.observe(
+                "whisperx_api_stage_seconds", time.perf_counter() - start, stage=stage
             )
 
-        response_text = response.text.strip()
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
 
-        # Robust JSON Parsing
-        cleaned_text = response_text
-        import re
+    def forward(self):
+        """Start collecting observations for drain() (in worker processes)."""
+        with self._lock:
+            self._pending = []
 
-        code_block = re.search(
-            r"```(?:json)?\s*(.*?)```", response_text, re.DOTALL | re.IGNORECASE
-        )
-        if code_block:
-            cleaned_text = code_block.group(1).strip()
+    def drain(self):
+        with self._lock:
+            pending = self._pending or []
+            if self._pending is not None:
+                self._pending = []
+        return pending
 
-        sentences = []
-        try:
-            sentences = json.loads(cleaned_text)
-        except json.JSONDecodeError:
-            json_array_match = re.search(r"(\[.*\])", response_text, re.DOTALL)
-            if json_array_match:
-                try:
-                    sentences = json.loads(json_array_match.group(1))
-                except json.JSONDecodeError:
-                    print(
-                        f"DEBUG: Failed to parse extracted JSON array. Raw snippet: {json_array_match.group(1)[:200]}..."
-                    )
-                    # Recover from truncated JSON
-                    try:
-                        potential_json = json_array_match.group(1)
-                        if not potential_json.strip().endswith("]"):
-                            print(
-                                "DEBUG: JSON appears truncated. Attempting simple repair..."
-                            )
-                            last_quote_idx = potential_json.rfind('"')
-                            if last_quote_idx > 0:
-                                repair_attempt = (
-                                    potential_json[: last_quote_idx + 1] + "]"
-                                )
-                                sentences = json.loads(repair_attempt)
-                                print("DEBUG: Repair successful.")
-                    except:
-                        pass
-
-                    if not sentences:
-                        raise ValueError("Could not parse Gemini response as JSON")
+    def merge(self, records):
+        """Replay observations drained in a worker process."""
+        for kind, name, value, labels in records:
+            if kind == "inc":
+                self.inc(name, value, **labels)
             else:
-                print(
-                    f"DEBUG: No valid JSON found. Raw Gemini Response: {response_text[:500]}"
-                )
-                if response_text.strip().startswith(
-                    "["
-                ) and not response_text.strip().endswith("]"):
-                    print(
-                        "DEBUG: Response starts with '[' but does not end with ']'. Likely token limit reached."
+                self.observe(name, value, **labels)
+
+    def render(self, gauges=()):
+        """
+        Prometheus text exposition of all metrics plus gauges, a list of
+        (name, help text, [(labels dict, value)]) computed by the caller.
+        """
+        lines = []
+
+        def fmt_labels(labels):
+            if not labels:
+                return ""
+            pairs = ",".join(f'{k}="{_prometheus_escape(str(v))}"' for k, v in labels)
+            return "{" + pairs + "}"
+
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(entry[0]), entry[1], entry[2])
+                for key, entry in self._histograms.items()
+            }
+
+        for name, (metric_type, help_text) in sorted(self._help.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{fmt_labels(labels)} {value}")
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(self._buckets[name], counts):
+                    bucket_labels = labels + (("le", repr(float(bound))),)
+                    lines.append(
+                        f"{name}_bucket{fmt_labels(bucket_labels)} {bucket_count}"
                     )
-                raise ValueError("Could not parse Gemini response as JSON")
+                lines.append(
+                    f'{name}_bucket{fmt_labels(labels + (("le", "+Inf"),))} {count}'
+                )
+                lines.append(f"{name}_sum{fmt_labels(labels)} {total}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {count}")
 
-        return sentences
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{fmt_labels(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
 
-    except Exception as e:
-        print(f"Error in Gemini call: {e}")
-        return None
 
+metrics = Metrics()
+metrics.define_histogram(
+    "whisperx_api_stage_seconds",
+    "Duration of each transcription pipeline stage in seconds.",
+    METRICS_STAGE_BUCKETS,
+)
+metrics.define_histogram(
+    "whisperx_api_real_time_factor",
+    "Processing time divided by audio duration, per transcription.",
+    METRICS_REAL_TIME_FACTOR_BUCKETS,
+)
+metrics.define_counter(
+    "whisperx_api_cache_lookups_total",
+    "Cache lookups by cache and result (hit or miss).",
+)
+metrics.define_counter(
+    "whisperx_api_transcriptions_total",
+    "Finished transcription jobs by final status.",
+)
 
-def split_segments_with_gemini(segments, gemini_api_key, detected_language="en"):
+
+class Tracer:
     """
-    Use Gemini 2.5 Flash to intelligently split long segments.
-    Processes in chunks to avoid token limits.
+    Timing spans of one traced request, as Chrome trace-event "complete"
+    events. Spans from job threads and worker processes are merged in, so
+    nesting shows per thread. The request and the job it started each
+    hold() the trace; it is written to TRACE_DIR when the last one releases
+    it, i.e. once the response has been sent and the job has finished.
     """
-    if not GEMINI_AVAILABLE:
-        print("Google Generative AI library not available. Returning segments as-is.")
-        return segments
-
-    if not gemini_api_key:
-        print("No Gemini API key provided. Returning segments as-is.")
-        return segments
 
-    try:
-        genai.configure(api_key=gemini_api_key)
-    except Exception as e:
-        print(f"Error configuring Gemini API: {e}")
-        return segments
+    def __init__(self, cprofile=False):
+        self.id = uuid.uuid4().hex
+        self.cprofile = cprofile
+        self.events = []
+        self.profile_stats = None  # cProfile stats of the transcription, if any
+        self._holders = 0
+        self._lock = threading.Lock()
 
-    if not segments:
-        return segments
+    def hold(self):
+        with self._lock:
+            self._holders += 1
 
-    try:
-        print(f"Using {GEMINI_MODEL_LABEL} to split segments (with chunking)...")
+    def release(self):
+        """Drop a hold(); the last one saves the trace."""
+        with self._lock:
+            self._holders -= 1
+            finished = self._holders == 0
+        if finished:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Could not write trace {self.id}: {e}")
 
-        # 1. Chunk segments by duration (e.g. 120 seconds per chunk)
-        CHUNK_DURATION_SECONDS = 120
-        chunks = []
-        current_chunk = []
-        chunk_start = segments[0].get("start", 0)
+    def add(self, name, start, end, **args):
+        """Record a span from start to end (time.time() seconds)."""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": max(0, int((end - start) * 1e6)),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": dict(args, thread=thread.name),
+        }
+        with self._lock:
+            self.events.append(event)
 
-        for seg in segments:
-            current_chunk.append(seg)
-            if seg.get("end", 0) - chunk_start >= CHUNK_DURATION_SECONDS:
-                chunks.append(current_chunk)
-                current_chunk = []
-                # Will set start time at next iteration or after loop
-                if segments.index(seg) + 1 < len(segments):
-                    chunk_start = segments[segments.index(seg) + 1].get("start", 0)
+    @contextmanager
+    def span(self, name, **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), **args)
 
-        if current_chunk:
-            chunks.append(current_chunk)
+    def merge(self, events, profile_stats=None):
+        """Add the spans (and cProfile stats) recorded by a worker process."""
+        with self._lock:
+            self.events.extend(events)
+        if profile_stats is not None:
+            self.profile_stats = profile_stats
 
-        print(
-            f"Split {len(segments)} segments into {len(chunks)} chunks for processing."
-        )
+    def profile(self, function, *args):
+        """Call function(*args), under cProfile if this trace asked for it."""
+        if not self.cprofile:
+            return function(*args)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Only one profiler can be active at a time
+            print(f"cProfile unavailable for trace {self.id}: {e}")
+            return function(*args)
+        try:
+            return function(*args)
+        finally:
+            profiler.disable()
+            profiler.create_stats()
+            self.profile_stats = profiler.stats
 
-        final_processed_segments = []
+    def reference(self):
+        """Where the saved trace (and profile) can be fetched, for the response."""
+        reference = {"trace_id": self.id, "trace_url": f"/traces/{self.id}.json"}
+        if self.cprofile:
+            reference["profile_url"] = f"/traces/{self.id}.prof"
+        return reference
 
-        for i, chunk in enumerate(chunks):
-            print(f"Processing chunk {i+1}/{len(chunks)} ({len(chunk)} segments)...")
+    def save(self):
+        """Write the trace (and the cProfile dump) to TRACE_DIR."""
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+        # Name the processes and threads in the trace viewer
+        names = {}
+        for event in events:
+            names[(event["pid"], event["tid"])] = event["args"]["thread"]
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for (pid, tid), name in names.items()
+        ]
+        metadata += [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "server" if pid == os.getpid() else f"worker {pid}"},
+            }
+            for pid in {pid for pid, _ in names}
+        ]
+        path = os.path.join(TRACE_DIR, f"{self.id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+        if self.profile_stats is not None:
+            # The format pstats.Stats reads (cProfile.Profile.dump_stats)
+            with open(os.path.join(TRACE_DIR, f"{self.id}.prof"), "wb") as f:
+                marshal.dump(self.profile_stats, f)
+        print(f"Trace of {len(events)} spans written to {path}.")
+        remove_old_traces()
 
-            # Prepare text for this chunk
-            chunk_texts = [
-                s.get("text", "").strip() for s in chunk if s.get("text", "").strip()
-            ]
-            if not chunk_texts:
-                continue
 
-            combined_text = " ".join(chunk_texts)
+_trace_state = threading.local()
 
-            # Calculate chunk boundaries
-            chunk_start_time = chunk[0].get("start", 0)
-            chunk_end_time = chunk[-1].get("end", 0)
-            chunk_duration = chunk_end_time - chunk_start_time
 
-            # Call Gemini
-            sentences = _call_gemini_split(
-                combined_text, detected_language, gemini_api_key
-            )
+def current_tracer():
+    """The Tracer of the request or job handled by this thread, or None."""
+    return getattr(_trace_state, "tracer", None)
 
-            if not sentences or not isinstance(sentences, list) or len(sentences) == 0:
-                print(f"Gemini failed for chunk {i+1}, using original chunk segments.")
-                final_processed_segments.extend(chunk)
-                continue
 
-            # Map sentences to timestamps
-            total_chars = len(combined_text)
-            current_char_pos = 0
+@contextmanager
+def tracing(tracer):
+    """Make tracer (may be None) the current tracer of this thread."""
+    previous = current_tracer()
+    _trace_state.tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _trace_state.tracer = previous
 
-            for j, sentence in enumerate(sentences):
-                if not sentence or not sentence.strip():
-                    continue
 
-                sentence = sentence.strip()
-                sentence_chars = len(sentence)
-
-                # Calculate proportional timing relative to chunk start
-                if total_chars > 0:
-                    char_proportion_start = current_char_pos / total_chars
-                    char_proportion_end = (
-                        current_char_pos + sentence_chars
-                    ) / total_chars
-                else:
-                    char_proportion_start = j / len(sentences)
-                    char_proportion_end = (j + 1) / len(sentences)
-
-                sentence_start = chunk_start_time + (
-                    chunk_duration * char_proportion_start
-                )
-                sentence_end = chunk_start_time + (chunk_duration * char_proportion_end)
+@contextmanager
+def trace_span(name, **args):
+    """Record the enclosed block as a span of the current trace, if any."""
+    tracer = current_tracer()
+    if tracer is None:
+        yield
+        return
+    with tracer.span(name, **args):
+        yield
 
-                # Clamp to chunk boundaries
-                sentence_end = min(sentence_end, chunk_end_time)
 
-                final_processed_segments.append(
-                    {"text": sentence, "start": sentence_start, "end": sentence_end}
-                )
+def traced(function):
+    """Wrap function to run under the calling thread's tracer in another thread."""
+    tracer = current_tracer()
+    if tracer is None:
+        return function
 
-                current_char_pos += sentence_chars + 1  # +1 for space
+    def run(*args, **kwargs):
+        with tracing(tracer):
+            return function(*args, **kwargs)
 
-        return final_processed_segments
+    return run
 
-    except Exception as e:
-        print(f"Error calling Gemini for sentence splitting: {e}")
-        print("Falling back to original segments.")
-        return segments
 
+def profiled(function, *args):
+    """Call function(*args) under cProfile if the current trace asked for it."""
+    tracer = current_tracer()
+    if tracer is None:
+        return function(*args)
+    return tracer.profile(function, *args)
 
-@app.route("/transcribe", methods=["POST"])
-def transcribe_audio():
-    if model is None:
-        return (
-            jsonify({"error": "WhisperX model is not loaded. Check server logs."}),
-            500,
-        )
 
-    if "audio" not in request.files:
-        return jsonify({"error": "No audio file part in the request"}), 400
+def request_tracer(params):
+    """
+    Tracer for the current request: profile=1 traces it, profile=cprofile
+    also profiles it, and TRACE_SAMPLE_RATE of the others are traced too.
+    """
+    profile = params.get("profile", "").strip().lower()
+    if profile == "cprofile":
+        return Tracer(cprofile=True)
+    if profile in ("1", "true", "yes", "on") or (
+        TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    ):
+        return Tracer()
+    return None
 
-    file = request.files["audio"]
-    if file.filename == "":
-        return jsonify({"error": "No selected file"}), 400
 
-    # Get transcription level parameter (word or sentence)
-    transcription_level = request.form.get("transcription_level", "word")
-    if transcription_level not in ["word", "sentence"]:
-        transcription_level = "word"
+def remove_old_traces(max_files=TRACE_MAX_FILES):
+    """Delete the oldest files in TRACE_DIR beyond max_files."""
+    try:
+        paths = [os.path.join(TRACE_DIR, name) for name in os.listdir(TRACE_DIR)]
+        paths.sort(key=os.path.getmtime)
+    except OSError:
+        return
+    for path in paths[: max(0, len(paths) - max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
-    # Get Gemini API key (optional, only needed for sentence-level splitting)
-    gemini_api_key = request.form.get("gemini_api_key", "").strip()
 
-    # Get language (optional, to skip auto-detection)
-    language_code = request.form.get("language", "").strip()
-    if language_code == "":
-        language_code = None  # Use auto-detect if empty
+class DiskCache:
+    """
+    Size-bounded on-disk cache of JSON values with least-recently-used eviction.
+    Every entry is one file named after its key plus suffix. The file access
+    time is refreshed on each hit, so the LRU order survives server restarts,
+    while the modification time records when the entry was written; entries
+    older than max_age_seconds (if given) are treated as misses and removed.
+    Worker processes and other servers may share the directory, so lookups
+    also find entries this process has not indexed, and eviction goes by a
+    fresh scan of the directory rather than this process's own accounting.
+    The directory is indexed on first use (see load_index), not at import.
+    """
 
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        temp_file_path = None
+    suffix = ".json"
 
+    def __init__(
+        self, directory, max_bytes, name="cache", max_age_seconds=None, label=None
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.name = name
+        # Value of the "cache" label in /metrics
+        self.label = label or os.path.basename(directory)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, oldest first
+        self._total_bytes = 0
+        self._indexed = False
         try:
-            if not os.path.exists(app.config["UPLOAD_FOLDER"]):
-                print(
-                    f"Upload folder {app.config['UPLOAD_FOLDER']} not found during request. Attempting to create."
-                )
-                try:
-                    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-                except Exception as e_mkdir:
-                    print(f"Failed to create upload folder during request: {e_mkdir}")
-                    return (
-                        jsonify(
-                            {
-                                "error": "Server configuration issue: cannot create upload directory."
-                            }
-                        ),
-                        500,
-                    )
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            print(f"{self.name}: could not create cache directory {directory}: {e}")
 
-            temp_fd, temp_file_path = tempfile.mkstemp(
-                suffix=os.path.splitext(filename)[1], dir=app.config["UPLOAD_FOLDER"]
-            )
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
 
-            with os.fdopen(temp_fd, "wb") as tmp:
-                file.save(tmp)
+    def _scan(self):
+        """
+        Index the entries on disk, least recently used first, removing
+        expired ones.
+        """
+        found = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                    if self._expired(stat.st_mtime, now):
+                        os.remove(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue  # Evicted by another process meanwhile
+                key = entry.name[: -len(self.suffix)]
+                found.append((stat.st_atime, key, stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(found))
+        self._total_bytes = sum(self._entries.values())
 
-            print(f"Loading audio for WhisperX: {temp_file_path}")
-            audio = whisperx.load_audio(temp_file_path)
+    def load_index(self):
+        """
+        Index the directory if that has not happened yet. Runs on first use,
+        or earlier on a background thread at startup (see index_caches).
+        """
+        with self._lock:
+            self._ensure_index()
 
+    def _ensure_index(self):
+        """load_index with the lock held."""
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            self._scan()
             print(
-                f"Transcribing with WhisperX model ({MODEL_SIZE}, Language: {language_code if language_code else 'auto-detect'})..."
-            )
-            transcribe_start_time = time.time()
-            # When language=None in load_model, transcribe will detect the language.
-            # If language_code is provided, transcribe refers to it.
-            result = model.transcribe(
-                audio, batch_size=BATCH_SIZE, language=language_code
+                f"{self.name}: {len(self._entries)} entries ({self._total_bytes / 1e6:.1f} MB) in {self.directory}"
             )
-            transcribe_duration = time.time() - transcribe_start_time
-
-            detected_language = result.get("language")
-            if not detected_language:
-                print("Error: WhisperX could not detect the language of the audio.")
-                return jsonify({"error": "Language detection failed."}), 500
+        except Exception as e:
+            print(f"{self.name}: could not index cache directory {self.directory}: {e}")
 
-            print(
-                f"Initial transcription completed in {transcribe_duration:.2f}s. Detected language: {detected_language}"
-            )
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        return self._lookup(key, self._load)
 
-            final_segments = result["segments"]
-            full_text = " ".join(
-                [
-                    segment["text"].strip()
-                    for segment in final_segments
-                    if "text" in segment
-                ]
-            )
+    def get_path(self, key):
+        """Return the path of the file cached for key without reading it, or None."""
+        return self._lookup(key, lambda path: path)
 
-            # Only perform word-level alignment if transcription_level is 'word'
-            if transcription_level == "word":
+    def _lookup(self, key, load):
+        with self._lock:
+            self._ensure_index()
+            path = self._path(key)
+            if key not in self._entries:
+                # Possibly written by another process since the last scan
                 try:
-                    print(
-                        f"Loading alignment model for detected language: {detected_language}..."
-                    )
-                    align_model_start_time = time.time()
-                    align_model, metadata = whisperx.load_align_model(
-                        language_code=detected_language, device=DEVICE
-                    )
-                    align_model_duration = time.time() - align_model_start_time
-                    print(
-                        f"Alignment model for '{detected_language}' loaded in {align_model_duration:.2f}s."
-                    )
-
-                    print("Aligning transcription...")
-                    align_start_time = time.time()
-                    result_aligned = whisperx.align(
-                        result["segments"],
-                        align_model,
-                        metadata,
-                        audio,
-                        DEVICE,
-                        return_char_alignments=False,
-                    )
-                    align_duration = time.time() - align_start_time
-                    print(f"Alignment completed in {align_duration:.2f}s.")
-
-                    final_segments = result_aligned["segments"]
-                    full_text = " ".join(
-                        [
-                            segment["text"].strip()
-                            for segment in final_segments
-                            if "text" in segment
-                        ]
-                    )
+                    self._entries[key] = os.path.getsize(path)
+                except OSError:
+                    self._record(False)
+                    return None
+                self._total_bytes += self._entries[key]
+            try:
+                written_at = os.stat(path).st_mtime
+                if self._expired(written_at, time.time()):
+                    self._forget(key)
+                    self._record(False)
+                    return None
+                value = load(path)
+                # Record the access for LRU order but keep the write time for expiry
+                os.utime(path, (time.time(), written_at))
+            except Exception as e:
+                print(f"{self.name}: dropping unreadable entry {key}: {e}")
+                self._forget(key)
+                self._record(False)
+                return None
+            self._entries.move_to_end(key)
+            self._record(True)
+            return value
 
-                except Exception as align_e:
-                    print(
-                        f"Could not align transcription for language '{detected_language}': {align_e}"
-                    )
-                    print(
-                        "Proceeding with segment-level timestamps only from initial transcription."
-                    )
-                    # final_segments is already from model.transcribe if alignment fails
-                    for seg in final_segments:
-                        seg["words_error"] = (
-                            f"Alignment failed for language {detected_language}: {str(align_e)}"
-                        )
-            else:
-                print(
-                    f"Sentence-level transcription requested. Skipping word alignment."
-                )
-                # Use Gemini to intelligently split long segments into shorter sentences
-                if gemini_api_key:
-                    print(
-                        f"Using {GEMINI_MODEL_LABEL} to split segments into captionable sentences..."
-                    )
-                    final_segments = split_segments_with_gemini(
-                        final_segments, gemini_api_key, detected_language
-                    )
-                    # Recalculate full_text after Gemini splitting
-                    full_text = " ".join(
-                        [
-                            segment["text"].strip()
-                            for segment in final_segments
-                            if "text" in segment
-                        ]
-                    )
-                else:
-                    print("No Gemini API key provided. Using original segments as-is.")
+    def _load(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
 
-            audio_duration = 0
-            if final_segments and "end" in final_segments[-1]:
-                audio_duration = final_segments[-1]["end"]
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.inc(
+            "whisperx_api_cache_lookups_total",
+            cache=self.label,
+            result="hit" if hit else "miss",
+        )
 
-            response_data = {
-                "language": detected_language,
-                "duration_seconds": audio_duration,
-                "full_text": full_text.strip(),
-                "segments": final_segments,
-                "transcription_level": transcription_level,
-            }
-            return jsonify(response_data), 200
+    def put(self, key, value):
+        """Store value under key and evict old entries if over budget."""
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            path = self._path(key)
+            tmp_path = self.temp_path(key)
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"{self.name}: could not write entry {key}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._insert(key, len(data))
 
-        except Exception as e:
-            print(f"Error during WhisperX transcription or alignment: {e}")
-            import traceback
+    def temp_path(self, key):
+        """Path to write a new entry for key to before handing it to put_file."""
+        return f"{self._path(key)}.{threading.get_ident()}.tmp"
 
-            traceback.print_exc()
-            return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
-        finally:
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                    print(f"Cleaned up temporary file: {temp_file_path}")
-                except Exception as e_remove:
-                    print(
-                        f"Error cleaning up temporary file {temp_file_path}: {e_remove}"
-                    )
-    else:
-        return jsonify({"error": "File type not allowed"}), 400
+    def put_file(self, key, file_path):
+        """
+        Move the finished file at file_path into the cache as the entry for
+        key (e.g. a result written incrementally). Returns the entry's path,
+        or None if the file is larger than the whole cache and was left alone.
+        """
+        size = os.path.getsize(file_path)
+        if size > self.max_bytes:
+            return None
+        path = self._path(key)
+        with self._lock:
+            try:
+                os.replace(file_path, path)
+            except PermissionError:
+                # On Windows an entry that is open (e.g. memory-mapped by
+                # another job) cannot be replaced. Entries are named after
+                # their content, so keep the existing one
+                if not os.path.exists(path):
+                    raise
+                print(f"{self.name}: entry {key} is in use; keeping it.")
+                remove_temp_file(file_path)
+                size = os.path.getsize(path)
+            self._insert(key, size)
+        return path
 
+    def _insert(self, key, size):
+        """Account for a newly written entry and evict old ones; holds the lock."""
+        self._ensure_index()
+        # Count what all processes have written, not only this one; writes
+        # are rare next to the transcriptions that produce them
+        try:
+            self._scan()
+        except OSError as e:
+            print(f"{self.name}: could not rescan {self.directory}: {e}")
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._total_bytes += size
+        for oldest in list(self._entries)[:-1]:
+            if self._total_bytes <= self.max_bytes:
+                break
+            # Entries that cannot be removed yet (e.g. mapped on Windows)
+            # stay counted and are retried on the next insert
+            self._forget(oldest)
 
-@app.route("/health", methods=["GET"])
-def health_check():
-    if model is not None:
-        return (
-            jsonify(
-                {
-                    "status": "API is running",
-                    "model_loaded": True,
-                    "model_type": "WhisperX",
-                    "model_size": MODEL_SIZE,
-                    "language_setting": "auto-detect",
-                }
-            ),
-            200,
-        )
-    else:
+    def _expired(self, written_at, now):
         return (
-            jsonify(
-                {
-                    "status": "API is running",
-                    "model_loaded": False,
-                    "language_setting": "auto-detect",
-                    "error": "WhisperX Model failed to load",
-                }
-            ),
-            500,
+            self.max_age_seconds is not None and now - written_at > self.max_age_seconds
         )
 
+    def _forget(self, key):
+        """Remove the entry for key; it stays indexed if its file cannot be removed."""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"{self.name}: could not remove entry {key}: {e}")
+            return
+        self._total_bytes -= self._entries.pop(key, 0)
 
-if __name__ == "__main__":
-    if model is None:
-        print(
-            "CRITICAL: WhisperX model could not be loaded. The API will not function correctly."
-        )
-        # Consider exiting if model loading is absolutely critical for the app to even start
-        # sys.exit(1)
+    def stats(self):
+        with self._lock:
+            self._ensure_index()
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
 
-    if not os.path.exists(UPLOAD_FOLDER):
-        print(
+
+class AudioCache(DiskCache):
+    """
+    DiskCache of decoded 16 kHz float32 audio, one .npy file per content hash.
+    Hits are opened as copy-on-write memory maps, so repeated requests and
+    worker processes read the samples from the page cache without copying.
+    """
+
+    suffix = ".npy"
+
+    def _load(self, path):
+        return np.load(path, mmap_mode="c")
+
+    def put(self, key, audio):
+        """
+        Store audio under key. Returns a memory map of the stored file, or audio
+        itself when it could not be stored.
+        """
+        audio = np.asarray(audio, dtype=np.float32)
+        if audio.nbytes > self.max_bytes:
+            return audio
+        # Written outside the lock: long recordings take a while to save
+        tmp_path = self.temp_path(key)
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, audio)
+            return np.load(self.put_file(key, tmp_path), mmap_mode="c")
+        except Exception as e:
+            print(f"{self.name}: could not write entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return audio
+
+
+result_cache = (
+    DiskCache(
+        RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, name="Result cache", label="results"
+    )
+    if RESULT_CACHE_ENABLED
+    else None
+)
+split_cache = (
+    DiskCache(
+        SPLIT_CACHE_DIR,
+        SPLIT_CACHE_MAX_BYTES,
+        name="Sentence split cache",
+        label="splits",
+        max_age_seconds=SPLIT_CACHE_MAX_AGE_SECONDS,
+    )
+    if SPLIT_CACHE_ENABLED
+    else None
+)
+language_cache = (
+    DiskCache(
+        LANGUAGE_CACHE_DIR,
+        LANGUAGE_CACHE_MAX_BYTES,
+        name="Language cache",
+        label="languages",
+    )
+    if LANGUAGE_PROBE_ENABLED
+    else None
+)
+audio_cache = (
+    AudioCache(
+        AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, name="Audio cache", label="audio"
+    )
+    if AUDIO_CACHE_ENABLED
+    else None
+)
+
+
+def index_caches():
+    """Index the on-disk caches, so the first requests don't wait for the scans."""
+    for cache in (result_cache, split_cache, language_cache, audio_cache):
+        if cache is not None:
+            cache.load_index()
+
+
+def _model_memory_bytes(align_model):
+    """Estimate the parameter memory of a (torch) alignment model in bytes."""
+    try:
+        return sum(p.numel() * p.element_size() for p in align_model.parameters())
+    except Exception:
+        return 0
+
+
+class AlignModelPool:
+    """
+    Process-wide registry of WhisperX alignment models, one per language code,
+    with least-recently-used eviction bounded by model count and optionally by
+    parameter memory.
+    """
+
+    def __init__(self, max_models, max_bytes=0, device="cpu"):
+        self.max_models = max(1, max_models)
+        self.max_bytes = max_bytes
+        self.device = device
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._models = OrderedDict()  # language -> (model, metadata, size_bytes)
+        self._load_locks = {}  # language -> Lock, so a language is loaded only once
+
+    def get(self, language_code):
+        """Return (align_model, metadata) for language_code, loading it if needed."""
+        with self._lock:
+            entry = self._models.get(language_code)
+            if entry is not None:
+                self._models.move_to_end(language_code)
+                self.hits += 1
+                metrics.inc(
+                    "whisperx_api_cache_lookups_total",
+                    cache="alignment_models",
+                    result="hit",
+                )
+                return entry[0], entry[1]
+            load_lock = self._load_locks.setdefault(language_code, threading.Lock())
+
+        with load_lock:
+            # Another request may have finished loading while we waited
+            with self._lock:
+                entry = self._models.get(language_code)
+                if entry is not None:
+                    self._models.move_to_end(language_code)
+                    self.hits += 1
+                    metrics.inc(
+                        "whisperx_api_cache_lookups_total",
+                        cache="alignment_models",
+                        result="hit",
+                    )
+                    return entry[0], entry[1]
+
+            print(f"Loading alignment model for language: {language_code}...")
+            load_start_time = time.time()
+            metrics.inc(
+                "whisperx_api_cache_lookups_total",
+                cache="alignment_models",
+                result="miss",
+            )
+            import whisperx  # Imported on first use: it takes seconds (torch)
+
+            with metrics.time_stage("align_model_load"):
+                align_model, metadata = whisperx.load_align_model(
+                    language_code=language_code, device=self.device
+                )
+            size_bytes = _model_memory_bytes(align_model)
+            print(
+                f"Alignment model for '{language_code}' loaded in {time.time() - load_start_time:.2f}s "
+                f"({size_bytes / 1e6:.0f} MB)."
+            )
+
+            with self._lock:
+                self._models[language_code] = (align_model, metadata, size_bytes)
+                self.loads += 1
+                self._evict()
+            return align_model, metadata
+
+    def _evict(self):
+        # Never evict the most recently added model, even if it alone exceeds the budget
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models
+            or (self.max_bytes and self._resident_bytes() > self.max_bytes)
+        ):
+            language_code, _ = self._models.popitem(last=False)
+            self.evictions += 1
+            print(f"Evicted alignment model for '{language_code}' from the pool.")
+
+    def _resident_bytes(self):
+        return sum(entry[2] for entry in self._models.values())
+
+    def preload(self, language_codes):
+        for language_code in language_codes:
+            try:
+                self.get(language_code)
+            except Exception as e:
+                print(f"Could not preload alignment model for '{language_code}': {e}")
+
+    def prefetch(self, language_code):
+        """Start loading the model for language_code in the background."""
+        threading.Thread(
+            target=traced(self.preload),
+            args=([language_code],),
+            name=f"align-prefetch-{language_code}",
+            daemon=True,
+        ).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": [
+                    {"language": lang, "size_bytes": entry[2]}
+                    for lang, entry in self._models.items()
+                ],
+                "max_models": self.max_models,
+                "max_bytes": self.max_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+align_model_pool = AlignModelPool(
+    ALIGN_MODEL_POOL_SIZE, ALIGN_MODEL_POOL_MAX_BYTES, device=DEVICE
+)
+
+
+class ModelRegistry:
+    """
+    WhisperX transcription models keyed by model size. Models are loaded
+    lazily on first use (or by warmup() in the background) and the least
+    recently used one is unloaded once more than max_models are resident.
+    """
+
+    def __init__(self, max_models):
+        self.max_models = max(1, max_models)
+        self._lock = threading.Lock()
+        self._models = OrderedDict()  # model size -> loaded model, oldest first
+        self._errors = {}  # model size -> last load error message
+        self._loading = set()
+        self._load_locks = {}
+
+    def get(self, model_size):
+        """
+        Return the loaded model for model_size, loading it if needed.
+        Raises PipelineError if it cannot be loaded.
+        """
+        with self._lock:
+            if model_size in self._models:
+                self._models.move_to_end(model_size)
+                return self._models[model_size]
+            load_lock = self._load_locks.setdefault(model_size, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if model_size in self._models:
+                    self._models.move_to_end(model_size)
+                    return self._models[model_size]
+                self._loading.add(model_size)
+
+            print(
+                f"Loading WhisperX model: {model_size} (language: auto-detect) on {DEVICE} with {COMPUTE_TYPE} compute type..."
+            )
+            load_start_time = time.time()
+            try:
+                import whisperx  # Imported on first use: it takes seconds (torch)
+
+                loaded_model = whisperx.load_model(
+                    model_size,
+                    device=DEVICE,
+                    compute_type=COMPUTE_TYPE,
+                    language=None,  # Set to None for automatic language detection
+                    threads=CPU_THREADS,
+                )
+            except Exception as e:
+                print(f"Error loading WhisperX model: {e}")
+                print(
+                    "Please ensure you have a working internet connection for the first download,"
+                )
+                print(
+                    "and that the model size/type is correct and WhisperX is installed properly."
+                )
+                with self._lock:
+                    self._loading.discard(model_size)
+                    self._errors[model_size] = str(e)
+                raise PipelineError(
+                    f"WhisperX model '{model_size}' could not be loaded: {e}", 503
+                )
+
+            print(
+                f"WhisperX Model {model_size} (Language: auto-detect) loaded successfully in {time.time() - load_start_time:.2f}s."
+            )
+            with self._lock:
+                self._loading.discard(model_size)
+                self._errors.pop(model_size, None)
+                self._models[model_size] = loaded_model
+                while len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    print(f"Unloaded WhisperX model {evicted} (registry full).")
+            return loaded_model
+
+    def is_ready(self, model_size):
+        with self._lock:
+            return model_size in self._models
+
+    def load_error(self, model_size):
+        with self._lock:
+            return self._errors.get(model_size)
+
+    def warmup(self, model_sizes, align_languages=()):
+        """Load the given models (and alignment models) on a background thread."""
+
+        def _warm():
+            for model_size in model_sizes:
+                try:
+                    self.get(model_size)
+                except PipelineError:
+                    pass
+            if align_languages:
+                print(f"Preloading alignment models: {', '.join(align_languages)}")
+                align_model_pool.preload(align_languages)
+
+        if model_sizes or align_languages:
+            threading.Thread(target=_warm, name="model-warmup", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._models),
+                "loading": sorted(self._loading),
+                "failed": dict(self._errors),
+                "max_models": self.max_models,
+                "allowed": ALLOWED_MODELS,
+            }
+
+
+model_registry = ModelRegistry(MAX_LOADED_MODELS)
+
+
+def save_upload(stream, dest, digest=None, head=b""):
+    """
+    Copy the binary stream of an upload, after the head already read from
+    it, into the open binary file object dest and return the SHA-256 hex
+    digest of its contents (fed to digest, if given).
+    """
+    digest = digest or hashlib.sha256()
+    digest.update(head)
+    dest.write(head)
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dest.write(chunk)
+    return digest.hexdigest()
+
+
+def _read_stream(stream, digest, size):
+    """
+    Read up to size bytes of a binary stream into one preallocated buffer,
+    feeding digest on the way.
+    """
+    data = bytearray(size)
+    position = 0
+    while position < size:
+        chunk = stream.read(min(UPLOAD_CHUNK_SIZE, size - position))
+        if not chunk:
+            break
+        digest.update(chunk)
+        data[position : position + len(chunk)] = chunk
+        position += len(chunk)
+    del data[position:]
+    return data
+
+
+def _pcm_to_float(data, sample_format, bits):
+    """Convert little-endian PCM bytes to float32 samples in [-1, 1]."""
+    if sample_format == 3 and bits == 32:
+        return np.frombuffer(data, dtype="<f4").astype(np.float32, copy=False)
+    if sample_format == 3 and bits == 64:
+        return np.frombuffer(data, dtype="<f8").astype(np.float32)
+    if sample_format != 1:
+        raise PipelineError(f"Unsupported WAV sample format {sample_format}.", 415)
+    if bits == 8:
+        samples = np.frombuffer(data, dtype=np.uint8).astype(np.float32)
+        return (samples - 128.0) / 128.0
+    if bits == 16:
+        return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    if bits == 24:
+        raw = np.frombuffer(data[: len(data) - len(data) % 3], dtype=np.uint8)
+        raw = raw.reshape(-1, 3).astype(np.int32)
+        samples = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(samples >= 1 << 23, samples - (1 << 24), samples)
+        return samples.astype(np.float32) / float(1 << 23)
+    if bits == 32:
+        return np.frombuffer(data, dtype="<i4").astype(np.float32) / float(1 << 31)
+    raise PipelineError(f"Unsupported WAV bit depth {bits}.", 415)
+
+
+def read_wav_layout(read, size):
+    """
+    Walk the RIFF chunks of a WAV file of size bytes up to its data chunk;
+    read(position, count) returns the file's bytes there. Returns
+    (sample_format, channels, sample_rate, bits, data_start, data_end),
+    data_end trimmed to whole frames. Raises PipelineError (415) for files
+    that are not WAV.
+    """
+    riff = read(0, 12)
+    if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise PipelineError("Not a RIFF/WAVE file.", 415)
+
+    fmt = None
+    position = 12
+    while position + 8 <= size:
+        header = read(position, 8)
+        chunk_id = header[:4]
+        chunk_size = int.from_bytes(header[4:8], "little")
+        body_start = position + 8
+        if chunk_id == b"fmt ":
+            body = read(body_start, min(chunk_size, 26))
+            sample_format = int.from_bytes(body[0:2], "little")
+            channels = int.from_bytes(body[2:4], "little")
+            sample_rate = int.from_bytes(body[4:8], "little")
+            bits = int.from_bytes(body[14:16], "little")
+            if sample_format == 0xFFFE and chunk_size >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: the real format is in the sub-format GUID
+                sample_format = int.from_bytes(body[24:26], "little")
+            fmt = (sample_format, max(1, channels), sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise PipelineError("WAV data chunk before the fmt chunk.", 415)
+            # Streamed WAVs may leave the size as 0 or 0xFFFFFFFF; use what is there
+            body_end = size
+            if 0 < chunk_size <= size - body_start:
+                body_end = body_start + chunk_size
+            frame_bytes = max(1, fmt[1] * fmt[3] // 8)
+            body_end -= (body_end - body_start) % frame_bytes
+            return fmt + (body_start, body_end)
+        position = body_start + chunk_size + (chunk_size & 1)
+    raise PipelineError("WAV file has no data chunk.", 415)
+
+
+def _pcm_to_mono(data, sample_format, bits, channels):
+    """
+    Convert interleaved PCM bytes to mono float32 samples a block at a time,
+    straight into the output array, so no full-size intermediate arrays are
+    made.
+    """
+    frame_bytes = max(1, channels * bits // 8)
+    frames = len(data) // frame_bytes
+    block = max(frame_bytes, UPLOAD_CHUNK_SIZE - UPLOAD_CHUNK_SIZE % frame_bytes)
+    view = memoryview(data)[: frames * frame_bytes]
+    samples = np.empty(frames, np.float32)
+    for start in range(0, len(view), block):
+        pcm = _pcm_to_float(view[start : start + block], sample_format, bits)
+        if channels > 1:
+            pcm = pcm.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+        first = start // frame_bytes
+        samples[first : first + len(pcm)] = pcm
+    return samples
+
+
+def wav_header(audio_format, sample_rate, channels, data_bytes):
+    """RIFF/WAVE header for data_bytes of raw PCM in one of RAW_AUDIO_FORMATS."""
+    dtype = np.dtype(RAW_AUDIO_FORMATS[audio_format])
+    block_align = channels * dtype.itemsize
+    data_bytes = min(data_bytes, 0xFFFFFFFF - 36)  # Readers take the rest as data
+    fields = (
+        (16, 4),
+        (3 if dtype.kind == "f" else 1, 2),
+        (channels, 2),
+        (sample_rate, 4),
+        (sample_rate * block_align, 4),
+        (block_align, 2),
+        (dtype.itemsize * 8, 2),
+    )
+    return (
+        b"RIFF"
+        + (36 + data_bytes).to_bytes(4, "little")
+        + b"WAVEfmt "
+        + b"".join(value.to_bytes(size, "little") for value, size in fields)
+        + b"data"
+        + data_bytes.to_bytes(4, "little")
+    )
+
+
+def _convert_pcm_to_npy(stream, out, data_bytes, sample_format, bits, channels):
+    """
+    Convert data_bytes of PCM from stream to mono float32 written to out,
+    UPLOAD_CHUNK_SIZE at a time. Returns the number of samples written.
+    """
+    frame_bytes = max(1, channels * bits // 8)
+    block = max(frame_bytes, UPLOAD_CHUNK_SIZE - UPLOAD_CHUNK_SIZE % frame_bytes)
+    samples = 0
+    while data_bytes > 0:
+        chunk = stream.read(min(block, data_bytes))
+        if len(chunk) < frame_bytes:
+            break
+        pcm = _pcm_to_mono(chunk, sample_format, bits, channels)
+        out.write(pcm)
+        samples += len(pcm)
+        data_bytes -= len(chunk)
+    return samples
+
+
+def _resample_poly_numpy(samples, up, down):
+    """
+    Polyphase windowed-sinc resampling by up/down in vectorized numpy blocks
+    (the fallback when scipy is not installed).
+    """
+    max_rate = max(up, down)
+    half_len = RESAMPLE_HALF_TAPS * max_rate
+    t = np.arange(-half_len, half_len + 1)
+    taps = np.sinc(t / max_rate) / max_rate * np.kaiser(len(t), 5.0)
+    taps *= up / taps.sum()
+    # phases[r, k] = taps[r + k * up]: the taps that hit real input samples
+    phase_taps = -(-len(taps) // up)
+    padded = np.zeros(phase_taps * up)
+    padded[: len(taps)] = taps
+    phases = padded.reshape(phase_taps, up).T.astype(np.float32)
+
+    out_len = -(-len(samples) * up // down)
+    source = np.concatenate(
+        [
+            np.zeros(phase_taps, np.float32),
+            samples.astype(np.float32, copy=False),
+            np.zeros(phase_taps, np.float32),
+        ]
+    )
+    out = np.empty(out_len, np.float32)
+    k = np.arange(phase_taps)
+    for block_start in range(0, out_len, RESAMPLE_BLOCK_SIZE):
+        n = np.arange(block_start, min(out_len, block_start + RESAMPLE_BLOCK_SIZE))
+        position = n * down + half_len
+        base = position // up
+        index = np.clip(base[:, None] - k[None, :] + phase_taps, 0, len(source) - 1)
+        out[n] = np.einsum("ij,ij->i", phases[position % up], source[index])
+    return out
+
+
+def resample_audio(samples, orig_rate, target_rate=SAMPLE_RATE):
+    """Resample float32 samples from orig_rate to target_rate in-process."""
+    if orig_rate == target_rate or len(samples) == 0:
+        return samples
+    divisor = math.gcd(int(orig_rate), int(target_rate))
+    up, down = int(target_rate) // divisor, int(orig_rate) // divisor
+    if SCIPY_AVAILABLE:
+        return resample_poly(samples, up, down).astype(np.float32, copy=False)
+    return _resample_poly_numpy(samples, up, down)
+
+
+def load_audio(audio_path):
+    """Decode audio_path with whisperx.load_audio (ffmpeg), importing whisperx."""
+    import whisperx
+
+    return whisperx.load_audio(audio_path)
+
+
+def decode_audio_bytes(data, audio_format, sample_rate=SAMPLE_RATE, channels=1):
+    """
+    Decode an in-memory WAV file or raw little-endian PCM into the 16 kHz mono
+    float32 array whisperx expects (the same output as whisperx.load_audio).
+    Raises PipelineError (415) for WAVs that are not uncompressed PCM or
+    IEEE float.
+    """
+    if audio_format == "wav":
+        layout = read_wav_layout(
+            lambda position, count: data[position : position + count], len(data)
+        )
+        sample_format, channels, sample_rate, bits, start, end = layout
+        data = memoryview(data)[start:end]
+    elif audio_format in RAW_AUDIO_FORMATS:
+        dtype = np.dtype(RAW_AUDIO_FORMATS[audio_format])
+        sample_format, bits = (3 if dtype.kind == "f" else 1), dtype.itemsize * 8
+    else:
+        raise PipelineError(f"Unsupported audio format '{audio_format}'.", 415)
+
+    if sample_rate <= 0:
+        raise PipelineError("Invalid sample rate.", 400)
+    samples = _pcm_to_mono(data, sample_format, bits, channels)
+    return resample_audio(samples, sample_rate)
+
+
+def result_cache_key(audio_hash, options):
+    """
+    Build the result cache key from the audio hash, the server-side model
+    settings and every request option that changes the transcription output.
+    """
+    params = {
+        "audio": audio_hash,
+        "model_size": MODEL_SIZE,
+        "compute_type": COMPUTE_TYPE,
+    }
+    params.update(options)
+    return hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def language_cache_key(audio_hash, model_size):
+    """Key of the language detected in the audio with audio_hash by model_size."""
+    params = {"audio": audio_hash, "model_size": model_size, "detect": "language"}
+    return hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def build_split_prompt(text, detected_language):
+    """Build the subtitle-splitting prompt sent to the LLM for one chunk of text."""
+    language_name = (
+        detected_language.upper() if detected_language else "the detected language"
+    )
+
+    return f"""You are a professional subtitle editor. Your task is to split the following transcription text into short, readable, captionable segments suitable for video subtitles.
+
+CRITICAL RULES:
+    1. LENGTH CONSTRAINT: Maximum around 9 words per segment, keep it natural, but you can go up to 12 words if it maintains readability and flow. Avoid very short segments (1-2 words) unless they are natural pauses or standalone phrases.
+    2. GRAMMATICAL GLUE (High Priority):
+      - NEVER separate a pronoun from its verb (e.g., keep "se merece", "te quiero", "it is" together).
+      - NEVER separate a preposition from its noun (e.g., keep "con [Name]", "in the house", "para ti" together).
+      - NEVER separate an article from its noun (e.g., keep "la casa", "the car" together).
+    3. NO ORPHANS: Do not end a line with a weak word like "y", "que", "de", "el", "la", "a", "con", "the", "and", "or". Push them to the next segment mantaining the natural flow and grammatical structure.
+    4. NATURAL FLOW:
+      - Split at natural pauses (commas, periods).
+      - Segments MUST NOT end with a comma (,) or a period (.), just ignore those punctuation marks at the end of each segment, only use them in between segments to guide splits.
+    5. FORMAT:
+      - Capitalize the first word of a segment ONLY if it starts a new sentence.
+      - Return ONLY a JSON array of strings.
+
+    ### PATTERN EXAMPLES (Follow this Logic):
+
+    TYPE A: The "Preposition/Article" Split
+    BAD:  ["I went to the", "park with my friend"]
+    GOOD: ["I went to the park", "with my friend"]
+    (Reason: Keep "to the park" and "with my friend" as complete units.)
+
+    TYPE B: The "Pronoun/Verb" Split
+    BAD:  ["Lo que realmente se", "merece es esto"]
+    GOOD: ["Lo que realmente se merece", "es esto"]
+    (Reason: "se" belongs to "merece". Never split them.)
+
+Transcription text (in {language_name}):
+{text}
+
+Return the JSON array of segments:"""
+
+
+def parse_sentence_array(response_text):
+    """
+    Extract the JSON array of sentence strings from an LLM response, tolerating
+    code fences, surrounding prose and truncated output.
+    Raises ValueError if no array can be recovered.
+    """
+    response_text = response_text.strip()
+
+    # Robust JSON Parsing
+    cleaned_text = response_text
+
+    code_block = re.search(
+        r"```(?:json)?\s*(.*?)```", response_text, re.DOTALL | re.IGNORECASE
+    )
+    if code_block:
+        cleaned_text = code_block.group(1).strip()
+
+    sentences = []
+    try:
+        sentences = json.loads(cleaned_text)
+    except json.JSONDecodeError:
+        json_array_match = re.search(r"(\[.*\])", response_text, re.DOTALL)
+        if json_array_match:
+            try:
+                sentences = json.loads(json_array_match.group(1))
+            except json.JSONDecodeError:
+                print(
+                    f"DEBUG: Failed to parse extracted JSON array. Raw snippet: {json_array_match.group(1)[:200]}..."
+                )
+                # Recover from truncated JSON
+                try:
+                    potential_json = json_array_match.group(1)
+                    if not potential_json.strip().endswith("]"):
+                        print(
+                            "DEBUG: JSON appears truncated. Attempting simple repair..."
+                        )
+                        last_quote_idx = potential_json.rfind('"')
+                        if last_quote_idx > 0:
+                            repair_attempt = potential_json[: last_quote_idx + 1] + "]"
+                            sentences = json.loads(repair_attempt)
+                            print("DEBUG: Repair successful.")
+                except:
+                    pass
+
+                if not sentences:
+                    raise ValueError("Could not parse Gemini response as JSON")
+        else:
+            print(
+                f"DEBUG: No valid JSON found. Raw Gemini Response: {response_text[:500]}"
+            )
+            if response_text.strip().startswith(
+                "["
+            ) and not response_text.strip().endswith("]"):
+                print(
+                    "DEBUG: Response starts with '[' but does not end with ']'. Likely token limit reached."
+                )
+            raise ValueError("Could not parse Gemini response as JSON")
+
+    if not isinstance(sentences, list):
+        raise ValueError("Gemini response is not a JSON array")
+    return sentences
+
+
+class GeminiSplitClient:
+    """
+    Sentence-splitting client backed by google-generativeai.
+    Split clients only need a generate(prompt) method returning the raw
+    response text, so tests can substitute any other implementation.
+    """
+
+    model_name = GEMINI_MODEL_NAME
+
+    def __init__(self, api_key):
+        genai.configure(api_key=api_key)
+        try:
+            self.model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        except Exception:
+            try:
+                self.model = genai.GenerativeModel("gemini-2.5-flash")
+            except Exception:
+                self.model = genai.GenerativeModel("gemini-2.0-flash")
+
+    def generate(self, prompt):
+        generation_config = {
+            "temperature": 0.2,
+            "max_output_tokens": 8192,
+        }
+
+        try:
+            config_with_json = generation_config.copy()
+            config_with_json["response_mime_type"] = "application/json"
+            response = self.model.generate_content(
+                prompt, generation_config=config_with_json
+            )
+        except Exception:
+            print(
+                "Note: JSON MIME type enforcement not supported/failed, falling back to standard text generation."
+            )
+            response = self.model.generate_content(
+                prompt, generation_config=generation_config
+            )
+        return response.text
+
+
+class HttpSplitClient:
+    """
+    Split client for a plain HTTP endpoint that accepts {"prompt": ...} as a
+    JSON POST body and answers with {"text": ...}. Used to run the splitter
+    against a local (fake) LLM server instead of Gemini.
+    """
+
+    def __init__(self, url, timeout=LLM_SPLIT_TIMEOUT_SECONDS):
+        self.url = url
+        self.model_name = url
+        self.timeout = timeout
+
+    def generate(self, prompt):
+        body = json.dumps({"prompt": prompt}).encode("utf-8")
+        req = urllib.request.Request(
+            self.url, data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))["text"]
+
+
+def make_split_client(gemini_api_key):
+    """
+    Return the sentence-splitting client for a request: the HTTP client when
+    LLM_SPLIT_ENDPOINT is configured, otherwise Gemini (None if unavailable).
+    """
+    if LLM_SPLIT_ENDPOINT:
+        return HttpSplitClient(LLM_SPLIT_ENDPOINT)
+
+    if not GEMINI_AVAILABLE:
+        print("Google Generative AI library not available. Returning segments as-is.")
+        return None
+
+    if not gemini_api_key:
+        print("No Gemini API key provided. Returning segments as-is.")
+        return None
+
+    try:
+        return GeminiSplitClient(gemini_api_key)
+    except Exception as e:
+        print(f"Error configuring Gemini API: {e}")
+        return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available.
+    Tokens refill continuously at rate_per_second up to capacity.
+    """
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last_refill) * self.rate
+                )
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared by all requests, since the Gemini quota is per project rather than per request
+gemini_rate_limiter = TokenBucket(
+    GEMINI_REQUESTS_PER_MINUTE / 60.0, GEMINI_RATE_LIMIT_BURST
+)
+
+
+def split_cache_key(text, detected_language, client):
+    params = {
+        "text": text,
+        "language": detected_language,
+        "model": getattr(client, "model_name", GEMINI_MODEL_NAME),
+        "prompt_version": SPLIT_PROMPT_VERSION,
+    }
+    return hashlib.sha256(
+        json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def _call_gemini_split(text, detected_language, client):
+    """
+    Helper function to call the split client (rate limited, with exponential
+    backoff between attempts) and return a list of sentence strings, or None.
+    Successfully parsed arrays are served from and stored in split_cache.
+    """
+    cache_key = None
+    if split_cache is not None:
+        cache_key = split_cache_key(text, detected_language, client)
+        cached = split_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    prompt = build_split_prompt(text, detected_language)
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            gemini_rate_limiter.acquire()
+            with metrics.time_stage("gemini_chunk"):
+                response_text = client.generate(prompt)
+            with trace_span("gemini_parse"):
+                sentences = parse_sentence_array(response_text)
+            if cache_key is not None and any(
+                isinstance(sentence, str) and sentence.strip() for sentence in sentences
+            ):
+                split_cache.put(cache_key, sentences)
+            return sentences
+        except Exception as e:
+            print(f"Error in Gemini call (attempt {attempt + 1}): {e}")
+            if attempt < GEMINI_MAX_RETRIES:
+                delay = GEMINI_RETRY_BASE_DELAY_SECONDS * (2**attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+    return None
+
+
+def _proportional_sentence_times(sentences, combined_text, start_time, end_time):
+    """
+    Spread the time between start_time and end_time over sentences in
+    proportion to their character counts within combined_text.
+    """
+    duration = end_time - start_time
+    total_chars = len(combined_text)
+    current_char_pos = 0
+    times = []
+
+    for j, sentence in enumerate(sentences):
+        sentence_chars = len(sentence)
+
+        # Calculate proportional timing relative to chunk start
+        if total_chars > 0:
+            char_proportion_start = current_char_pos / total_chars
+            char_proportion_end = (current_char_pos + sentence_chars) / total_chars
+        else:
+            char_proportion_start = j / len(sentences)
+            char_proportion_end = (j + 1) / len(sentences)
+
+        sentence_start = start_time + (duration * char_proportion_start)
+        sentence_end = start_time + (duration * char_proportion_end)
+
+        # Clamp to chunk boundaries
+        times.append((sentence_start, min(sentence_end, end_time)))
+
+        current_char_pos += sentence_chars + 1  # +1 for space
+    return times
+
+
+def time_sentences(sentences, chunk_segments, combined_text):
+    """
+    Turn the split sentences of one chunk into timed segments. When the chunk
+    carries aligned word timestamps, each sentence is snapped to its first and
+    last matched word (one linear walk over the chunk's words); sentences
+    without matched words, or chunks without alignment, fall back to times
+    proportional to their character offsets.
+    """
+    sentences = [
+        sentence.strip()
+        for sentence in sentences
+        if isinstance(sentence, str) and sentence.strip()
+    ]
+    proportional_times = _proportional_sentence_times(
+        sentences,
+        combined_text,
+        chunk_segments[0].get("start", 0),
+        chunk_segments[-1].get("end", 0),
+    )
+
+    words = _flatten_aligned_words(chunk_segments)
+    if words:
+        matches = match_sentences_to_words(sentences, words)
+    else:
+        matches = [[] for _ in sentences]
+
+    timed = []
+    for sentence, pairs, (start, end) in zip(sentences, matches, proportional_times):
+        if pairs:
+            start = words[pairs[0][1]]["start"]
+            end = max(start, words[pairs[-1][1]]["end"])
+        timed.append({"text": sentence, "start": start, "end": end})
+    return timed
+
+
+def split_segments_with_gemini(
+    segments, gemini_api_key, detected_language="en", client=None
+):
+    """
+    Use Gemini 2.5 Flash to intelligently split long segments.
+    Processes in chunks to avoid token limits; chunks are sent concurrently
+    (up to GEMINI_MAX_CONCURRENCY at a time) and reassembled in order.
+    client overrides the split client (see make_split_client).
+    Segments returned unsplit because the split failed carry a "split_error".
+    """
+    if not segments:
+        return segments
+
+    if client is None:
+        client = make_split_client(gemini_api_key)
+        if client is None:
+            return _mark_split_error(segments, "Sentence splitter unavailable.")
+
+    try:
+        print(f"Using {GEMINI_MODEL_LABEL} to split segments (with chunking)...")
+
+        # 1. Chunk segments by duration (e.g. 120 seconds per chunk)
+        CHUNK_DURATION_SECONDS = 120
+        chunks = []
+        current_chunk = []
+        chunk_start = segments[0].get("start", 0)
+
+        for index, seg in enumerate(segments):
+            current_chunk.append(seg)
+            if seg.get("end", 0) - chunk_start >= CHUNK_DURATION_SECONDS:
+                chunks.append(current_chunk)
+                current_chunk = []
+                # Will set start time at next iteration or after loop
+                if index + 1 < len(segments):
+                    chunk_start = segments[index + 1].get("start", 0)
+
+        if current_chunk:
+            chunks.append(current_chunk)
+
+        print(
+            f"Split {len(segments)} segments into {len(chunks)} chunks for processing."
+        )
+
+        # 2. Prepare the text of every chunk and send them concurrently
+        chunk_combined_texts = []
+        for chunk in chunks:
+            chunk_texts = [
+                s.get("text", "").strip() for s in chunk if s.get("text", "").strip()
+            ]
+            chunk_combined_texts.append(" ".join(chunk_texts))
+
+        workers = max(1, min(GEMINI_MAX_CONCURRENCY, len(chunks)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="gemini-split"
+        ) as executor:
+            futures = [
+                (
+                    executor.submit(
+                        traced(_call_gemini_split),
+                        combined_text,
+                        detected_language,
+                        client,
+                    )
+                    if combined_text
+                    else None
+                )
+                for combined_text in chunk_combined_texts
+            ]
+
+            # 3. Reassemble the results in chunk order
+            final_processed_segments = []
+
+            for i, (chunk, combined_text, future) in enumerate(
+                zip(chunks, chunk_combined_texts, futures)
+            ):
+                if future is None:
+                    continue
+                print(
+                    f"Processing chunk {i+1}/{len(chunks)} ({len(chunk)} segments)..."
+                )
+                sentences = future.result()
+
+                if (
+                    not sentences
+                    or not isinstance(sentences, list)
+                    or len(sentences) == 0
+                ):
+                    print(
+                        f"Gemini failed for chunk {i+1}, using original chunk segments."
+                    )
+                    final_processed_segments.extend(
+                        _mark_split_error(chunk, "Sentence splitting failed.")
+                    )
+                    continue
+
+                # Map sentences to timestamps
+                final_processed_segments.extend(
+                    time_sentences(sentences, chunk, combined_text)
+                )
+
+        return final_processed_segments
+
+    except Exception as e:
+        print(f"Error calling Gemini for sentence splitting: {e}")
+        print("Falling back to original segments.")
+        return _mark_split_error(segments, f"Sentence splitting failed: {str(e)}")
+
+
+def _mark_split_error(segments, message):
+    for seg in segments:
+        seg["split_error"] = message
+    return segments
+
+
+def has_fallback(segments):
+    """
+    Whether any of segments came from a fallback path (failed alignment or
+    sentence split). Such results are returned but never cached, so a retry
+    gets another chance once the aligner or the splitter works again.
+    """
+    return any("words_error" in seg or "split_error" in seg for seg in segments)
+
+
+def _normalize_token(token):
+    """Lowercase a word and strip punctuation so transcript tokens can be compared."""
+    return re.sub(r"[^\w]+", "", token.lower())
+
+
+def _flatten_aligned_words(aligned_segments):
+    """
+    Return all aligned words of aligned_segments as one list. Words that the
+    aligner could not time (e.g. numerals) inherit the end time of the
+    previous word so every entry has a usable start and end.
+    """
+    words = []
+    last_end = aligned_segments[0].get("start", 0) if aligned_segments else 0
+    for seg in aligned_segments:
+        for w in seg.get("words") or []:
+            start = w.get("start")
+            end = w.get("end")
+            if start is None:
+                start = last_end
+            if end is None:
+                end = start
+            words.append(
+                {
+                    "word": w.get("word", ""),
+                    "start": start,
+                    "end": end,
+                    "score": w.get("score"),
+                }
+            )
+            last_end = end
+    return words
+
+
+def match_sentences_to_words(sentence_texts, words):
+    """
+    Match every whitespace token of sentence_texts to an aligned word in a
+    single forward walk over words. Returns one list of (token, word_index)
+    pairs per sentence. A token that does not equal the next word may skip
+    ahead up to MATCH_LOOKAHEAD_WORDS words to resynchronise; otherwise it
+    consumes the next word anyway (e.g. "20" vs "twenty").
+    """
+    normalized = [_normalize_token(w.get("word", "")) for w in words]
+    total_words = len(words)
+    pos = 0
+    matches = []
+    for text in sentence_texts:
+        pairs = []
+        for token in text.split():
+            key = _normalize_token(token)
+            if not key:
+                # Punctuation-only token: glue it to the previous word
+                if pairs:
+                    pairs[-1] = (f"{pairs[-1][0]} {token}", pairs[-1][1])
+                continue
+            if pos >= total_words:
+                break
+            target = pos
+            if normalized[pos] != key:
+                lookahead_end = min(pos + 1 + MATCH_LOOKAHEAD_WORDS, total_words)
+                for k in range(pos + 1, lookahead_end):
+                    if normalized[k] == key:
+                        target = k
+                        break
+            pairs.append((token, target))
+            pos = target + 1
+        matches.append(pairs)
+    return matches
+
+
+def attach_words_to_sentences(sentence_segments, aligned_segments):
+    """
+    Give each sentence segment a "words" array built from the aligned word
+    timestamps. Word text comes from the sentence (so Gemini's casing is kept),
+    timing from the matched aligned word, and the sentence start/end are
+    snapped to its first and last word. Sentences without matched words keep
+    an empty "words" array and share the time between their neighbours in
+    proportion to their lengths.
+    """
+    words = _flatten_aligned_words(aligned_segments)
+    texts = [seg.get("text", "").strip() for seg in sentence_segments]
+    matches = match_sentences_to_words(texts, words)
+
+    combined = []
+    for seg, text, pairs in zip(sentence_segments, texts, matches):
+        if not text:
+            continue
+        seg_words = [
+            {
+                "word": token,
+                "start": words[idx]["start"],
+                "end": words[idx]["end"],
+                "score": words[idx]["score"],
+            }
+            for token, idx in pairs
+        ]
+        combined.append(
+            {
+                "text": text,
+                "start": seg_words[0]["start"] if seg_words else None,
+                "end": seg_words[-1]["end"] if seg_words else None,
+                "words": seg_words,
+            }
+        )
+
+    span_start = sentence_segments[0].get("start", 0) if sentence_segments else 0
+    span_end = sentence_segments[-1].get("end", span_start) if sentence_segments else 0
+    first = 0
+    while first < len(combined):
+        if combined[first]["words"]:
+            first += 1
+            continue
+        last = first
+        while last < len(combined) and not combined[last]["words"]:
+            last += 1
+        start = combined[first - 1]["end"] if first else span_start
+        end = combined[last]["start"] if last < len(combined) else span_end
+        unmatched = combined[first:last]
+        run_texts = [seg["text"] for seg in unmatched]
+        times = _proportional_sentence_times(
+            run_texts, " ".join(run_texts), start, max(start, end)
+        )
+        for seg, (seg_start, seg_end) in zip(unmatched, times):
+            seg["start"], seg["end"] = seg_start, seg_end
+        first = last
+    return combined
+
+
+# Words that must not end a subtitle line (articles, prepositions, conjunctions),
+# and pronouns that stay glued to the following verb, per language code.
+LOCAL_SPLIT_WEAK_WORDS = {
+    "en": set(
+        "a an the and or but nor so of to in on at by for with from into onto "
+        "about as than that if because my your his her its our their this "
+        "these those very".split()
+    ),
+    "es": set(
+        "el la los las un una unos unas lo al del y e o u ni pero que de a en "
+        "con por para sin sobre entre hasta desde hacia como si mi mis tu tus "
+        "su sus muy porque".split()
+    ),
+    "pt": set(
+        "o a os as um uma uns umas e ou mas que de do da dos das em no na nos "
+        "nas com por para sem como se meu minha seu sua muito porque".split()
+    ),
+    "fr": set(
+        "le la les l un une des du de d et ou mais que qu à au aux en dans "
+        "avec pour par sur sans sous chez comme si mon ma mes ton ta tes son "
+        "sa ses très parce".split()
+    ),
+    "it": set(
+        "il lo la i gli le un uno una e o ma che di a da in con su per tra fra "
+        "del della al alla nel nella come se mio mia tuo tua suo sua molto "
+        "perché".split()
+    ),
+    "de": set(
+        "der die das den dem des ein eine einen einem einer und oder aber "
+        "dass von zu zum zur in im an am auf mit für bei aus nach über unter "
+        "ohne wie wenn weil mein meine dein deine sein seine ihr ihre "
+        "sehr".split()
+    ),
+}
+LOCAL_SPLIT_GLUE_WORDS = {
+    "en": set("i you he she it we they i'm it's".split()),
+    "es": set("me te se nos os le les yo no".split()),
+    "pt": set("me te se nos lhe lhes eu não".split()),
+    "fr": set("je j tu il elle on nous vous ils elles me te se ne n".split()),
+    "it": set("mi ti si ci vi gli io non".split()),
+    "de": set("ich du er sie es wir ihr".split()),
+}
+SENTENCE_END_PUNCTUATION = (".", "?", "!", "…", "。", "？", "！")
+CLAUSE_END_PUNCTUATION = (",", ";", ":", "，", "、")
+
+
+def _words_from_segments(segments):
+    """
+    Aligned words of segments; segments without word timestamps (e.g. failed
+    alignment) contribute their text tokens spread evenly over the segment.
+    """
+    words = []
+    for seg in segments:
+        if seg.get("words"):
+            words.extend(_flatten_aligned_words([seg]))
+            continue
+        tokens = seg.get("text", "").split()
+        start = seg.get("start", 0)
+        step = (seg.get("end", start) - start) / max(len(tokens), 1)
+        for k, token in enumerate(tokens):
+            words.append(
+                {
+                    "word": token,
+                    "start": start + k * step,
+                    "end": start + (k + 1) * step,
+                    "score": None,
+                }
+            )
+    return words
+
+
+def _local_split_segment(words, first, last):
+    """Build the output segment for words[first:last]."""
+    text = " ".join(w["word"].strip() for w in words[first:last])
+    # Lines never end on a comma or period; those only guide the splits
+    text = text.rstrip(".,;:，、。")
+    return {
+        "text": text,
+        "start": words[first]["start"],
+        "end": max(words[first]["start"], words[last - 1]["end"]),
+    }
+
+
+def split_segments_locally(segments, detected_language="en"):
+    """
+    Split (aligned) segments into captionable lines without an LLM, following
+    the same rules as the Gemini prompt: aim for LOCAL_SPLIT_TARGET_WORDS and
+    never exceed LOCAL_SPLIT_MAX_WORDS, split at punctuation and pauses, never
+    end a line on an article/preposition/conjunction, never separate a
+    glue pronoun from the next word and avoid orphan lines shorter than
+    LOCAL_SPLIT_MIN_WORDS at the end of a sentence. Runs in a single pass
+    over the words, then rebalances short sentence ends with their previous
+    line.
+    """
+    words = _words_from_segments(segments)
+    if not words:
+        return segments
+
+    language = (detected_language or "").split("-")[0].lower()
+    weak_words = LOCAL_SPLIT_WEAK_WORDS.get(language, set())
+    glue_words = LOCAL_SPLIT_GLUE_WORDS.get(language, set())
+
+    def can_break_after(index):
+        if index + 1 >= len(words):
+            return True
+        word = words[index]["word"].strip().lower().strip('.,;:!?"')
+        keys = {word, _normalize_token(word)}
+        return not (keys & weak_words or keys & glue_words)
+
+    def ends_sentence(index):
+        return words[index]["word"].strip().endswith(SENTENCE_END_PUNCTUATION)
+
+    def is_pause_after(index):
+        token = words[index]["word"].strip()
+        return (
+            token.endswith(SENTENCE_END_PUNCTUATION + CLAUSE_END_PUNCTUATION)
+            or words[index + 1]["start"] - words[index]["end"]
+            >= LOCAL_SPLIT_PAUSE_SECONDS
+        )
+
+    ranges = []  # [first, last) word ranges of the lines
+    first = 0
+    for i, w in enumerate(words):
+        length = i - first + 1
+        token = w["word"].strip()
+        is_last = i + 1 == len(words)
+        gap = 0 if is_last else words[i + 1]["start"] - w["end"]
+
+        if is_last:
+            break_here = True
+        elif token.endswith(SENTENCE_END_PUNCTUATION):
+            break_here = (
+                length >= LOCAL_SPLIT_MIN_WORDS or gap >= LOCAL_SPLIT_PAUSE_SECONDS
+            )
+        elif token.endswith(CLAUSE_END_PUNCTUATION) or gap >= LOCAL_SPLIT_PAUSE_SECONDS:
+            break_here = length >= LOCAL_SPLIT_MIN_WORDS and can_break_after(i)
+        else:
+            break_here = length >= LOCAL_SPLIT_TARGET_WORDS and can_break_after(i)
+
+        if not break_here and length >= LOCAL_SPLIT_MAX_WORDS:
+            # Hard limit: back off to the latest allowed break in the line,
+            # preferring punctuation and pauses
+            allowed = [
+                k
+                for k in range(i, first + LOCAL_SPLIT_MIN_WORDS - 2, -1)
+                if can_break_after(k)
+            ]
+            cut = next((k for k in allowed if is_pause_after(k)), None)
+            if cut is None:
+                cut = allowed[0] if allowed else i
+            ranges.append((first, cut + 1))
+            first = cut + 1
+            continue
+
+        if break_here:
+            ranges.append((first, i + 1))
+            first = i + 1
+
+    # A sentence must not end with an orphan line of fewer than
+    # LOCAL_SPLIT_MIN_WORDS words cut off from its previous line: join the
+    # two lines, or move the break back when they do not fit in one
+    balanced = []
+    for first, last in ranges:
+        if (
+            balanced
+            and last - first < LOCAL_SPLIT_MIN_WORDS
+            and (last == len(words) or ends_sentence(last - 1))
+            and not ends_sentence(balanced[-1][1] - 1)
+        ):
+            previous = balanced[-1][0]
+            if last - previous <= LOCAL_SPLIT_MAX_WORDS:
+                balanced[-1] = (previous, last)
+                continue
+            cuts = [
+                k
+                for k in range(
+                    max(
+                        previous + LOCAL_SPLIT_MIN_WORDS - 1,
+                        last - LOCAL_SPLIT_MAX_WORDS - 1,
+                    ),
+                    last - LOCAL_SPLIT_MIN_WORDS,
+                )
+                if can_break_after(k)
+            ]
+            if cuts:
+                # The most even split of the two lines
+                cut = min(cuts, key=lambda k: abs(2 * (k + 1) - previous - last))
+                balanced[-1] = (previous, cut + 1)
+                balanced.append((cut + 1, last))
+                continue
+        balanced.append((first, last))
+
+    lines = [_local_split_segment(words, first, last) for first, last in balanced]
+    return [line for line in lines if line["text"]]
+
+
+def align_segments(segments, audio, detected_language):
+    """
+    Run word-level alignment for segments. Returns (aligned_segments, error);
+    on failure the original segments are returned together with the error.
+    """
+    try:
+        align_model, metadata = align_model_pool.get(detected_language)
+
+        print("Aligning transcription...")
+        align_start_time = time.time()
+        import whisperx
+
+        with metrics.time_stage("align"):
+            result_aligned = whisperx.align(
+                segments,
+                align_model,
+                metadata,
+                audio,
+                DEVICE,
+                return_char_alignments=False,
+            )
+        align_duration = time.time() - align_start_time
+        print(f"Alignment completed in {align_duration:.2f}s.")
+        return result_aligned["segments"], None
+
+    except Exception as align_e:
+        print(
+            f"Could not align transcription for language '{detected_language}': {align_e}"
+        )
+        print(
+            "Proceeding with segment-level timestamps only from initial transcription."
+        )
+        return segments, align_e
+
+
+def postprocess_segments(segments, audio, detected_language, options, progress=None):
+    """
+    Turn raw transcription segments into the segments returned to the client:
+    align them (word and both levels), split them into sentences (sentence and
+    both levels) and attach matched words to sentences (both level).
+    """
+    transcription_level = options.get("transcription_level", "word")
+    gemini_api_key = options.get("gemini_api_key", "")
+    splitter = options.get("splitter", "gemini")
+    # The local splitter needs no API key; Gemini only runs when a key is given
+    split_sentences = splitter == "local" or bool(gemini_api_key)
+    if progress is None:
+        progress = lambda stage, fraction: None
+
+    final_segments = segments
+
+    # Word-level alignment is needed for 'word' and for the combined 'both' level
+    align_error = None
+    if transcription_level in ("word", "both"):
+        progress("aligning", PROGRESS_ALIGN_START)
+        final_segments, align_error = align_segments(segments, audio, detected_language)
+        if align_error is not None:
+            # final_segments is already from model.transcribe if alignment fails
+            for seg in final_segments:
+                seg["words_error"] = (
+                    f"Alignment failed for language {detected_language}: {str(align_error)}"
+                )
+    elif transcription_level == "sentence" and split_sentences:
+        # Split sentences are timed from the aligned words; without alignment
+        # the splitter falls back to proportional timing
+        print("Aligning words to time the split sentences...")
+        progress("aligning", PROGRESS_ALIGN_START)
+        final_segments, align_error = align_segments(segments, audio, detected_language)
+
+    if transcription_level in ("sentence", "both"):
+        if transcription_level == "sentence" and not split_sentences:
+            print(f"Sentence-level transcription requested. Skipping word alignment.")
+        sentence_segments = final_segments
+        if splitter == "local":
+            progress("splitting", PROGRESS_SPLIT_START)
+            print("Splitting segments into captionable sentences locally...")
+            split_start_time = time.time()
+            with trace_span("split_local"):
+                sentence_segments = split_segments_locally(
+                    final_segments, detected_language
+                )
+            print(
+                f"Local split produced {len(sentence_segments)} segments in {time.time() - split_start_time:.3f}s."
+            )
+        # Use Gemini to intelligently split long segments into shorter sentences
+        elif gemini_api_key:
+            progress("splitting", PROGRESS_SPLIT_START)
+            print(
+                f"Using {GEMINI_MODEL_LABEL} to split segments into captionable sentences..."
+            )
+            with trace_span("split_gemini"):
+                sentence_segments = split_segments_with_gemini(
+                    final_segments, gemini_api_key, detected_language
+                )
+        else:
+            print("No Gemini API key provided. Using original segments as-is.")
+
+        if transcription_level == "both" and align_error is None:
+            # Pair each sentence with its aligned words from the same transcription pass
+            with trace_span("attach_words"):
+                final_segments = attach_words_to_sentences(
+                    sentence_segments, final_segments
+                )
+        else:
+            final_segments = sentence_segments
+            if align_error is not None:
+                for seg in final_segments:
+                    seg["words_error"] = (
+                        f"Alignment failed for language {detected_language}: {str(align_error)}"
+                    )
+            elif transcription_level == "sentence":
+                # Sentence level only returns segment timing
+                for seg in final_segments:
+                    seg.pop("words", None)
+
+    return final_segments
+
+
+def run_transcription_pipeline(audio_path, options, progress=None, audio=None):
+    """
+    Decode, transcribe and (for word and both levels) align the audio file at
+    audio_path, or the already decoded 16 kHz samples in audio.
+    options holds the parsed request parameters: "model", "language",
+    "transcription_level", "gemini_api_key" and "splitter".
+    progress is an optional callable(stage, fraction) invoked between stages.
+    Returns the response dictionary sent back to the client.
+    """
+    language_code = options.get("language")
+    transcription_level = options.get("transcription_level", "word")
+    model_size = options.get("model") or MODEL_SIZE
+    if progress is None:
+        progress = lambda stage, fraction: None
+
+    progress("loading model", 0.0)
+    whisper_model = model_registry.get(model_size)
+
+    pipeline_start_time = time.time()
+    if audio is None:
+        progress("decoding", 0.0)
+        print(f"Loading audio for WhisperX: {audio_path}")
+        with metrics.time_stage("load_audio"):
+            audio = load_audio(audio_path)
+
+    range_start, range_end = options.get("start"), options.get("end")
+    has_range = range_start is not None or range_end is not None
+    clip_offset = 0.0
+    if has_range:
+        audio, clip_offset = clip_audio(audio, range_start, range_end)
+        print(
+            f"Transcribing {clip_offset:.2f}s to {clip_offset + len(audio) / SAMPLE_RATE:.2f}s only."
+        )
+
+    detection = None
+    if language_code is None and LANGUAGE_PROBE_ENABLED and len(audio):
+        progress("detecting language", 0.0)
+        detection = detect_language(whisper_model, audio)
+        language_code = detection["language"]
+    if language_code and needs_alignment(options):
+        # Loads while the transcription runs instead of after it
+        align_model_pool.prefetch(language_code)
+
+    print(
+        f"Transcribing with WhisperX model ({model_size}, Language: {language_code if language_code else 'auto-detect'})..."
+    )
+    progress("transcribing", PROGRESS_TRANSCRIBE_START)
+    transcribe_start_time = time.time()
+    # When language=None in load_model, transcribe will detect the language.
+    # If language_code is provided, transcribe refers to it.
+    with metrics.time_stage("transcribe"):
+        result = whisper_model.transcribe(
+            audio, batch_size=BATCH_SIZE, language=language_code
+        )
+    transcribe_duration = time.time() - transcribe_start_time
+
+    detected_language = result.get("language")
+    if not detected_language:
+        print("Error: WhisperX could not detect the language of the audio.")
+        raise PipelineError("Language detection failed.", 500)
+
+    print(
+        f"Initial transcription completed in {transcribe_duration:.2f}s. Detected language: {detected_language}"
+    )
+
+    final_segments = postprocess_segments(
+        result["segments"], audio, detected_language, options, progress
+    )
+    if has_range:
+        shift_segments(final_segments, clip_offset)
+        final_segments = [
+            seg
+            for seg in final_segments
+            if in_time_range(seg, range_start or 0.0, range_end)
+        ]
+
+    full_text = segments_full_text(final_segments)
+
+    audio_duration = 0
+    if final_segments and "end" in final_segments[-1]:
+        audio_duration = final_segments[-1]["end"]
+
+    if len(audio):
+        metrics.observe(
+            "whisperx_api_real_time_factor",
+            (time.time() - pipeline_start_time) / (len(audio) / SAMPLE_RATE),
+        )
+
+    progress("finishing", 1.0)
+    response = {
+        "model": model_size,
+        "language": detected_language,
+        "duration_seconds": audio_duration,
+        "full_text": full_text,
+        "segments": final_segments,
+        "transcription_level": transcription_level,
+    }
+    if has_range:
+        response["time_range"] = [range_start or 0.0, range_end]
+    if detection is not None:
+        response["language_detection"] = detection
+    return response
+
+
+def segments_full_text(segments):
+    return " ".join(
+        [segment["text"].strip() for segment in segments if "text" in segment]
+    ).strip()
+
+
+def shift_segments(segments, offset_seconds):
+    """Shift the segment and word timestamps of segments by offset_seconds in place."""
+    if not offset_seconds:
+        return segments
+    for seg in segments:
+        for key in ("start", "end"):
+            if seg.get(key) is not None:
+                seg[key] = round(seg[key] + offset_seconds, 3)
+        for w in seg.get("words") or []:
+            for key in ("start", "end"):
+                if w.get(key) is not None:
+                    w[key] = round(w[key] + offset_seconds, 3)
+    return segments
+
+
+def clip_audio(audio, start, end, context_seconds=RANGE_CONTEXT_SECONDS):
+    """
+    Cut the range start..end (seconds, None for the file start or end) plus
+    context_seconds on each side out of 16 kHz audio.
+    Returns (clip, offset_seconds of the clip within audio).
+    """
+    first = int(max(0.0, (start or 0.0) - context_seconds) * SAMPLE_RATE)
+    last = len(audio)
+    if end is not None:
+        last = min(last, int((end + context_seconds) * SAMPLE_RATE))
+    if first >= last:
+        raise PipelineError(
+            f"The requested range starts after the end of the audio ({len(audio) / SAMPLE_RATE:.2f}s).",
+            400,
+        )
+    return audio[first:last], first / SAMPLE_RATE
+
+
+def in_time_range(segment, start, end):
+    """Whether the middle of segment lies in start..end (end None: open-ended)."""
+    seg_start = segment.get("start")
+    if seg_start is None:
+        return False
+    seg_end = segment.get("end")
+    middle = (seg_start + (seg_end if seg_end is not None else seg_start)) / 2
+    return middle >= start and (end is None or middle < end)
+
+
+def _clamp_times(segment, lower=None, upper=None):
+    """Clamp the segment and word timestamps of segment into lower..upper."""
+    for item in [segment] + list(segment.get("words") or []):
+        for key in ("start", "end"):
+            value = item.get(key)
+            if value is None:
+                continue
+            if lower is not None and value < lower:
+                item[key] = lower
+            elif upper is not None and value > upper:
+                item[key] = upper
+
+
+def _fix_seam(previous, following, boundary):
+    """
+    Remove the overlap between two neighboring segments from different
+    transcriptions by cutting both at boundary (moved into the overlap).
+    """
+    prev_end, next_start = previous.get("end"), following.get("start")
+    if prev_end is None or next_start is None or prev_end <= next_start:
+        return
+    cut = round(min(max(boundary, next_start), prev_end), 3)
+    _clamp_times(previous, upper=cut)
+    _clamp_times(following, lower=cut)
+
+
+def splice_result(base, window_result, start, end):
+    """
+    Replace the segments of the earlier result base that lie in start..end
+    with the segments of window_result, a transcription of just that range.
+    Segments belong to the range when their middle does; overlapping
+    timestamps where the two transcriptions meet are cut at the range bounds.
+    Returns a new result dictionary; base is not modified.
+    """
+    start = start or 0.0
+    base_segments = copy.deepcopy(base.get("segments", []))
+    before = [
+        seg
+        for seg in base_segments
+        if not in_time_range(seg, start, None) and seg.get("start") is not None
+    ]
+    after = [
+        seg
+        for seg in base_segments
+        if end is not None and in_time_range(seg, end, None)
+    ]
+    new_segments = copy.deepcopy(window_result["segments"])
+    if before and new_segments:
+        _fix_seam(before[-1], new_segments[0], start)
+    if new_segments and after:
+        _fix_seam(new_segments[-1], after[0], end)
+    segments = before + new_segments + after
+
+    result = dict(base)
+    result.pop("cache_hit", None)
+    result.pop("result_id", None)
+    result["segments"] = segments
+    result["full_text"] = segments_full_text(segments)
+    result["duration_seconds"] = max(
+        base.get("duration_seconds") or 0,
+        (segments[-1].get("end") or 0) if segments else 0,
+    )
+    result["spliced_range"] = [start, end]
+    return result
+
+
+def _overlap_seconds(a, b):
+    return min(a.get("end") or 0.0, b.get("end") or 0.0) - max(
+        a.get("start") or 0.0, b.get("start") or 0.0
+    )
+
+
+def _segment_signature(segment):
+    """What a client displays of a segment, for telling changed segments apart."""
+    return (
+        segment.get("text", "").strip(),
+        round(segment.get("start") or 0.0, 2),
+        round(segment.get("end") or 0.0, 2),
+        tuple(
+            (
+                w.get("word"),
+                round(w.get("start") or 0.0, 2),
+                round(w.get("end") or 0.0, 2),
+            )
+            for w in segment.get("words") or []
+        ),
+    )
+
+
+def diff_segments(draft_segments, refined_segments):
+    """
+    Give each refined segment the "id" of the draft segment it overlaps most
+    (by at least DRAFT_MATCH_MIN_OVERLAP of the shorter one), or a new id,
+    and return the changes from the draft: "updated" and "added" refined
+    segments, "removed" draft ids and the "unchanged" ones. Both lists are
+    in time order, so each refined segment only looks at the draft segments
+    it overlaps.
+    """
+    next_id = max((seg["id"] for seg in draft_segments), default=-1) + 1
+    matched = set()
+    diff = {"updated": [], "added": [], "removed": [], "unchanged": []}
+    first = 0
+    for seg in refined_segments:
+        while first < len(draft_segments) and (
+            draft_segments[first].get("end") or 0.0
+        ) <= (seg.get("start") or 0.0):
+            first += 1
+        best, best_overlap = None, 0.0
+        index = first
+        while index < len(draft_segments) and (
+            draft_segments[index].get("start") or 0.0
+        ) < (seg.get("end") or 0.0):
+            candidate = draft_segments[index]
+            overlap = _overlap_seconds(seg, candidate)
+            if candidate["id"] not in matched and overlap > best_overlap:
+                best, best_overlap = candidate, overlap
+            index += 1
+        if best is not None:
+            shorter = min(
+                (seg.get("end") or 0.0) - (seg.get("start") or 0.0),
+                (best.get("end") or 0.0) - (best.get("start") or 0.0),
+            )
+            if best_overlap < DRAFT_MATCH_MIN_OVERLAP * shorter:
+                best = None
+        if best is None:
+            seg["id"] = next_id
+            next_id += 1
+            diff["added"].append(seg)
+            continue
+        seg["id"] = best["id"]
+        matched.add(best["id"])
+        if _segment_signature(seg) == _segment_signature(best):
+            diff["unchanged"].append(seg["id"])
+        else:
+            diff["updated"].append(seg)
+    diff["removed"] = [seg["id"] for seg in draft_segments if seg["id"] not in matched]
+    return diff
+
+
+def run_draft_and_refine(audio, options, progress, emit):
+    """
+    Two-pass transcription of the decoded audio: options["draft_model"]
+    first, handed to emit() as a {"type": "draft"} event as soon as it is
+    done, then options["model"] in the draft's language. Draft segments are
+    numbered in order; returns the refined result with diff_segments' ids
+    and its "diff".
+    """
+    share = DRAFT_PROGRESS_SHARE
+    draft_options = dict(options, model=options["draft_model"])
+    draft = run_transcription_pipeline(
+        None,
+        draft_options,
+        progress=lambda stage, fraction: progress(f"draft: {stage}", fraction * share),
+        audio=audio,
+    )
+    for index, seg in enumerate(draft["segments"]):
+        seg["id"] = index
+    draft["draft"] = True
+    emit({"type": "draft", "result": draft})
+
+    # The refine pass reuses the draft's language instead of detecting it again
+    refine_options = dict(
+        options, language=options.get("language") or draft["language"]
+    )
+    refined = run_transcription_pipeline(
+        None,
+        refine_options,
+        progress=lambda stage, fraction: progress(
+            stage, share + fraction * (1 - share)
+        ),
+        audio=audio,
+    )
+    diff = diff_segments(draft["segments"], refined["segments"])
+    print(
+        f"Refined draft: {len(diff['updated'])} updated, {len(diff['added'])} added, "
+        f"{len(diff['removed'])} removed, {len(diff['unchanged'])} unchanged segments."
+    )
+    if "language_detection" in draft:
+        refined["language_detection"] = draft["language_detection"]
+    refined["draft_model"] = options["draft_model"]
+    refined["diff"] = diff
+    return refined
+
+
+def frame_energy(audio, frame_seconds=ENERGY_FRAME_SECONDS):
+    """
+    Return the RMS energy of consecutive frames of audio. Computed block by
+    block so no full-length temporary array is allocated.
+    """
+    frame = max(1, int(SAMPLE_RATE * frame_seconds))
+    n_frames = len(audio) // frame
+    energy = np.zeros(n_frames, dtype=np.float32)
+    block_frames = 4096
+    for first in range(0, n_frames, block_frames):
+        last = min(first + block_frames, n_frames)
+        block = np.asarray(audio[first * frame : last * frame], dtype=np.float32)
+        block = block.reshape(last - first, frame)
+        energy[first:last] = np.sqrt(np.mean(block * block, axis=1))
+    return energy
+
+
+def find_quiet_cut_points(audio, window_seconds, search_seconds):
+    """
+    Split audio into windows of roughly window_seconds, moving every boundary to
+    the quietest frame within search_seconds of it so that cuts fall into
+    pauses rather than into words. Returns sample offsets [0, ..., len(audio)].
+    """
+    total_samples = len(audio)
+    window_samples = int(window_seconds * SAMPLE_RATE)
+    if total_samples <= window_samples:
+        return [0, total_samples]
+
+    energy = frame_energy(audio)
+    frame = max(1, int(SAMPLE_RATE * ENERGY_FRAME_SECONDS))
+    window_frames = max(1, window_samples // frame)
+    search_frames = int(search_seconds / ENERGY_FRAME_SECONDS)
+
+    cuts = [0]
+    target = window_frames
+    while target < len(energy):
+        lo = max(cuts[-1] // frame + 1, target - search_frames)
+        hi = min(len(energy), target + search_frames + 1)
+        if lo >= hi:
+            break
+        quietest = lo + int(np.argmin(energy[lo:hi]))
+        cuts.append(quietest * frame)
+        target = quietest + window_frames
+    if total_samples - cuts[-1] < frame:
+        cuts[-1] = total_samples
+    else:
+        cuts.append(total_samples)
+    return cuts
+
+
+def speech_probe(audio):
+    """
+    Join the LANGUAGE_PROBE_WINDOWS windows of audio with the most speech
+    (frames well above the noise floor) in their original order. Audio that
+    is not longer than the probe is returned as is.
+    """
+    window = int(LANGUAGE_PROBE_WINDOW_SECONDS * SAMPLE_RATE)
+    scanned = audio[: int(LANGUAGE_PROBE_SCAN_SECONDS * SAMPLE_RATE)]
+    if len(scanned) <= window * LANGUAGE_PROBE_WINDOWS:
+        return np.asarray(scanned, dtype=np.float32)
+
+    energy = frame_energy(scanned)
+    frame = max(1, int(SAMPLE_RATE * ENERGY_FRAME_SECONDS))
+    window_frames = window // frame
+    floor, loud = np.percentile(energy, [10, 90])
+    voiced = (energy > floor + 0.25 * (loud - floor)).astype(np.float32)
+    # Voiced frames in the window starting at every frame
+    cumulative = np.concatenate(([0.0], np.cumsum(voiced)))
+    scores = cumulative[window_frames:] - cumulative[:-window_frames]
+    starts = []
+    for _ in range(LANGUAGE_PROBE_WINDOWS):
+        best = int(np.argmax(scores))
+        starts.append(best)
+        # No overlap with the windows already chosen
+        scores[max(0, best - window_frames + 1) : best + window_frames] = -1
+    return np.concatenate(
+        [
+            np.asarray(scanned[first * frame : first * frame + window], np.float32)
+            for first in sorted(starts)
+        ]
+    )
+
+
+def _language_probabilities(whisper_model, probe):
+    """
+    Run Whisper's language detection on probe (at most 30 s) and return
+    [(language, probability), ...], most likely first. This uses the
+    faster-whisper model behind the WhisperX pipeline, like its own
+    detect_language, but keeps the probabilities.
+    """
+    from whisperx.audio import N_SAMPLES, log_mel_spectrogram
+
+    n_mels = whisper_model.model.feat_kwargs.get("feature_size") or 80
+    segment = log_mel_spectrogram(
+        probe[:N_SAMPLES],
+        n_mels=n_mels,
+        padding=max(0, N_SAMPLES - len(probe)),
+    )
+    encoder_output = whisper_model.model.encode(segment)
+    results = whisper_model.model.model.detect_language(encoder_output)
+    return [(token[2:-2], probability) for token, probability in results[0]]
+
+
+def detect_language(whisper_model, audio):
+    """
+    Detect the spoken language from a speech_probe of audio. Returns
+    {"language", "probability", "probabilities", "probe_seconds"}; the
+    probabilities of the LANGUAGE_PROBE_TOP_LANGUAGES most likely languages.
+    """
+    probe = speech_probe(audio)
+    start_time = time.time()
+    with metrics.time_stage("detect_language"):
+        try:
+            ranked = _language_probabilities(whisper_model, probe)
+        except Exception as e:
+            # Other backends only report the most likely language
+            print(f"Language probabilities unavailable ({e}); detecting language only.")
+            ranked = [(whisper_model.detect_language(probe), None)]
+    language, probability = ranked[0]
+    print(
+        f"Detected language '{language}' from a {len(probe) / SAMPLE_RATE:.0f}s probe in {time.time() - start_time:.2f}s."
+    )
+    return {
+        "language": language,
+        "probability": None if probability is None else round(probability, 4),
+        "probabilities": {
+            code: round(p, 4)
+            for code, p in ranked[:LANGUAGE_PROBE_TOP_LANGUAGES]
+            if p is not None
+        },
+        "probe_seconds": round(len(probe) / SAMPLE_RATE, 2),
+    }
+
+
+def needs_alignment(options):
+    """Whether postprocess_segments aligns words for these options."""
+    transcription_level = options.get("transcription_level", "word")
+    if transcription_level in ("word", "both"):
+        return True
+    return transcription_level == "sentence" and (
+        options.get("splitter") == "local" or bool(options.get("gemini_api_key"))
+    )
+
+
+def stream_transcription(audio, options, audio_label=""):
+    """
+    Generator that transcribes audio in groups of windows and yields one event
+    dictionary per finalized segment, so the first subtitles reach the client
+    long before the whole file is processed.
+    Events: {"type": "start"}, {"type": "language"} once the language is
+    known, {"type": "segment"} for every segment, then {"type": "end"} or
+    {"type": "error"}.
+    """
+    language_code = options.get("language")
+    transcription_level = options.get("transcription_level", "word")
+    model_size = options.get("model") or MODEL_SIZE
+    cuts = find_quiet_cut_points(
+        audio, STREAM_WINDOW_SECONDS, STREAM_CUT_SEARCH_SECONDS
+    )
+    total_duration = len(audio) / SAMPLE_RATE
+    print(
+        f"Streaming transcription of {audio_label} ({total_duration:.1f}s) in {len(cuts) - 1} windows..."
+    )
+
+    yield {
+        "type": "start",
+        "model": model_size,
+        "transcription_level": transcription_level,
+        "duration_seconds": total_duration,
+        "windows": len(cuts) - 1,
+    }
+
+    segment_count = 0
+    try:
+        whisper_model = model_registry.get(model_size)
+        if not language_code and LANGUAGE_PROBE_ENABLED and len(audio):
+            detection = detect_language(whisper_model, audio)
+            language_code = detection["language"]
+            yield {
+                "type": "language",
+                "language": language_code,
+                "language_detection": detection,
+            }
+
+        first, group_size = 0, 1
+        while first < len(cuts) - 1:
+            last = min(first + group_size, len(cuts) - 1)
+            windows = [audio[cuts[i] : cuts[i + 1]] for i in range(first, last)]
+            group_start_time = time.time()
+            detected_language, window_segments = transcribe_clips(
+                whisper_model, windows, language_code
+            )
+            if not language_code:
+                # Detected on the first window, then kept fixed
+                language_code = detected_language
+                if not language_code:
+                    raise PipelineError("Language detection failed.", 500)
+                yield {"type": "language", "language": language_code}
+
+            for index, window, segments in zip(
+                range(first, last), windows, window_segments
+            ):
+                segments = postprocess_segments(
+                    segments, window, language_code, options
+                )
+                for seg in shift_segments(segments, cuts[index] / SAMPLE_RATE):
+                    segment_count += 1
+                    yield {"type": "segment", "segment": seg}
+            print(
+                f"Windows {first + 1}-{last}/{len(cuts) - 1} processed in {time.time() - group_start_time:.2f}s."
+            )
+            first, group_size = last, min(group_size * 2, STREAM_MAX_GROUP_WINDOWS)
+
+        yield {
+            "type": "end",
+            "language": language_code,
+            "segment_count": segment_count,
+            "duration_seconds": total_duration,
+        }
+    except Exception as e:
+        print(f"Error during streaming transcription: {e}")
+        yield {"type": "error", "error": f"Transcription failed: {str(e)}"}
+
+
+def plan_windows(audio):
+    """
+    Cover audio with windows of WINDOWED_WINDOW_SECONDS overlapping by
+    WINDOWED_OVERLAP_SECONDS. Returns [(first, last, keep_from, keep_until)]
+    in samples: a window spans first..last, and keeps the segments whose
+    middle lies in keep_from..keep_until (None: to the end). Neighboring keep
+    ranges meet at the quietest frame in the middle half of their overlap.
+    Only depends on the audio, so the same file always gives the same windows.
+    """
+    total = len(audio)
+    window = int(WINDOWED_WINDOW_SECONDS * SAMPLE_RATE)
+    overlap = min(int(WINDOWED_OVERLAP_SECONDS * SAMPLE_RATE), window // 2)
+    firsts = [0]
+    while firsts[-1] + window < total:
+        firsts.append(firsts[-1] + window - overlap)
+
+    frame = max(1, int(SAMPLE_RATE * ENERGY_FRAME_SECONDS))
+    boundaries = []
+    for first in firsts[1:]:
+        lo, hi = first + overlap // 4, first + 3 * overlap // 4
+        energy = frame_energy(audio[lo:hi])
+        quietest = int(np.argmin(energy)) if len(energy) else 0
+        boundaries.append(lo + quietest * frame)
+    keep_froms = [0] + boundaries
+    keep_untils = boundaries + [None]
+    return [
+        (first, min(first + window, total), keep_from, keep_until)
+        for first, keep_from, keep_until in zip(firsts, keep_froms, keep_untils)
+    ]
+
+
+def run_windowed_pipeline(audio, options, progress=None):
+    """
+    Transcribe, align and split audio window by window (see plan_windows)
+    and write the response JSON to a new file in UPLOAD_FOLDER as segments
+    are finalized. Only one window's segments are held in memory.
+    Returns a summary with the file's "result_path".
+    """
+    language_code = options.get("language")
+    transcription_level = options.get("transcription_level", "word")
+    model_size = options.get("model") or MODEL_SIZE
+    if progress is None:
+        progress = lambda stage, fraction: None
+
+    progress("loading model", 0.0)
+    whisper_model = model_registry.get(model_size)
+    pipeline_start_time = time.time()
+    detection = None
+    if language_code is None:
+        progress("detecting language", 0.0)
+        detection = detect_language(whisper_model, audio)
+        language_code = detection["language"]
+    if needs_alignment(options):
+        align_model_pool.prefetch(language_code)
+
+    windows = plan_windows(audio)
+    total_duration = len(audio) / SAMPLE_RATE
+    print(
+        f"Windowed transcription of {total_duration:.1f}s in {len(windows)} windows..."
+    )
+
+    fd, result_path = tempfile.mkstemp(suffix=".json", dir=UPLOAD_FOLDER)
+    texts = []
+    segment_count = 0
+    last_end = 0
+    fallback = False
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            out.write('{"segments": [')
+            held = None  # Last kept segment, written once its successor is known
+
+            def write(seg):
+                nonlocal segment_count, last_end, fallback
+                fallback = fallback or has_fallback([seg])
+                out.write(",\n" if segment_count else "\n")
+                out.write(json.dumps(seg, ensure_ascii=False))
+                segment_count += 1
+                texts.append(seg.get("text", "").strip())
+                last_end = seg.get("end") or last_end
+
+            for index, (first, last, keep_from, keep_until) in enumerate(windows):
+                progress(
+                    "transcribing",
+                    PROGRESS_TRANSCRIBE_START
+                    + (1 - PROGRESS_TRANSCRIBE_START) * index / len(windows),
+                )
+                window_start_time = time.time()
+                window_audio = audio[first:last]
+                with metrics.time_stage("transcribe"):
+                    result = whisper_model.transcribe(
+                        window_audio, batch_size=BATCH_SIZE, language=language_code
+                    )
+                segments = postprocess_segments(
+                    result["segments"], window_audio, language_code, options
+                )
+                shift_segments(segments, first / SAMPLE_RATE)
+                keep_end = None if keep_until is None else keep_until / SAMPLE_RATE
+                segments = [
+                    seg
+                    for seg in segments
+                    if in_time_range(seg, keep_from / SAMPLE_RATE, keep_end)
+                ]
+                for position, seg in enumerate(segments):
+                    if held is not None:
+                        if position == 0:
+                            # Seam between two windows
+                            _fix_seam(held, seg, keep_from / SAMPLE_RATE)
+                        write(held)
+                    held = seg
+                print(
+                    f"Window {index + 1}/{len(windows)} processed in {time.time() - window_start_time:.2f}s."
+                )
+            if held is not None:
+                write(held)
+
+            summary = {
+                "model": model_size,
+                "language": language_code,
+                "duration_seconds": last_end,
+                "transcription_level": transcription_level,
+                "windows": len(windows),
+            }
+            if detection is not None:
+                summary["language_detection"] = detection
+            out.write("\n]")
+            for key, value in summary.items():
+                out.write(f", {json.dumps(key)}: {json.dumps(value)}")
+            out.write(
+                f', "full_text": {json.dumps(" ".join(texts), ensure_ascii=False)}}}'
+            )
+    except BaseException:
+        remove_temp_file(result_path)
+        raise
+
+    if total_duration > 0:
+        metrics.observe(
+            "whisperx_api_real_time_factor",
+            (time.time() - pipeline_start_time) / total_duration,
+        )
+    progress("finishing", 1.0)
+    summary["segment_count"] = segment_count
+    summary["result_path"] = result_path
+    summary["fallback"] = fallback  # Not part of the written response
+    return summary
+
+
+def transcribe_clips(whisper_model, clips, language):
+    """
+    Transcribe clips with one whisper_model.transcribe call, joined with
+    BATCH_GAP_SECONDS of silence in between, and give every segment back to
+    the clip its middle falls into. Returns (detected language, [segments of
+    each clip]) with the times relative to the start of each clip.
+    """
+    gap = np.zeros(int(BATCH_GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+    offsets, pieces, position = [], [], 0
+    for clip in clips:
+        offsets.append(position / SAMPLE_RATE)
+        pieces += [clip, gap]
+        position += len(clip) + len(gap)
+    combined = np.concatenate(pieces[:-1]) if len(clips) > 1 else clips[0]
+    with metrics.time_stage("transcribe"):
+        transcription = whisper_model.transcribe(
+            combined, batch_size=BATCH_SIZE, language=language
+        )
+    del combined
+
+    clip_segments = []
+    for clip, offset in zip(clips, offsets):
+        duration = len(clip) / SAMPLE_RATE
+        segments = [
+            dict(seg)
+            for seg in transcription["segments"]
+            if in_time_range(seg, offset, offset + duration)
+        ]
+        shift_segments(segments, -offset)
+        for seg in segments:
+            _clamp_times(seg, 0.0, duration)
+        clip_segments.append(segments)
+    return transcription.get("language"), clip_segments
+
+
+def run_batch_pipeline(clips, options, progress=None):
+    """
+    Transcribe a list of decoded 16 kHz clips with shared model passes. The
+    clips are grouped by language (options["languages"] has the known ones,
+    the others are detected), each group is transcribed in one call with
+    BATCH_GAP_SECONDS of silence between its clips, and every segment goes
+    back to the clip its middle falls into. Alignment and splitting then run
+    per clip, with one alignment model per language from align_model_pool.
+    Returns {"results": [...]} with one run_transcription_pipeline style
+    result per clip, in order, and the "batches" that were transcribed.
+    """
+    transcription_level = options.get("transcription_level", "word")
+    model_size = options.get("model") or MODEL_SIZE
+    languages = list(options.get("languages") or [None] * len(clips))
+    if progress is None:
+        progress = lambda stage, fraction: None
+
+    progress("loading model", 0.0)
+    whisper_model = model_registry.get(model_size)
+
+    detections = [None] * len(clips)
+    for index, clip in enumerate(clips):
+        if languages[index] is None and len(clip):
+            progress("detecting language", 0.0)
+            detections[index] = detect_language(whisper_model, clip)
+            languages[index] = detections[index]["language"]
+    groups = {}
+    for index, language in enumerate(languages):
+        if len(clips[index]):
+            groups.setdefault(language, []).append(index)
+    if needs_alignment(options):
+        for language in groups:
+            align_model_pool.prefetch(language)
+
+    results = [None] * len(clips)
+    batches = []
+    total_seconds = sum(len(clip) for clip in clips) / SAMPLE_RATE or 1.0
+    done_seconds = 0.0
+    for language, indices in groups.items():
+        print(
+            f"Transcribing {len(indices)} clip(s) ({language}) in one pass with WhisperX model ({model_size})..."
+        )
+        progress("transcribing", PROGRESS_TRANSCRIBE_START)
+        transcribe_start_time = time.time()
+        detected_language, clip_segments = transcribe_clips(
+            whisper_model, [clips[index] for index in indices], language
+        )
+        detected_language = detected_language or language
+        batches.append(
+            {
+                "language": detected_language,
+                "files": len(indices),
+                "transcribe_seconds": round(time.time() - transcribe_start_time, 2),
+            }
+        )
+
+        for index, segments in zip(indices, clip_segments):
+            duration = len(clips[index]) / SAMPLE_RATE
+            final_segments = postprocess_segments(
+                segments, clips[index], detected_language, options
+            )
+            results[index] = {
+                "model": model_size,
+                "language": detected_language,
+                "duration_seconds": (
+                    final_segments[-1].get("end", 0) if final_segments else 0
+                ),
+                "full_text": segments_full_text(final_segments),
+                "segments": final_segments,
+                "transcription_level": transcription_level,
+            }
+            if detections[index] is not None:
+                results[index]["language_detection"] = detections[index]
+            done_seconds += duration
+            progress("aligning", done_seconds / total_seconds)
+
+    for index, clip in enumerate(clips):
+        if results[index] is None:
+            # Empty clips are not transcribed
+            results[index] = {
+                "model": model_size,
+                "language": languages[index],
+                "duration_seconds": 0,
+                "full_text": "",
+                "segments": [],
+                "transcription_level": transcription_level,
+            }
+    progress("finishing", 1.0)
+    return {"results": results, "batches": batches}
+
+
+def replay_result_as_events(result):
+    """Yield a finished (e.g. cached) result as the events of a stream."""
+    yield {
+        "type": "start",
+        "model": result.get("model"),
+        "transcription_level": result.get("transcription_level"),
+        "duration_seconds": result.get("duration_seconds"),
+        "cache_hit": True,
+    }
+    yield {"type": "language", "language": result.get("language")}
+    for seg in result.get("segments", []):
+        yield {"type": "segment", "segment": seg}
+    yield {
+        "type": "end",
+        "language": result.get("language"),
+        "segment_count": len(result.get("segments", [])),
+        "duration_seconds": result.get("duration_seconds"),
+    }
+
+
+def encode_stream_events(events, stream_format):
+    """Serialize events as newline-delimited JSON or as server-sent events."""
+    for event in events:
+        data = json.dumps(event, ensure_ascii=False)
+        if stream_format == "sse":
+            yield f"event: {event['type']}\ndata: {data}\n\n"
+        else:
+            yield data + "\n"
+
+
+def _milliseconds(seconds):
+    return -1 if seconds is None else int(round(seconds * 1000))
+
+
+def to_columnar(result):
+    """
+    Convert a transcription result to the compact format=columnar layout:
+    parallel arrays instead of one object per word, with times in integer
+    milliseconds and scores in thousandths (-1 where missing). Segment i owns
+    words segment_word_offsets[i] to segment_word_offsets[i + 1] - 1.
+    The numeric arrays come before any transcribed text, so a client can
+    slice them out of the raw response without a full JSON parse.
+    """
+    segment_id, segment_start, segment_end, segment_word_offsets = [], [], [], [0]
+    word_start, word_end, word_score = [], [], []
+    segment_text, words, segment_words_error = [], [], []
+    segment_split_error = []
+    has_words = False
+    for seg in result.get("segments", []):
+        segment_id.append(seg.get("id"))
+        segment_start.append(_milliseconds(seg.get("start")))
+        segment_end.append(_milliseconds(seg.get("end")))
+        segment_text.append(seg.get("text", ""))
+        segment_words_error.append(seg.get("words_error"))
+        segment_split_error.append(seg.get("split_error"))
+        if "words" in seg:
+            has_words = True
+        for w in seg.get("words") or []:
+            words.append(w.get("word", ""))
+            word_start.append(_milliseconds(w.get("start")))
+            word_end.append(_milliseconds(w.get("end")))
+            score = w.get("score")
+            word_score.append(-1 if score is None else int(round(score * 1000)))
+        segment_word_offsets.append(len(words))
+
+    columnar = {
+        "format": "columnar",
+        "version": 1,
+        "segment_start": segment_start,
+        "segment_end": segment_end,
+        "segment_word_offsets": segment_word_offsets,
+        "word_start": word_start,
+        "word_end": word_end,
+        "word_score": word_score,
+        "has_words": has_words,
+    }
+    if any(seg_id is not None for seg_id in segment_id):
+        # Stable ids of draft_model results (see diff_segments)
+        columnar["segment_id"] = segment_id
+    for key, value in result.items():
+        if key not in ("segments", "full_text"):
+            columnar[key] = value
+    columnar["segment_text"] = segment_text
+    columnar["words"] = words
+    if any(segment_words_error):
+        columnar["segment_words_error"] = segment_words_error
+    if any(segment_split_error):
+        columnar["segment_split_error"] = segment_split_error
+    columnar["full_text"] = result.get("full_text", "")
+    return columnar
+
+
+def parse_transcription_options(form):
+    """
+    Read the transcription parameters shared by /transcribe and /jobs from the
+    request form. Returns (options, cache_options, use_cache).
+    Raises PipelineError (400) for a model that is not in ALLOWED_MODELS.
+    """
+    # Get transcription level parameter (word, sentence or both)
+    transcription_level = form.get("transcription_level", "word")
+    if transcription_level not in ["word", "sentence", "both"]:
+        transcription_level = "word"
+
+    # Get WhisperX model (optional, defaults to MODEL_SIZE)
+    model_size = form.get("model", "").strip() or MODEL_SIZE
+    if model_size not in ALLOWED_MODELS:
+        raise PipelineError(
+            f"Model '{model_size}' is not available. Allowed models: {', '.join(ALLOWED_MODELS)}",
+            400,
+        )
+
+    # Get Gemini API key (optional, only needed for sentence-level splitting)
+    gemini_api_key = form.get("gemini_api_key", "").strip()
+
+    # Sentence splitter: "gemini" (default, needs an API key) or the built-in "local" one
+    splitter = form.get("splitter", "gemini").strip().lower()
+    if splitter not in ["gemini", "local"]:
+        splitter = "gemini"
+
+    # Get language (optional, to skip auto-detection)
+    language_code = form.get("language", "").strip()
+    if language_code == "":
+        language_code = None  # Use auto-detect if empty
+
+    # Optional start/end (seconds) to transcribe only part of the audio
+    range_start = _float_param(form, "start")
+    range_end = _float_param(form, "end")
+    if range_start is not None and range_start < 0:
+        raise PipelineError("'start' must not be negative.", 400)
+    if range_end is not None and range_end <= (range_start or 0.0):
+        raise PipelineError("'end' must be greater than 'start'.", 400)
+    # Id of an earlier result the new range is spliced into
+    splice_id = form.get("splice", "").strip() or None
+    if splice_id and range_start is None and range_end is None:
+        raise PipelineError("'splice' needs a 'start' and/or 'end' range.", 400)
+
+    # windowed=1 processes long files in bounded memory (see run_windowed_pipeline)
+    windowed = form.get("windowed", "").strip().lower() in ("1", "true", "yes", "on")
+    if windowed and (range_start is not None or range_end is not None or splice_id):
+        raise PipelineError(
+            "'windowed' cannot be combined with 'start', 'end' or 'splice'.", 400
+        )
+
+    # draft_model returns a quick draft with that model before the refined result
+    draft_model = form.get("draft_model", "").strip() or None
+    if draft_model and draft_model.lower() in ("1", "true", "yes", "on"):
+        draft_model = DRAFT_MODEL_SIZE
+    if draft_model and draft_model not in ALLOWED_MODELS:
+        raise PipelineError(
+            f"Draft model '{draft_model}' is not available. Allowed models: {', '.join(ALLOWED_MODELS)}",
+            400,
+        )
+    if draft_model == model_size:
+        raise PipelineError("'draft_model' must differ from 'model'.", 400)
+    if draft_model and (windowed or splice_id):
+        raise PipelineError(
+            "'draft_model' cannot be combined with 'windowed' or 'splice'.", 400
+        )
+
+    # Set cache=0 to bypass the result cache for this request (no lookup, no store)
+    use_cache = result_cache is not None and form.get(
+        "cache", "1"
+    ).strip().lower() not in ("0", "false", "no", "off")
+
+    options = {
+        "model": model_size,
+        "language": language_code,
+        "transcription_level": transcription_level,
+        "gemini_api_key": gemini_api_key,
+        "splitter": splitter,
+    }
+    # The API key itself must never end up in the cache key, only whether it was set
+    cache_options = {
+        "model_size": model_size,
+        "language": language_code or "auto",
+        "transcription_level": transcription_level,
+        "gemini": bool(gemini_api_key)
+        and transcription_level != "word"
+        and splitter == "gemini",
+        "splitter": splitter if transcription_level != "word" else None,
+    }
+    # Only part of the key when given, so existing cache entries stay valid
+    for key, value in (("start", range_start), ("end", range_end)):
+        if value is not None:
+            options[key] = cache_options[key] = value
+    if splice_id:
+        options["splice"] = cache_options["splice"] = splice_id
+    if windowed:
+        options["windowed"] = cache_options["windowed"] = True
+    if draft_model:
+        options["draft_model"] = cache_options["draft_model"] = draft_model
+    return options, cache_options, use_cache
+
+
+def transcription_job_kind(options):
+    """The Job kind for options from parse_transcription_options."""
+    if options.get("windowed"):
+        return "windowed"
+    if options.get("draft_model"):
+        return "refine"
+    return "transcribe"
+
+
+def _float_param(params, name):
+    value = params.get(name, "").strip()
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise PipelineError(f"'{name}' must be a number of seconds.", 400)
+    if not math.isfinite(number):
+        raise PipelineError(f"'{name}' must be a number of seconds.", 400)
+    return number
+
+
+def find_result(result_id):
+    """
+    Look up an earlier result by id: the job_id of a finished /jobs job that
+    has not expired yet, or the result_id of a cached result.
+    """
+    job = job_manager.get(result_id)
+    if job is not None:
+        return job.result if job.status == "done" else None
+    if result_cache is not None:
+        return result_cache.get(result_id)
+    return None
+
+
+def load_splice_base(options, cache_options):
+    """
+    Return the result named by options["splice"] (None without splice), and
+    default the language to the one of that result: a short range is a poor
+    sample for language detection. Raises PipelineError (404, 400; also for
+    a windowed job, whose result is only a summary).
+    """
+    splice_id = options.get("splice")
+    if not splice_id:
+        return None
+    base = find_result(splice_id)
+    if base is None:
+        raise PipelineError(f"No finished or cached result with id '{splice_id}'.", 404)
+    if "segments" not in base:
+        # Finished windowed jobs only keep a summary; their segments are in a file
+        raise PipelineError(
+            f"Result '{splice_id}' is a windowed result without segments to splice into.",
+            400,
+        )
+    if base.get("transcription_level") != options["transcription_level"]:
+        raise PipelineError(
+            f"Result '{splice_id}' has transcription_level '{base.get('transcription_level')}'; splice with the same level.",
+            400,
+        )
+    if options["language"] is None and base.get("language"):
+        options["language"] = cache_options["language"] = base["language"]
+    return base
+
+
+def store_upload(file, filename, raw_layout=None, head=b""):
+    """
+    Save the uploaded file (a FileStorage, a binary stream after its
+    already read head, or bytes) to UPLOAD_FOLDER. Returns (temp_file_path,
+    audio_hash); audio_hash is None for bytes. raw_layout=(audio_format, sample_rate, channels) marks raw
+    PCM, which gets a WAV header so it decodes like any other upload, and is
+    hashed like receive_audio hashes it in memory.
+    Raises PipelineError if the upload folder cannot be created.
+    """
+    if not os.path.exists(app.config["UPLOAD_FOLDER"]):
+        print(
+            f"Upload folder {app.config['UPLOAD_FOLDER']} not found during request. Attempting to create."
+        )
+        try:
+            os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+        except Exception as e_mkdir:
+            print(f"Failed to create upload folder during request: {e_mkdir}")
+            raise PipelineError(
+                "Server configuration issue: cannot create upload directory.", 500
+            )
+
+    suffix = ".wav" if raw_layout else os.path.splitext(filename)[1]
+    temp_fd, temp_file_path = tempfile.mkstemp(
+        suffix=suffix, dir=app.config["UPLOAD_FOLDER"]
+    )
+    try:
+        with os.fdopen(temp_fd, "wb") as tmp, metrics.time_stage("upload_save"):
+            if isinstance(file, (bytes, bytearray)):
+                tmp.write(file)
+                audio_hash = None
+            elif raw_layout:
+                header = wav_header(*raw_layout, 0)
+                tmp.write(header)
+                digest = hashlib.sha256()
+                save_upload(getattr(file, "stream", file), tmp, digest, head)
+                # The same bytes are different audio at another rate or layout
+                digest.update(":".join(map(str, raw_layout)).encode("utf-8"))
+                audio_hash = digest.hexdigest()
+                data_bytes = tmp.tell() - len(header)
+                tmp.seek(0)
+                tmp.write(wav_header(*raw_layout, data_bytes))
+            else:
+                audio_hash = save_upload(getattr(file, "stream", file), tmp, head=head)
+    except Exception:
+        remove_temp_file(temp_file_path)
+        raise
+    return temp_file_path, audio_hash
+
+
+def is_raw_audio_request():
+    """Whether the audio is the request body itself rather than a form upload."""
+    return request.mimetype not in (
+        "",
+        "multipart/form-data",
+        "application/x-www-form-urlencoded",
+    )
+
+
+def in_memory_audio_format(filename, params):
+    """
+    Decoder for an upload: "wav" or a RAW_AUDIO_FORMATS key to decode it in
+    memory, or None to save it for whisperx.load_audio (ffmpeg).
+    """
+    if not IN_MEMORY_DECODE_ENABLED:
+        return None
+    requested = params.get("audio_format", "").strip().lower()
+    if requested:
+        return requested
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension == "wav":
+        return "wav"
+    if extension in ("pcm", "raw"):
+        return "pcm_s16le"
+    return None
+
+
+def _int_param(params, name, default):
+    value = params.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise PipelineError(f"Invalid value for {name}: {value}", 400)
+
+
+def receive_audio(file, params, spool=False):
+    """
+    Read the audio of the current request: the "audio" file of a form upload,
+    or the raw request body when file is None. WAV and raw PCM up to
+    IN_MEMORY_UPLOAD_MAX_BYTES are decoded in memory. Everything else is
+    saved to UPLOAD_FOLDER (decoded later by the job, a chunk at a time), and
+    so is everything with spool=True.
+    Returns (temp_file_path, audio, audio_hash, label), with exactly one of
+    temp_file_path and audio set. Raises PipelineError.
+    """
+    if file is not None:
+        label = secure_filename(file.filename)
+        audio_format = in_memory_audio_format(label, params)
+        stream = file.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        spool = spool or audio_format is None
+    else:
+        label = "request body"
+        audio_format = params.get("audio_format", "").strip().lower() or None
+        stream = request.stream
+        size = request.content_length  # None for chunked request bodies
+    if spool or size is None or size > IN_MEMORY_UPLOAD_MAX_BYTES:
+        head = b""
+        if file is None:
+            head = stream.read(4)
+            if not head:
+                raise PipelineError("The uploaded audio is empty.", 400)
+            if audio_format is None:
+                audio_format = "wav" if head == b"RIFF" else "pcm_s16le"
+        return spool_audio(stream, label, audio_format, params, head)
+
+    digest = hashlib.sha256()
+    with metrics.time_stage("upload_save"):
+        data = _read_stream(stream, digest, size)
+    if not data:
+        raise PipelineError("The uploaded audio is empty.", 400)
+    if audio_format is None:
+        audio_format = "wav" if data[:4] == b"RIFF" else "pcm_s16le"
+
+    sample_rate = _int_param(params, "sample_rate", SAMPLE_RATE)
+    channels = max(1, _int_param(params, "channels", 1))
+    if audio_format in RAW_AUDIO_FORMATS:
+        # The same bytes are different audio at another rate or layout
+        digest.update(f"{audio_format}:{sample_rate}:{channels}".encode("utf-8"))
+    audio_hash = digest.hexdigest()
+    audio = cached_audio(audio_hash, label)
+    if audio is not None:
+        return None, audio, audio_hash, label
+
+    try:
+        with metrics.time_stage("load_audio"):
+            audio = decode_audio_bytes(data, audio_format, sample_rate, channels)
+    except PipelineError as e:
+        if audio_format != "wav" or e.status_code != 415:
+            raise
+        # Compressed WAV (e.g. ADPCM): let ffmpeg decode it as before
+        print(f"Decoding {label} with ffmpeg: {e}")
+        temp_file_path, _ = store_upload(data, label or "upload.wav")
+        return temp_file_path, None, audio_hash, label
+
+    print(
+        f"Decoded {label} in memory ({audio_format}, {len(audio) / SAMPLE_RATE:.1f}s)."
+    )
+    if audio_cache is not None:
+        audio = audio_cache.put(audio_hash, audio)
+    return None, audio, audio_hash, label
+
+
+def spool_audio(stream, label, audio_format, params, head=b""):
+    """
+    Save the audio of receive_audio from stream (after its already read
+    head) to UPLOAD_FOLDER without decoding it, raw PCM as a WAV file.
+    Returns like receive_audio.
+    """
+    raw_layout = None
+    if audio_format in RAW_AUDIO_FORMATS:
+        raw_layout = (
+            audio_format,
+            _int_param(params, "sample_rate", SAMPLE_RATE),
+            max(1, _int_param(params, "channels", 1)),
+        )
+        if raw_layout[1] <= 0:
+            raise PipelineError("Invalid sample rate.", 400)
+    temp_file_path, audio_hash = store_upload(stream, label, raw_layout, head)
+    audio = cached_audio(audio_hash, label)
+    if audio is not None:
+        remove_temp_file(temp_file_path)
+        return None, audio, audio_hash, label
+    return temp_file_path, None, audio_hash, label
+
+
+def cached_audio(audio_hash, label):
+    """Memory map of the decoded audio with audio_hash from audio_cache, or None."""
+    if audio_cache is None or audio_hash is None:
+        return None
+    audio = audio_cache.get(audio_hash)
+    if audio is not None:
+        print(f"Decoded audio cache hit for {label} ({len(audio) / SAMPLE_RATE:.1f}s).")
+    return audio
+
+
+def decode_into_audio_cache(audio_path, audio_hash):
+    """
+    Decode the uploaded file at audio_path with ffmpeg straight into an
+    audio_cache entry, without holding the whole signal in memory. Returns
+    the memory-mapped audio.
+    """
+    print(f"Loading audio for WhisperX: {audio_path}")
+    tmp_path = audio_cache.temp_path(audio_hash)
+    try:
+        with metrics.time_stage("load_audio"):
+            decode_to_npy(audio_path, tmp_path)
+        cached_path = audio_cache.put_file(audio_hash, tmp_path)
+        return np.load(cached_path or tmp_path, mmap_mode="c")
+    finally:
+        remove_temp_file(tmp_path)
+
+
+def _npy_header(samples):
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header, {"descr": "<f4", "fortran_order": False, "shape": (samples,)}
+    )
+    return header.getvalue()
+
+
+def decode_to_npy(audio_path, npy_path):
+    """
+    Decode audio_path to 16 kHz mono float32 like whisperx.load_audio, but
+    write it to the .npy file npy_path a chunk at a time, so the signal is
+    never held in memory. PCM WAV files at SAMPLE_RATE are converted
+    in-process, anything else by ffmpeg. The header is rewritten with the
+    final length at the end (it is padded so the length always fits).
+    Returns the number of samples. Raises RuntimeError if ffmpeg fails.
+    """
+    with open(npy_path, "wb") as out:
+        out.write(_npy_header(0))
+        samples = _decode_wav_to_npy(audio_path, out)
+        if samples is None:
+            samples = _ffmpeg_to_npy(audio_path, out)
+        header = _npy_header(samples)
+        if len(header) != len(_npy_header(0)):
+            raise RuntimeError("Decoded audio is too long for the .npy header.")
+        out.seek(0)
+        out.write(header)
+    return samples
+
+
+def _decode_wav_to_npy(audio_path, out):
+    """
+    Convert a PCM WAV file at SAMPLE_RATE into out without ffmpeg. Returns
+    the number of samples, or None if the file needs ffmpeg.
+    """
+    with open(audio_path, "rb") as f:
+
+        def read(position, count):
+            f.seek(position)
+            return f.read(count)
+
+        try:
+            layout = read_wav_layout(read, os.path.getsize(audio_path))
+            sample_format, channels, sample_rate, bits, start, end = layout
+            _pcm_to_float(b"", sample_format, bits)  # Raises for other encodings
+        except PipelineError:
+            return None
+        if sample_rate != SAMPLE_RATE:
+            return None
+        f.seek(start)
+        return _convert_pcm_to_npy(f, out, end - start, sample_format, bits, channels)
+
+
+def _ffmpeg_to_npy(audio_path, out):
+    """Decode audio_path with ffmpeg into out; returns the number of samples."""
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads",
+        "0",
+        "-i",
+        audio_path,
+        "-f",
+        "s16le",
+        "-ac",
+        "1",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-",
+    ]
+    samples = 0
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        leftover = b""
+        while True:
+            chunk = process.stdout.read(FFMPEG_READ_BYTES)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            usable = len(chunk) - len(chunk) % 2
+            leftover = chunk[usable:]
+            pcm = np.frombuffer(chunk[:usable], dtype="<i2")
+            out.write((pcm.astype(np.float32) / 32768.0).tobytes())
+            samples += len(pcm)
+        process.stdout.close()
+        if process.wait() != 0:
+            stderr.seek(0)
+            message = stderr.read().decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"Failed to load audio: {message[-500:]}")
+    return samples
+
+
+def decode_to_temp_npy(audio_path):
+    """
+    Decode the upload at audio_path into a .npy file in UPLOAD_FOLDER (see
+    decode_to_npy) and remove the upload. Returns the path of the .npy file.
+    """
+    print(f"Loading audio for WhisperX: {audio_path}")
+    fd, npy_path = tempfile.mkstemp(suffix=AudioCache.suffix, dir=UPLOAD_FOLDER)
+    os.close(fd)
+    try:
+        with metrics.time_stage("load_audio"):
+            decode_to_npy(audio_path, npy_path)
+    except BaseException:
+        remove_temp_file(npy_path)
+        raise
+    remove_temp_file(audio_path)
+    return npy_path
+
+
+def remove_orphaned_uploads(max_age_seconds=UPLOAD_ORPHAN_MAX_AGE_SECONDS):
+    """
+    Delete files in UPLOAD_FOLDER older than max_age_seconds: uploads of
+    requests that never finished, e.g. because the server was killed.
+    """
+    removed = 0
+    now = time.time()
+    try:
+        for entry in os.scandir(UPLOAD_FOLDER):
+            if entry.is_file() and now - entry.stat().st_mtime > max_age_seconds:
+                os.remove(entry.path)
+                removed += 1
+    except Exception as e:
+        print(f"Could not clean up upload folder {UPLOAD_FOLDER}: {e}")
+    if removed:
+        print(f"Removed {removed} orphaned upload(s) from {UPLOAD_FOLDER}.")
+
+
+def remove_temp_file(temp_file_path):
+    if temp_file_path and os.path.exists(temp_file_path):
+        try:
+            os.remove(temp_file_path)
+            print(f"Cleaned up temporary file: {temp_file_path}")
+        except Exception as e_remove:
+            print(f"Error cleaning up temporary file {temp_file_path}: {e_remove}")
+
+
+def validate_audio_upload():
+    """
+    Return (file, None) for a valid "audio" upload in the current request, or
+    (None, error_response) otherwise.
+    """
+    if "audio" not in request.files:
+        return None, (jsonify({"error": "No audio file part in the request"}), 400)
+
+    file = request.files["audio"]
+    if file.filename == "":
+        return None, (jsonify({"error": "No selected file"}), 400)
+
+    if not allowed_file(file.filename):
+        return None, (jsonify({"error": "File type not allowed"}), 400)
+
+    return file, None
+
+
+def stream_response(events, stream_format):
+    mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    response = Response(encode_stream_events(events, stream_format), mimetype=mimetype)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def json_response(data, status_code=200, response_format="json"):
+    """
+    Serialize a (possibly large) transcription result, timing the serialization.
+    With response_format "columnar" the result (data itself, or a job's
+    data["result"] or data["draft"]) is converted with to_columnar and the
+    key order is kept. Traced requests get a "trace" reference added.
+    """
+    tracer = current_tracer()
+    if tracer is not None:
+        data = dict(data, trace=tracer.reference())
+    with metrics.time_stage("json_serialize"):
+        if response_format != "columnar":
+            return jsonify(data), status_code
+        if "segments" in data:
+            data = to_columnar(data)
+        else:
+            for key in ("result", "draft"):
+                if isinstance(data.get(key), dict):
+                    data = dict(data, **{key: to_columnar(data[key])})
+        response = Response(
+            json.dumps(data, separators=(",", ":")), mimetype="application/json"
+        )
+    return response, status_code
+
+
+def client_disconnected():
+    """
+    Whether the client of the current request has closed its connection.
+    Only detectable on the built-in server, which exposes the socket.
+    """
+    sock = request.environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A closed connection is readable and yields no data
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+def wait_for_job(job, waiter, label, release=True, ready=None):
+    """
+    Block the current request (waiter of job) until job finishes (or the
+    ready event is set first) and (if release) release it. Returns False if
+    the client disconnected first; it no longer waits for the job then,
+    which is cancelled if nobody else does.
+    """
+    ready = ready or job.done_event
+    while not ready.wait(CLIENT_DISCONNECT_POLL_SECONDS):
+        if job.done_event.is_set():
+            break
+        if client_disconnected():
+            print(f"Client of {label} disconnected while waiting.")
+            job_manager.abandon(job, waiter)
+            return False
+    if release:
+        job_manager.release(job, waiter)
+    return True
+
+
+def result_file_response(path, result_id=None, cache_hit=False, on_close=None):
+    """
+    Stream a response file written by run_windowed_pipeline, calling
+    on_close once it has been sent. The file is opened right away, so a
+    result evicted from the cache in the meantime gives a clean HTTP 410.
+    """
+    try:
+        result_file = open(path, "rb")
+    except FileNotFoundError:
+        if on_close is not None:
+            on_close()
+        return jsonify({"error": "The result is no longer available."}), 410
+
+    def chunks():
+        try:
+            with result_file:
+                while True:
+                    data = result_file.read(UPLOAD_CHUNK_SIZE)
+                    if not data:
+                        break
+                    yield data
+        finally:
+            if on_close is not None:
+                on_close()
+
+    response = Response(chunks(), mimetype="application/json")
+    response.headers["X-Cache-Hit"] = "true" if cache_hit else "false"
+    if result_id:
+        response.headers["X-Result-Id"] = result_id
+    return response
+
+
+def stream_job_events(job, waiter):
+    """Yield the events of a queued stream job; cancel it if the client goes away."""
+    try:
+        while True:
+            event = job.events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        job_manager.abandon(job, waiter)
+
+
+def traced_request(view, name):
+    """
+    Run view() for the current request, traced if request_tracer says so.
+    The request holds the trace until its response (including a streamed
+    body) has been sent; a job it started holds it until the job finishes.
+    """
+    tracer = request_tracer(request.values)
+    if tracer is None:
+        return view()
+    tracer.hold()
+    try:
+        with tracing(tracer):
+            with tracer.span(name):
+                response = app.make_response(view())
+    except BaseException:
+        tracer.release()
+        raise
+    sent_at = time.time()
+
+    def close():
+        tracer.add("send_response", sent_at, time.time())
+        tracer.release()
+
+    response.call_on_close(close)
+    response.headers["X-Trace-Url"] = tracer.reference()["trace_url"]
+    return response
+
+
+@app.route("/transcribe", methods=["POST"])
+def transcribe_audio():
+    # profile=1 records the request as a trace (see Tracer)
+    return traced_request(_transcribe_audio, "POST /transcribe")
+
+
+def _transcribe_audio():
+    # Audio comes as the "audio" form file, or as the raw request body (WAV or
+    # PCM) with the other parameters in the query string
+    file = None
+    if not is_raw_audio_request():
+        file, error_response = validate_audio_upload()
+        if error_response:
+            return error_response
+
+    # Optional streaming of segments as they are finalized: "ndjson" or "sse"
+    stream_format = request.values.get("stream", "").strip().lower()
+    if stream_format not in ("ndjson", "sse"):
+        stream_format = None
+
+    try:
+        options, cache_options, use_cache = parse_transcription_options(request.values)
+        if stream_format and any(k in options for k in ("start", "end")):
+            raise PipelineError("'start'/'end' cannot be combined with 'stream'.", 400)
+        if stream_format and "draft_model" in options:
+            raise PipelineError("'draft_model' cannot be combined with 'stream'.", 400)
+        splice_base = load_splice_base(options, cache_options)
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    # format=columnar returns parallel arrays instead of one object per word
+    response_format = request.values.get("format", "json").strip().lower()
+    windowed = options.get("windowed", False)
+    if windowed and (stream_format or response_format == "columnar"):
+        return (
+            jsonify(
+                {"error": "'windowed' cannot be combined with 'stream' or 'format'."}
+            ),
+            400,
+        )
+
+    temp_file_path = None
+
+    try:
+        with trace_span("receive_audio"):
+            temp_file_path, audio, audio_hash, filename = receive_audio(
+                file, request.values, spool=windowed
+            )
+
+        apply_cached_language(options, audio_hash)
+        # Identical requests share one job while it runs (see JobManager.submit)
+        share_key = result_cache_key(audio_hash, cache_options)
+        cache_key = share_key if use_cache else None
+        if use_cache and windowed:
+            cached_path = result_cache.get_path(cache_key)
+            if cached_path is not None:
+                print(f"Result cache hit for {filename} ({cache_key[:12]}).")
+                return result_file_response(cached_path, cache_key, cache_hit=True)
+        elif use_cache:
+            with trace_span("result_cache_lookup"):
+                cached = result_cache.get(cache_key)
+            if cached is not None:
+                print(f"Result cache hit for {filename} ({cache_key[:12]}).")
+                if stream_format:
+                    return stream_response(
+                        replay_result_as_events(cached), stream_format
+                    )
+                cached["cache_hit"] = True
+                cached["result_id"] = cache_key
+                return json_response(cached, response_format=response_format)
+
+        # Run through the job queue like /jobs, so concurrent requests are
+        # admitted up to JOB_QUEUE_SIZE and spread over the workers
+        job = Job(
+            temp_file_path,
+            options,
+            None if stream_format else cache_key,
+            kind="stream" if stream_format else transcription_job_kind(options),
+            audio=audio,
+            splice_base=splice_base,
+            audio_hash=audio_hash,
+            tracer=current_tracer(),
+        )
+        try:
+            # Streams deliver events to a single client and traced jobs record
+            # one request, so neither is shared
+            shared = not stream_format and job.tracer is None
+            queued_job, waiter = job_manager.submit(job, share_key if shared else None)
+        except queue.Full:
+            return queue_full_response()
+        if queued_job is job:
+            temp_file_path = None  # Removed by the job once it finishes
+        job = queued_job
+
+        if stream_format:
+            return stream_response(stream_job_events(job, waiter), stream_format)
+
+        # Windowed results are streamed from their file; the job (and an
+        # uncached file) is only released once the response has been sent.
+        # draft_model requests return as soon as the draft is ready.
+        draft_ready = job.draft_event if job.kind == "refine" else None
+        with trace_span("wait_for_job"):
+            finished = wait_for_job(
+                job,
+                waiter,
+                filename,
+                release=not windowed and draft_ready is None,
+                ready=draft_ready,
+            )
+        if not finished:
+            return "", 499
+        if not job.done_event.is_set():
+            # The refinement goes on as a job, kept until JOB_RESULT_TTL_SECONDS
+            draft = dict(job.draft, job_id=job.id, status_url=f"/jobs/{job.id}")
+            return json_response(draft, response_format=response_format)
+        if job.status == "done" and job.result_path is not None:
+            return result_file_response(
+                job.result_path,
+                job.result.get("result_id"),
+                on_close=lambda: job_manager.release(job, waiter),
+            )
+        if windowed or draft_ready is not None:
+            job_manager.release(job, waiter)
+        if job.status != "done":
+            return jsonify({"error": job.error}), job.status_code
+        return json_response(job.result, response_format=response_format)
+
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error during WhisperX transcription or alignment: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
+    finally:
+        remove_temp_file(temp_file_path)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled by the client."""
+
+
+def execute_task(kind, audio_path, options, progress, emit=None, audio=None):
+    """
+    Run one queued transcription, in a job worker thread or a worker process.
+    kind "transcribe" returns the pipeline result, kind "detect_language" the
+    detect_language result, kind "windowed" the run_windowed_pipeline
+    summary, kind "refine" the run_draft_and_refine result (its draft goes
+    to emit()) and kind "batch" the run_batch_pipeline result for the list
+    of clips in audio; kind "stream" passes the events of
+    stream_transcription to emit() and returns None. audio is the
+    already decoded audio of in-memory uploads (audio_path is None then); an
+    audio_path into audio_cache is memory-mapped instead of decoded.
+    """
+    if kind == "batch":
+        # audio is a list of clips: decoded samples, or paths to decode
+        clips = [
+            (
+                np.load(clip, mmap_mode="c")
+                if isinstance(clip, str) and clip.endswith(AudioCache.suffix)
+                else (load_audio(clip) if isinstance(clip, str) else clip)
+            )
+            for clip in audio
+        ]
+        return run_batch_pipeline(clips, options, progress)
+    if audio is None and audio_path and audio_path.endswith(AudioCache.suffix):
+        audio, audio_path = np.load(audio_path, mmap_mode="c"), None
+    if kind == "transcribe":
+        return run_transcription_pipeline(
+            audio_path, options, progress=progress, audio=audio
+        )
+
+    start_time = time.time()
+    if audio is None:
+        progress("decoding", 0.0)
+        print(f"Loading audio for WhisperX: {audio_path}")
+        with metrics.time_stage("load_audio"):
+            audio = load_audio(audio_path)
+    if kind == "detect_language":
+        progress("detecting language", 0.5)
+        return detect_language(model_registry.get(options["model"]), audio)
+    if kind == "windowed":
+        return run_windowed_pipeline(audio, options, progress)
+    if kind == "refine":
+        return run_draft_and_refine(audio, options, progress, emit)
+    duration = len(audio) / SAMPLE_RATE
+    label = os.path.basename(audio_path) if audio_path else "uploaded audio"
+    for event in stream_transcription(audio, options, label):
+        if event["type"] == "segment" and duration > 0:
+            progress("streaming", event["segment"]["end"] / duration)
+        emit(event)
+    if duration > 0:
+        metrics.observe(
+            "whisperx_api_real_time_factor", (time.time() - start_time) / duration
+        )
+    return None
+
+
+class Job:
+    """
+    A transcription request queued through the /jobs API, with its progress,
+    result and cancellation state.
+    """
+
+    def __init__(
+        self,
+        audio_path,
+        options,
+        cache_key=None,
+        kind="transcribe",
+        audio=None,
+        splice_base=None,
+        audio_hash=None,
+        tracer=None,
+        on_finish=None,
+    ):
+        self.id = uuid.uuid4().hex
+        # "transcribe", "stream", "detect_language", "windowed", "refine" or "batch"
+        self.kind = kind
+        self.audio_path = audio_path
+        self.audio = audio  # Decoded samples of in-memory uploads (no audio_path)
+        self.audio_hash = audio_hash  # Key of the decoded audio in audio_cache
+        self.options = options
+        self.cache_key = cache_key
+        # Earlier result the transcribed range is spliced into (options["splice"])
+        self.splice_base = splice_base
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.stage = "queued"
+        self.progress = 0.0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        # Draft result of kind "refine", available while the refinement runs
+        self.draft = None
+        self.draft_event = threading.Event()
+        # Response file of windowed jobs; deleted with the job if owns_result_file
+        self.result_path = None
+        self.owns_result_file = False
+        self.error = None
+        self.status_code = 200
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        # Tokens of the requests waiting for this job (handed out by
+        # JobManager.submit), the token of the request that created it, and
+        # the key identical requests share it by
+        self.waiters = set()
+        self.owner = None
+        self.share_key = None
+        self.tracer = tracer  # Tracer of a traced request (profile=1)
+        # Called with the job once it has finished, e.g. to remove its inputs
+        self.on_finish = on_finish
+        # Stream events for kind "stream", terminated by None
+        self.events = queue.Queue() if kind == "stream" else None
+
+    def emit(self, event):
+        """
+        Event hook for the pipeline: drafts are kept, trace spans from worker
+        processes merged and stream events queued.
+        """
+        if event["type"] == "draft":
+            self.draft = event["result"]
+            self.draft_event.set()
+        elif event["type"] == "trace":
+            if self.tracer is not None:
+                self.tracer.merge(event["events"], event["profile_stats"])
+        elif self.events is not None:
+            self.events.put(event)
+
+    def update(self, stage, fraction):
+        self.stage = stage
+        self.progress = max(self.progress, min(1.0, fraction))
+
+    def report(self, stage, fraction):
+        """Progress hook for the pipeline; also the point where cancellation takes effect."""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.update(stage, fraction)
+
+    def to_dict(self):
+        now = time.time()
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "percent": round(self.progress * 100, 1),
+            "created_at": self.created_at,
+        }
+        if self.cancel_event.is_set() and self.finished_at is None:
+            data["cancel_requested"] = True
+        if self.started_at is not None:
+            elapsed = (self.finished_at or now) - self.started_at
+            data["elapsed_seconds"] = round(elapsed, 2)
+            if self.status == "running" and self.progress > 0:
+                data["eta_seconds"] = round(
+                    elapsed * (1 - self.progress) / self.progress, 1
+                )
+        if self.status == "done" and self.result_path is not None:
+            data["result_url"] = f"/jobs/{self.id}/result"
+        elif self.status == "done":
+            data["result"] = self.result
+        elif self.error:
+            data["error"] = self.error
+        elif self.draft is not None:
+            data["draft"] = self.draft
+        if self.tracer is not None:
+            # Written once the job has finished
+            data["trace"] = self.tracer.reference()
+        return data
+
+
+def _transcription_process_main(conn, config):
+    """
+    Entry point of a worker process: apply the parent's configuration, load
+    the warmup models, then run the tasks received on conn one at a time.
+    While a task runs, the parent may send ("cancel",) or None (stop after it).
+    """
+    globals().update(config)
+    metrics.forward()
+    model_registry.max_models = max(1, MAX_LOADED_MODELS)
+    align_model_pool.device = DEVICE
+    align_model_pool.max_models = max(1, ALIGN_MODEL_POOL_SIZE)
+    align_model_pool.max_bytes = ALIGN_MODEL_POOL_MAX_BYTES
+    try:
+        import torch
+
+        torch.set_num_threads(CPU_THREADS)
+    except ImportError:
+        pass
+
+    def send_status():
+        conn.send(
+            (
+                "status",
+                model_registry.is_ready(MODEL_SIZE),
+                model_registry.load_error(MODEL_SIZE),
+                metrics.drain(),
+            )
+        )
+
+    for model_size in WARMUP_MODELS:
+        try:
+            model_registry.get(model_size)
+        except PipelineError:
+            pass
+    align_model_pool.preload(ALIGN_MODEL_PRELOAD_LANGUAGES)
+    send_status()
+
+    cancelled = stopping = False
+
+    def progress(stage, fraction):
+        nonlocal cancelled, stopping
+        while conn.poll():
+            if conn.recv() is None:
+                stopping = True
+            else:
+                cancelled = True
+        if cancelled:
+            raise JobCancelled()
+        conn.send(("progress", stage, fraction))
+
+    def emit(event):
+        conn.send(("event", event))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        if task[0] == "cancel":
+            continue  # Sent just as the task it was meant for finished
+        cancelled = False
+        kind, audio_path, options, audio = task
+        # Traced jobs record their spans here and send them back before the result
+        tracer = None
+        if options.get("trace"):
+            tracer = Tracer(cprofile=options["trace"] == "cprofile")
+        try:
+            with tracing(tracer):
+                message = (
+                    "result",
+                    profiled(
+                        execute_task, kind, audio_path, options, progress, emit, audio
+                    ),
+                )
+        except JobCancelled:
+            message = ("cancelled",)
+        except PipelineError as e:
+            message = ("error", str(e), e.status_code)
+        except Exception as e:
+            print(f"Error in transcription worker process: {e}")
+            import traceback
+
+            traceback.print_exc()
+            message = ("error", f"Transcription failed: {str(e)}", 500)
+        if tracer is not None:
+            emit(
+                {
+                    "type": "trace",
+                    "events": tracer.events,
+                    "profile_stats": tracer.profile_stats,
+                }
+            )
+        send_status()
+        conn.send(message)
+        if stopping:
+            break
+
+
+class TranscriptionProcess:
+    """
+    One worker process with its own WhisperX models. run() is called by the
+    single JobManager thread that owns this process.
+    """
+
+    def __init__(self, index, config):
+        self.index = index
+        self.config = config
+        self.model_ready = False
+        self.load_error = None
+        self.tasks = 0
+        self.stopping = False
+        self._start()
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._cancel_sent = False
+        self.process = context.Process(
+            target=_transcription_process_main,
+            args=(child_conn, self.config),
+            name=f"transcription-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        print(
+            f"Started transcription worker process {self.index} (pid {self.process.pid})."
+        )
+
+    def _restart(self):
+        if self.stopping:
+            return
+        print(f"Transcription worker process {self.index} exited; restarting it.")
+        self._conn.close()
+        self.model_ready = False
+        self._start()
+
+    def _receive(self, job=None):
+        """
+        Next message from the process, or None if it died. A cancellation of
+        job is passed on while waiting, so it reaches the process at its next
+        progress report even when the parent has nothing to read.
+        """
+        while True:
+            if job is not None and job.cancel_event.is_set() and not self._cancel_sent:
+                self._cancel_sent = True
+                self._conn.send(("cancel",))
+            if self._conn.poll(CANCEL_POLL_SECONDS):
+                break
+            if not self.process.is_alive():
+                return None
+        try:
+            message = self._conn.recv()
+        except EOFError:
+            return None
+        if message[0] == "status":
+            self.model_ready, self.load_error = message[1], message[2]
+            metrics.merge(message[3])
+        return message
+
+    def run(self, job):
+        """Run job in the process; returns the result or raises like execute_task."""
+        self._cancel_sent = False
+        self.tasks += 1
+        audio_path, audio = job.audio_path, job.audio
+        if isinstance(audio, np.memmap):
+            # Cached audio: the process maps the same file instead of getting a copy
+            audio_path, audio = audio.filename, None
+        elif isinstance(audio, list):
+            audio = [
+                clip.filename if isinstance(clip, np.memmap) else clip for clip in audio
+            ]
+        options = job.options
+        if job.tracer is not None:
+            options = dict(
+                options, trace="cprofile" if job.tracer.cprofile else "spans"
+            )
+        self._conn.send((job.kind, audio_path, options, audio))
+        while True:
+            message = self._receive(job)
+            if message is None and self.stopping:
+                raise PipelineError("The server is shutting down.", 503)
+            if message is None:
+                self._restart()
+                raise PipelineError(
+                    "Transcription worker process exited unexpectedly.", 500
+                )
+            kind = message[0]
+            if kind == "progress":
+                job.update(message[1], message[2])
+            elif kind == "event":
+                job.emit(message[1])
+            elif kind == "result":
+                return message[1]
+            elif kind == "cancelled":
+                raise JobCancelled()
+            elif kind == "error":
+                raise PipelineError(message[1], message[2])
+
+    def wait_ready(self):
+        """Wait for the startup status message sent once warmup is done."""
+        while self._receive() is None and not self.stopping:
+            self._restart()
+
+    def stop(self):
+        """Ask the process to exit after its current task."""
+        self.stopping = True
+        try:
+            self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+
+
+class JobManager:
+    """
+    Bounded queue of transcription jobs served by a fixed number of worker
+    threads, each running jobs in this process or in its own worker process.
+    Finished jobs are dropped JOB_RESULT_TTL_SECONDS after completion.
+    """
+
+    def __init__(self, workers, queue_size, ttl_seconds, processes=0):
+        self.workers = workers
+        self.processes = processes
+        self.ttl_seconds = ttl_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = {}
+        self._shared = {}  # share key -> unfinished job
+        self._lock = threading.Lock()
+        self._worker_processes = []
+        self._started = False
+
+    def configure(self, workers, queue_size, processes):
+        """Change the worker setup; only possible before the first job."""
+        with self._lock:
+            if self._started:
+                raise RuntimeError("JobManager is already running.")
+            self.workers = workers
+            self.processes = processes
+            self._queue = queue.Queue(maxsize=queue_size)
+
+    def start(self):
+        """Start the worker threads (and processes); called on first use at the latest."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if self.processes > 0:
+            config = worker_process_config()
+            for i in range(self.processes):
+                worker_process = TranscriptionProcess(i, config)
+                self._worker_processes.append(worker_process)
+                threading.Thread(
+                    target=self._worker,
+                    args=(worker_process,),
+                    name=f"job-worker-{i}",
+                    daemon=True,
+                ).start()
+            # Registered after the processes were started, so it runs before
+            # multiprocessing's own exit handler terminates them
+            atexit.register(self.shutdown)
+        else:
+            for i in range(max(1, self.workers)):
+                threading.Thread(
+                    target=self._worker, name=f"job-worker-{i}", daemon=True
+                ).start()
+
+    def shutdown(self):
+        """Let the worker processes finish their current task and exit."""
+        for worker_process in self._worker_processes:
+            worker_process.stop()
+
+    def submit(self, job, share_key=None):
+        """
+        Queue job and return (job, waiter); raises queue.Full when the queue
+        is saturated. waiter is the token of the submitting request for
+        release(), abandon() and cancel(). With share_key, an unfinished job
+        submitted under the same key (same audio and options) is joined and
+        returned instead, so concurrent duplicates run once; job itself is
+        then not used.
+        """
+        self.start()
+        self.cleanup()
+        waiter = uuid.uuid4().hex
+        with self._lock:
+            shared = self._shared.get(share_key) if share_key else None
+            if shared is not None and not shared.cancel_event.is_set():
+                shared.waiters.add(waiter)
+                if shared.cache_key is None:
+                    shared.cache_key = job.cache_key
+                print(
+                    f"Joined running job {shared.id} ({len(shared.waiters)} waiting)."
+                )
+                return shared, waiter
+            job.waiters.add(waiter)
+            job.owner = waiter
+            self._jobs[job.id] = job
+            if share_key:
+                job.share_key = share_key
+                self._shared[share_key] = job
+        if job.tracer is not None:
+            job.tracer.hold()  # Released by _finish
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+                self._unshare(job)
+            if job.tracer is not None:
+                job.tracer.release()
+            raise
+        return job, waiter
+
+    def release(self, job, waiter):
+        """A waiter received the result of job; forget it once nobody waits for it."""
+        with self._lock:
+            job.waiters.discard(waiter)
+            forget = not job.waiters
+        if forget:
+            self.discard(job.id)
+
+    def complete(self, job, result):
+        """Register job as already finished (e.g. answered from the result cache)."""
+        self.cleanup()
+        job.status = job.stage = "done"
+        job.progress = 1.0
+        job.started_at = job.finished_at = time.time()
+        job.result = result
+        job.done_event.set()
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def get(self, job_id):
+        self.cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        """Forget a job whose result has been delivered (requests to /transcribe)."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._remove_result_file(job)
+
+    def _remove_result_file(self, job):
+        if job.owns_result_file:
+            job.owns_result_file = False
+            remove_temp_file(job.result_path)
+
+    def cancel(self, job_id, waiter=None):
+        """
+        Withdraw waiter (by default the request that created the job) from
+        the job; the job is only cancelled once the last request waiting for
+        it has left. Withdrawing a waiter again does nothing. Returns the job
+        (None for an unknown id) and the number of other requests still
+        waiting for it.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None, 0
+        with self._lock:
+            waiter = waiter or job.owner
+            if waiter not in job.waiters:
+                return job, len(job.waiters)
+            job.waiters.discard(waiter)
+            if job.waiters:
+                return job, len(job.waiters)
+            self._unshare(job)
+        job.cancel_event.set()
+        if job.status == "queued":
+            # The worker skips it when dequeued; report it as cancelled right away
+            self._finish(job, "cancelled")
+        return job, 0
+
+    def abandon(self, job, waiter):
+        """
+        A waiting request went away (e.g. its client disconnected): withdraw
+        it, cancel the job if nobody else waits for it, and forget it then.
+        """
+        self.cancel(job.id, waiter)
+        with self._lock:
+            forget = not job.waiters
+        if forget:
+            self.discard(job.id)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def queue_capacity(self):
+        return self._queue.maxsize
+
+    def is_ready(self):
+        """Whether the default model is loaded (in at least one worker process)."""
+        if self.processes > 0:
+            return any(p.model_ready for p in self._worker_processes)
+        return model_registry.is_ready(MODEL_SIZE)
+
+    def load_error(self):
+        if self.processes > 0:
+            if self.is_ready():
+                return None
+            return next(
+                (p.load_error for p in self._worker_processes if p.load_error), None
+            )
+        return model_registry.load_error(MODEL_SIZE)
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished_at is not None
+                and now - job.finished_at > self.ttl_seconds
+            ]
+            expired_jobs = [self._jobs.pop(job_id) for job_id in expired]
+        for job in expired_jobs:
+            self._remove_result_file(job)
+        if expired:
+            print(f"Removed {len(expired)} expired job(s).")
+
+    def _unshare(self, job):
+        """Stop new requests from joining job; holds the lock."""
+        if job.share_key and self._shared.get(job.share_key) is job:
+            del self._shared[job.share_key]
+
+    def _finish(self, job, status, error=None, status_code=200):
+        if job.finished_at is not None:
+            return
+        with self._lock:
+            self._unshare(job)
+        job.status = job.stage = status
+        job.error = error
+        job.status_code = status_code
+        job.finished_at = time.time()
+        metrics.inc("whisperx_api_transcriptions_total", status=status)
+        job.audio_path, audio_path = None, job.audio_path
+        job.audio = job.splice_base = None
+        remove_temp_file(audio_path)
+        if job.on_finish is not None:
+            job.on_finish(job)
+        if job.events is not None:
+            if status != "done":
+                job.events.put(
+                    {"type": "error", "error": error or f"Transcription {status}."}
+                )
+            job.events.put(None)
+        job.done_event.set()
+        if job.tracer is not None:
+            job.tracer.release()
+
+    def _worker(self, worker_process=None):
+        if worker_process is not None:
+            worker_process.wait_ready()
+        while worker_process is None or not worker_process.stopping:
+            job = self._queue.get()
+            try:
+                if job.cancel_event.is_set():
+                    self._finish(job, "cancelled")
+                    continue
+                with tracing(job.tracer):
+                    self._run(job, worker_process)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job, worker_process=None):
+        job.status = "running"
+        job.started_at = time.time()
+        if job.tracer is not None:
+            job.tracer.add("queued", job.created_at, job.started_at, job_id=job.id)
+        try:
+            if job.audio is None and job.audio_hash and audio_cache is not None:
+                # Decode once into the audio cache; the upload is no longer needed
+                job.report("decoding", 0.0)
+                job.audio = decode_into_audio_cache(job.audio_path, job.audio_hash)
+                job.audio_path, audio_path = None, job.audio_path
+                remove_temp_file(audio_path)
+            elif job.audio is None:
+                # Without the cache, decode next to the upload: the job then
+                # maps the samples instead of holding a second copy
+                job.report("decoding", 0.0)
+                job.audio_path = decode_to_temp_npy(job.audio_path)
+            if worker_process is not None:
+                result = worker_process.run(job)
+            else:
+                result = profiled(
+                    execute_task,
+                    job.kind,
+                    job.audio_path,
+                    job.options,
+                    job.report,
+                    job.emit,
+                    job.audio,
+                )
+            if result is not None:
+                remember_language(job, result)
+                if job.splice_base is not None:
+                    result = splice_result(
+                        job.splice_base,
+                        result,
+                        job.options.get("start"),
+                        job.options.get("end"),
+                    )
+                if job.kind == "windowed":
+                    job.result_path = result.pop("result_path")
+                    fallback = result.pop("fallback")
+                    cached_path = None
+                    if job.cache_key is not None and not fallback:
+                        cached_path = result_cache.put_file(
+                            job.cache_key, job.result_path
+                        )
+                    if cached_path is not None:
+                        job.result_path = cached_path
+                        result["result_id"] = job.cache_key
+                    else:
+                        job.owns_result_file = True
+                elif job.cache_key is not None and not has_fallback(
+                    result.get("segments", [])
+                ):
+                    result_cache.put(job.cache_key, result)
+                    result["result_id"] = job.cache_key
+                result["cache_hit"] = False
+            job.result = result
+            job.progress = 1.0
+            self._finish(job, "done")
+            print(f"Job {job.id} finished in {job.finished_at - job.started_at:.2f}s.")
+        except JobCancelled:
+            print(f"Job {job.id} cancelled during stage '{job.stage}'.")
+            self._finish(job, "cancelled")
+        except PipelineError as e:
+            self._finish(job, "failed", str(e), e.status_code)
+        except Exception as e:
+            print(f"Error during job {job.id}: {e}")
+            import traceback
+
+            traceback.print_exc()
+            self._finish(job, "failed", f"Transcription failed: {str(e)}", 500)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        data = {
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "finished": len(statuses)
+            - statuses.count("queued")
+            - statuses.count("running"),
+            "queue_depth": self.queue_depth(),
+            "queue_capacity": self.queue_capacity(),
+            "workers": self.processes if self.processes > 0 else self.workers,
+            "mode": "processes" if self.processes > 0 else "threads",
+        }
+        if self.processes > 0:
+            data["worker_processes"] = [
+                {
+                    "pid": p.process.pid,
+                    "alive": p.process.is_alive(),
+                    "model_ready": p.model_ready,
+                    "tasks": p.tasks,
+                }
+                for p in self._worker_processes
+            ]
+        return data
+
+
+def remember_language(job, result):
+    """Store the language detected for a whole upload by job in language_cache."""
+    if job.kind == "detect_language":
+        detection = result
+    else:
+        detection = result.get("language_detection")
+    if (
+        language_cache is None
+        or detection is None
+        or not job.audio_hash
+        or "start" in job.options
+        or "end" in job.options
+    ):
+        return
+    language_cache.put(
+        language_cache_key(job.audio_hash, job.options.get("model") or MODEL_SIZE),
+        detection,
+    )
+
+
+def apply_cached_language(options, audio_hash):
+    """
+    Fill in the language of an auto-detect request from a cached detection,
+    so the transcription skips detecting it again. The cache key keeps
+    "auto": for this audio and model the detection always gives this answer.
+    """
+    if options["language"] is not None or language_cache is None:
+        return
+    detection = language_cache.get(language_cache_key(audio_hash, options["model"]))
+    if detection is not None:
+        options["language"] = detection["language"]
+        print(f"Using cached language detection: {detection['language']}.")
+
+
+def worker_process_config():
+    """Settings a worker process needs from this (possibly reconfigured) process."""
+    return {
+        "MODEL_SIZE": MODEL_SIZE,
+        "ALLOWED_MODELS": ALLOWED_MODELS,
+        "MAX_LOADED_MODELS": MAX_LOADED_MODELS,
+        "WARMUP_MODELS": WARMUP_MODELS,
+        "ALIGN_MODEL_PRELOAD_LANGUAGES": ALIGN_MODEL_PRELOAD_LANGUAGES,
+        "ALIGN_MODEL_POOL_SIZE": ALIGN_MODEL_POOL_SIZE,
+        "ALIGN_MODEL_POOL_MAX_BYTES": ALIGN_MODEL_POOL_MAX_BYTES,
+        "DEVICE": DEVICE,
+        "COMPUTE_TYPE": COMPUTE_TYPE,
+        "CPU_THREADS": WORKER_THREADS,
+        "BATCH_SIZE": BATCH_SIZE,
+        "LLM_SPLIT_ENDPOINT": LLM_SPLIT_ENDPOINT,
+    }
+
+
+job_manager = JobManager(
+    JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL_SECONDS, WORKER_PROCESSES
+)
+
+
+def queue_full_response():
+    """HTTP 429 telling the client to come back later."""
+    response = jsonify(
+        {
+            "error": "Job queue is full. Try again later.",
+            "queue_depth": job_manager.queue_depth(),
+            "queue_capacity": job_manager.queue_capacity(),
+        }
+    )
+    response.headers["Retry-After"] = str(JOB_RETRY_AFTER_SECONDS)
+    return response, 429
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    return traced_request(_create_job, "POST /jobs")
+
+
+def _create_job():
+    file = None
+    if not is_raw_audio_request():
+        file, error_response = validate_audio_upload()
+        if error_response:
+            return error_response
+
+    try:
+        options, cache_options, use_cache = parse_transcription_options(request.values)
+        splice_base = load_splice_base(options, cache_options)
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+    windowed = options.get("windowed", False)
+    try:
+        with trace_span("receive_audio"):
+            temp_file_path, audio, audio_hash, filename = receive_audio(
+                file, request.values, spool=windowed
+            )
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+    apply_cached_language(options, audio_hash)
+    share_key = result_cache_key(audio_hash, cache_options)
+    cache_key = share_key if use_cache else None
+    job = Job(
+        temp_file_path,
+        options,
+        cache_key,
+        kind=transcription_job_kind(options),
+        audio=audio,
+        splice_base=splice_base,
+        audio_hash=audio_hash,
+        tracer=current_tracer(),
+    )
+    if job.tracer is not None:
+        # A traced job records one request, so it is never shared
+        share_key = None
+
+    waiter = None
+    cached = cached_path = None
+    if cache_key is not None and windowed:
+        cached_path = result_cache.get_path(cache_key)
+    elif cache_key is not None:
+        cached = result_cache.get(cache_key)
+    if cached_path is not None:
+        print(f"Result cache hit for job {job.id} ({filename}).")
+        remove_temp_file(temp_file_path)
+        job.audio_path = job.audio = None
+        job.result_path = cached_path
+        job_manager.complete(job, {"cache_hit": True, "result_id": cache_key})
+    elif cached is not None:
+        print(f"Result cache hit for job {job.id} ({filename}).")
+        remove_temp_file(temp_file_path)
+        job.audio_path = job.audio = job.splice_base = None
+        cached["cache_hit"] = True
+        cached["result_id"] = cache_key
+        job_manager.complete(job, cached)
+    else:
+        try:
+            queued_job, waiter = job_manager.submit(job, share_key)
+        except queue.Full:
+            remove_temp_file(temp_file_path)
+            return queue_full_response()
+        if queued_job is job:
+            print(f"Queued job {job.id} for {filename}.")
+        else:
+            # An identical job is already running; its result is shared
+            remove_temp_file(temp_file_path)
+            job = queued_job
+
+    data = job.to_dict()
+    data["status_url"] = f"/jobs/{job.id}"
+    if waiter is not None:
+        # Identifies this request in DELETE /jobs/<job_id>?waiter_id=...
+        data["waiter_id"] = waiter
+    return json_response(
+        data, 202, response_format=request.values.get("format", "json").lower()
+    )
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id"}), 404
+    return json_response(
+        job.to_dict(), response_format=request.args.get("format", "json").lower()
+    )
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    """The result of a finished job by itself; the only way to get windowed results."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id"}), 404
+    if job.status != "done":
+        return jsonify({"error": f"Job is {job.status}.", "status": job.status}), 409
+    if job.result_path is not None:
+        return result_file_response(
+            job.result_path, job.result.get("result_id"), job.result.get("cache_hit")
+        )
+    return json_response(
+        job.result, response_format=request.args.get("format", "json").lower()
+    )
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """
+    Withdraw the request named by waiter_id (the waiter_id of its POST /jobs
+    response; by default the one that created the job) from the job. The job
+    is cancelled once no request waits for it; until then it keeps running
+    and the response says for how many other requests.
+    """
+    job, other_waiters = job_manager.cancel(
+        job_id, request.values.get("waiter_id") or None
+    )
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id"}), 404
+    data = job.to_dict()
+    if other_waiters:
+        data["other_waiters"] = other_waiters
+        data["message"] = (
+            f"Not cancelled: {other_waiters} other request(s) still wait for this job."
+        )
+    return jsonify(data), 200
+
+
+@app.route("/detect_language", methods=["POST"])
+def detect_language_endpoint():
+    """
+    Detect the spoken language of the uploaded audio (form upload or raw body)
+    from a short speech probe, without transcribing it. Returns the language,
+    its probability and those of the next most likely languages.
+    """
+    file = None
+    if not is_raw_audio_request():
+        file, error_response = validate_audio_upload()
+        if error_response:
+            return error_response
+
+    model_size = request.values.get("model", "").strip() or MODEL_SIZE
+    if model_size not in ALLOWED_MODELS:
+        return (
+            jsonify(
+                {
+                    "error": f"Model '{model_size}' is not available. Allowed models: {', '.join(ALLOWED_MODELS)}"
+                }
+            ),
+            400,
+        )
+
+    temp_file_path = None
+    try:
+        temp_file_path, audio, audio_hash, filename = receive_audio(
+            file, request.values
+        )
+        cache_key = language_cache_key(audio_hash, model_size)
+        cached = language_cache.get(cache_key) if language_cache else None
+        if cached is not None:
+            cached["cache_hit"] = True
+            return jsonify(cached), 200
+
+        job = Job(
+            temp_file_path,
+            {"model": model_size},
+            kind="detect_language",
+            audio=audio,
+            audio_hash=audio_hash,
+        )
+        try:
+            queued_job, waiter = job_manager.submit(job, cache_key)
+        except queue.Full:
+            return queue_full_response()
+        if queued_job is job:
+            temp_file_path = None  # Removed by the job once it finishes
+        job = queued_job
+
+        if not wait_for_job(job, waiter, filename):
+            return "", 499
+        if job.status != "done":
+            return jsonify({"error": job.error}), job.status_code
+        return jsonify(job.result), 200
+
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error during language detection: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return jsonify({"error": f"Language detection failed: {str(e)}"}), 500
+    finally:
+        remove_temp_file(temp_file_path)
+
+
+@app.route("/transcribe_batch", methods=["POST"])
+def transcribe_batch():
+    """
+    Transcribe several "audio" files of one form upload with shared model
+    passes (see run_batch_pipeline). Takes the /transcribe options, applied
+    to every file, except the time range, splice, windowed, draft_model and
+    stream ones. Returns one result per file in upload order; files with a
+    cached result are not transcribed again.
+    """
+    files = request.files.getlist("audio")
+    if not files:
+        return jsonify({"error": "No audio file part in the request"}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {BATCH_MAX_FILES} files per batch."}), 400
+    for file in files:
+        if file.filename == "" or not allowed_file(file.filename):
+            return jsonify({"error": f"File type not allowed: '{file.filename}'"}), 400
+
+    try:
+        options, cache_options, use_cache = parse_transcription_options(request.values)
+        unsupported = ("start", "end", "splice", "windowed", "draft_model")
+        if any(key in options for key in unsupported):
+            raise PipelineError(
+                f"{', '.join(repr(key) for key in unsupported)} are not supported by /transcribe_batch.",
+                400,
+            )
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+    temp_file_paths = []
+    try:
+        entries = []  # Per file: filename, audio hash, cache key and result
+        clips, languages, pending = [], [], []
+        for file in files:
+            temp_file_path, audio, audio_hash, filename = receive_audio(
+                file, request.values
+            )
+            if temp_file_path is not None:
+                temp_file_paths.append(temp_file_path)
+            cache_key = result_cache_key(audio_hash, cache_options)
+            cached = result_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                print(f"Result cache hit for {filename} ({cache_key[:12]}).")
+                cached["cache_hit"] = True
+                cached["result_id"] = cache_key
+            else:
+                file_options = dict(options)
+                apply_cached_language(file_options, audio_hash)
+                pending.append(len(entries))
+                clips.append(audio if audio is not None else temp_file_path)
+                languages.append(file_options["language"])
+            entries.append((filename, audio_hash, cache_key, cached))
+
+        batches = []
+        if clips:
+            # The job reads the uploaded clips until it finishes, which can be
+            # after this request has returned (client disconnected)
+            clip_paths = [clip for clip in clips if isinstance(clip, str)]
+
+            def remove_clips(job):
+                for clip_path in clip_paths:
+                    remove_temp_file(clip_path)
+
+            job = Job(
+                None,
+                dict(options, languages=languages),
+                kind="batch",
+                audio=clips,
+                on_finish=remove_clips,
+            )
+            try:
+                job, waiter = job_manager.submit(job)
+            except queue.Full:
+                return queue_full_response()
+            # Removed by the job once it finishes
+            temp_file_paths = [p for p in temp_file_paths if p not in clip_paths]
+            if not wait_for_job(job, waiter, f"a batch of {len(files)} files"):
+                return "", 499
+            if job.status != "done":
+                return jsonify({"error": job.error}), job.status_code
+            batches = job.result["batches"]
+            for position, result in zip(pending, job.result["results"]):
+                filename, audio_hash, cache_key, _ = entries[position]
+                detection = result.get("language_detection")
+                if detection is not None and language_cache is not None:
+                    language_cache.put(
+                        language_cache_key(audio_hash, options["model"]), detection
+                    )
+                if use_cache and not has_fallback(result["segments"]):
+                    result_cache.put(cache_key, result)
+                    result["result_id"] = cache_key
+                result["cache_hit"] = False
+                entries[position] = (filename, audio_hash, cache_key, result)
+
+        return json_response(
+            {
+                "files": [
+                    dict(result, filename=filename)
+                    for filename, _, _, result in entries
+                ],
+                "batches": batches,
+            }
+        )
+
+    except PipelineError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error during batch transcription: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return jsonify({"error": f"Batch transcription failed: {str(e)}"}), 500
+    finally:
+        for temp_file_path in temp_file_paths:
+            remove_temp_file(temp_file_path)
+
+
+@app.route("/traces/<name>", methods=["GET"])
+def get_trace(name):
+    """A trace (.json) or cProfile dump (.prof) written for a traced request."""
+    name = secure_filename(name)
+    if not name.endswith((".json", ".prof")) or not os.path.isfile(
+        os.path.join(TRACE_DIR, name)
+    ):
+        return jsonify({"error": "Trace not found."}), 404
+    return send_from_directory(TRACE_DIR, name, as_attachment=name.endswith(".prof"))
+
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    """
+    Liveness: answers as soon as the server runs. "ready" tells whether the
+    default model is loaded; the status is 500 only if loading it failed.
+    """
+    ready = job_manager.is_ready()
+    load_error = job_manager.load_error()
+    data = {
+        "status": "API is running",
+        "ready": ready,
+        "model_loaded": ready,
+        "model_type": "WhisperX",
+        "model_size": MODEL_SIZE,
+        "language_setting": "auto-detect",
+        "models": model_registry.stats(),
+        "result_cache": result_cache.stats() if result_cache else None,
+        "alignment_models": align_model_pool.stats(),
+        "jobs": job_manager.stats(),
+        "split_cache": split_cache.stats() if split_cache else None,
+        "audio_cache": audio_cache.stats() if audio_cache else None,
+        "language_cache": language_cache.stats() if language_cache else None,
+    }
+    if load_error:
+        data["error"] = f"WhisperX Model failed to load: {load_error}"
+        return jsonify(data), 500
+    return jsonify(data), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus metrics: stage latencies, real-time factor, load and cache hit ratios."""
+    job_stats = job_manager.stats()
+    cache_ratios = []
+    for cache in ("results", "splits", "audio", "languages", "alignment_models"):
+        hits = metrics.counter_value(
+            "whisperx_api_cache_lookups_total", cache=cache, result="hit"
+        )
+        misses = metrics.counter_value(
+            "whisperx_api_cache_lookups_total", cache=cache, result="miss"
+        )
+        if hits + misses:
+            cache_ratios.append(({"cache": cache}, round(hits / (hits + misses), 4)))
+    gauges = [
+        (
+            "whisperx_api_in_flight_requests",
+            "Transcriptions admitted and not yet finished (queued or running).",
+            [({}, job_stats["queued"] + job_stats["running"])],
+        ),
+        (
+            "whisperx_api_jobs_running",
+            "Transcriptions currently running on a worker.",
+            [({}, job_stats["running"])],
+        ),
+        (
+            "whisperx_api_job_queue_depth",
+            "Transcriptions waiting for a worker.",
+            [({}, job_stats["queue_depth"])],
+        ),
+        (
+            "whisperx_api_job_queue_capacity",
+            "Maximum number of waiting transcriptions before HTTP 429.",
+            [({}, job_stats["queue_capacity"])],
+        ),
+        (
+            "whisperx_api_cache_hit_ratio",
+            "Share of cache lookups that were hits.",
+            cache_ratios,
+        ),
+        (
+            "whisperx_api_ready",
+            "1 once the default model is loaded.",
+            [({}, int(job_manager.is_ready()))],
+        ),
+    ]
+    return Response(
+        metrics.render(gauges), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.route("/health/ready", methods=["GET"])
+def readiness_check():
+    """Readiness: 200 once the default model is loaded, 503 until then."""
+    ready = job_manager.is_ready()
+    return (
+        jsonify({"ready": ready, "model_size": MODEL_SIZE}),
+        200 if ready else 503,
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Local WhisperX transcription API for the After Effects panel. "
+        "Every option can also be set with the WHISPERX_API_<NAME> environment variable."
+    )
+    parser.add_argument(
+        "--host", default=_env_setting("HOST", "127.0.0.1"), help="Bind address"
+    )
+    parser.add_argument(
+        "--port", type=int, default=_env_setting("PORT", 5000, int), help="Port"
+    )
+    parser.add_argument(
+        "--model", default=MODEL_SIZE, help="Default WhisperX model size"
+    )
+    parser.add_argument(
+        "--allowed-models",
+        default=",".join(ALLOWED_MODELS),
+        help="Comma-separated models requests may select with the 'model' field",
+    )
+    parser.add_argument(
+        "--max-loaded-models",
+        type=int,
+        default=MAX_LOADED_MODELS,
+        help="Maximum number of WhisperX models kept in memory",
+    )
+    parser.add_argument(
+        "--warmup",
+        default=None,
+        help="Comma-separated models to load in the background at startup "
+        "(defaults to the default model; pass an empty string to disable)",
+    )
+    parser.add_argument(
+        "--align-preload",
+        default=",".join(ALIGN_MODEL_PRELOAD_LANGUAGES),
+        help="Comma-separated languages whose alignment models are preloaded",
+    )
+    parser.add_argument(
+        "--align-pool-size",
+        type=int,
+        default=ALIGN_MODEL_POOL_SIZE,
+        help="Maximum number of alignment models kept in memory",
+    )
+    parser.add_argument(
+        "--align-pool-max-bytes",
+        type=int,
+        default=ALIGN_MODEL_POOL_MAX_BYTES,
+        help="Parameter memory budget of the alignment models (0 = no limit)",
+    )
+    parser.add_argument("--device", default=DEVICE, help='"cpu" or "cuda"')
+    parser.add_argument("--compute-type", default=COMPUTE_TYPE)
+    parser.add_argument("--threads", type=int, default=CPU_THREADS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKER_PROCESSES,
+        help="Worker processes, each with its own model (0 runs jobs in threads)",
+    )
+    parser.add_argument(
+        "--worker-threads",
+        type=int,
+        default=None,
+        help="CPU threads per worker process (defaults to --threads)",
+    )
+    parser.add_argument(
+        "--job-workers",
+        type=int,
+        default=JOB_WORKERS,
+        help="Job threads when --workers is 0",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=JOB_QUEUE_SIZE,
+        help="Jobs waiting for a worker before requests get HTTP 429",
+    )
+    parser.add_argument(
+        "--trace-sample-rate",
+        type=float,
+        default=TRACE_SAMPLE_RATE,
+        help="Fraction of /transcribe requests traced as with profile=1",
+    )
+    parser.add_argument(
+        "--llm-split-endpoint",
+        default=LLM_SPLIT_ENDPOINT,
+        help="URL of an HTTP sentence splitter used instead of Gemini",
+    )
+    return parser.parse_args(argv)
+
+
+def apply_args(args):
+    """Apply parsed command line options to the module configuration."""
+    global MODEL_SIZE, ALLOWED_MODELS, WARMUP_MODELS, ALIGN_MODEL_PRELOAD_LANGUAGES
+    global ALIGN_MODEL_POOL_SIZE, ALIGN_MODEL_POOL_MAX_BYTES
+    global DEVICE, COMPUTE_TYPE, CPU_THREADS, BATCH_SIZE, MAX_LOADED_MODELS
+    global JOB_WORKERS, JOB_QUEUE_SIZE, WORKER_PROCESSES, WORKER_THREADS
+    global TRACE_SAMPLE_RATE, LLM_SPLIT_ENDPOINT
+
+    MODEL_SIZE = args.model
+    ALLOWED_MODELS = _csv_list(args.allowed_models)
+    if MODEL_SIZE not in ALLOWED_MODELS:
+        ALLOWED_MODELS.append(MODEL_SIZE)
+    MAX_LOADED_MODELS = max(1, args.max_loaded_models)
+    model_registry.max_models = MAX_LOADED_MODELS
+    if args.warmup is not None:
+        WARMUP_MODELS = _csv_list(args.warmup)
+    elif MODEL_SIZE not in WARMUP_MODELS:
+        WARMUP_MODELS = WARMUP_MODELS + [MODEL_SIZE]
+    ALIGN_MODEL_PRELOAD_LANGUAGES = _csv_list(args.align_preload)
+    ALIGN_MODEL_POOL_SIZE = max(1, args.align_pool_size)
+    ALIGN_MODEL_POOL_MAX_BYTES = max(0, args.align_pool_max_bytes)
+    align_model_pool.max_models = ALIGN_MODEL_POOL_SIZE
+    align_model_pool.max_bytes = ALIGN_MODEL_POOL_MAX_BYTES
+    DEVICE = args.device
+    align_model_pool.device = DEVICE
+    COMPUTE_TYPE = args.compute_type
+    CPU_THREADS = args.threads
+    BATCH_SIZE = args.batch_size
+    JOB_WORKERS = max(1, args.job_workers)
+    WORKER_PROCESSES = max(0, args.workers)
+    WORKER_THREADS = args.worker_threads or CPU_THREADS
+    JOB_QUEUE_SIZE = max(1, args.queue_size)
+    job_manager.configure(JOB_WORKERS, JOB_QUEUE_SIZE, WORKER_PROCESSES)
+    TRACE_SAMPLE_RATE = min(1.0, max(0.0, args.trace_sample_rate))
+    LLM_SPLIT_ENDPOINT = args.llm_split_endpoint or None
+
+
+if __name__ == "__main__":
+    # Needed for worker processes in the PyInstaller build
+    multiprocessing.freeze_support()
+    args = parse_args()
+    apply_args(args)
+
+    if not os.path.exists(UPLOAD_FOLDER):
+        print(
             f"Upload folder '{UPLOAD_FOLDER}' does not exist at startup. Attempting to create it."
         )
         try:
@@ -587,7 +5548,24 @@ if __name__ == "__main__":
                 "The application might not work correctly. Please check permissions or create the folder manually."
             )
             # sys.exit(1)
+    remove_orphaned_uploads()
+    threading.Thread(target=index_caches, name="cache-index", daemon=True).start()
+
+    # Models load in the background; the server accepts requests right away and
+    # /health/ready reports when the default model is available.
+    if WARMUP_MODELS:
+        print(
+            f"Warming up WhisperX model(s) in the background: {', '.join(WARMUP_MODELS)}"
+        )
+    if WORKER_PROCESSES > 0:
+        # Each worker process loads its own models
+        print(
+            f"Starting {WORKER_PROCESSES} transcription worker processes with {WORKER_THREADS} threads each."
+        )
+    else:
+        model_registry.warmup(WARMUP_MODELS, ALIGN_MODEL_PRELOAD_LANGUAGES)
+    job_manager.start()
 
-    print("Starting Flask server on host 127.0.0.1, port 5000")
+    print(f"Starting Flask server on host {args.host}, port {args.port}")
     print(f"Uploads will be temporarily stored in: {UPLOAD_FOLDER}")
-    app.run(host="127.0.0.1", port=5000, debug=False)
+    app.run(host=args.host, port=args.port, debug=False)